@@ -5,8 +5,15 @@ Starts the Telegram bot for video analytics
 """
 import asyncio
 import sys
+import time
+# Первым: таймер запуска создается при импорте src.startup, от этого момента
+# отсчитывается время в отчете о запуске
+from src.startup import startup_timer
+from src.config import settings
 from src.database import init_db
 from src.bot import main
+from src import profiler
+from src.workers import run_workers
 
 
 async def startup():
@@ -15,19 +22,15 @@ async def startup():
     print("VIDEO ANALYTICS BOT - STARTING")
     print("=" * 80)
 
-    try:
-        print("\n[1/2] Initializing database...")
-        await init_db()
-        print("[OK] Database initialized")
-    except Exception as e:
-        print(f"[INFO] Database initialization: {e}")
-        # Continue anyway - tables might already exist
+    # Remember the event loop thread for the sampling profiler (/profile)
+    profiler.install()
 
-    print("\n[2/2] Starting bot...")
-    print("[OK] Bot starting, waiting for messages...")
+    # Schema check, DB pool, LLM client and Telegram session are prepared
+    # in parallel by main(); "Бот запущен..." and a per-phase timing report
+    # are printed once the bot is serving
+    print(f"\nStarting bot... (imports took {time.perf_counter() - startup_timer.started:.2f} s)")
     print("\n" + "=" * 80)
-    print("Bot is now listening for messages on Telegram")
-    print("Send /start to the bot to begin")
+    print("Send /start to the bot once it reports it is running")
     print("Press Ctrl+C to stop")
     print("=" * 80 + "\n")
 
@@ -43,7 +46,31 @@ async def startup():
         sys.exit(1)
 
 
+def launch_workers():
+    """Initialize database once, then fork worker processes behind one webhook ingress"""
+    print("=" * 80)
+    print(f"VIDEO ANALYTICS BOT - STARTING {settings.workers} WORKERS")
+    print("=" * 80)
+
+    # Workers skip the schema check: it is done once here
+    try:
+        print("\n[1/2] Checking database schema...")
+        asyncio.run(init_db())
+        print("[OK] Database schema is up to date")
+    except Exception as e:
+        print(f"[INFO] Database initialization: {e}")
+
+    print(f"\n[2/2] Starting webhook ingress and {settings.workers} workers...")
+    print("Press Ctrl+C to stop")
+    print("=" * 80 + "\n")
+    run_workers(settings.workers)
+
+
 if __name__ == "__main__":
+    if settings.bot_mode == "webhook" and settings.workers > 1:
+        launch_workers()
+        sys.exit(0)
+
     try:
         asyncio.run(startup())
     except KeyboardInterrupt:
@@ -0,0 +1,67 @@
+"""
+Компактный ответ на вопрос о нескольких метриках или с разбивкой по дням.
+
+Такие вопросы считаются одним запросом (llm_engine.build_rows_sql): по
+колонке на метрику и, для ряда, по строке на день. Ответ - одно сообщение:
+значения метрик через «/», для ряда - строка на каждый день периода (дни без
+данных показываются нулями) и итог. Ряд длиннее series_max_days дней
+обрезается - полную таблицу дает выгрузка (intent EXPORT).
+"""
+from datetime import date, timedelta
+from src.config import settings
+from src.llm_engine import metric_list
+
+METRIC_NAMES = {
+    "id": "видео",
+    "views_count": "просмотры",
+    "likes_count": "лайки",
+    "delta_views_count": "прирост просмотров",
+    "delta_likes_count": "прирост лайков",
+    "delta_comments_count": "прирост комментариев",
+}
+
+
+def metric_names(args: dict) -> list:
+    names = [METRIC_NAMES.get(metric, metric) for metric in metric_list(args)]
+    if args["intent"] == "UNIQUE_ACTIVE":
+        # Разные видео, у которых был прирост
+        names = [f"видео ({name})" for name in names]
+    return names
+
+
+def fill_days(args: dict, rows: list) -> list:
+    """Строки ряда на каждый день периода; пропущенные дни - нулями"""
+    if not args.get("date_from") or not args.get("date_to"):
+        return rows
+    by_day = {row[0]: row[1:] for row in rows}
+    zeros = [0] * len(metric_list(args))
+    day, last = date.fromisoformat(args["date_from"]), date.fromisoformat(args["date_to"])
+    filled = []
+    while day <= last:
+        filled.append([day.isoformat(), *by_day.get(day.isoformat(), zeros)])
+        day += timedelta(days=1)
+    return filled
+
+
+def values_text(values) -> str:
+    return " / ".join(str(0 if value is None else value) for value in values)
+
+
+def format_rows(args: dict, rows: list, max_days: int = None, title: str = "📊 Результат:") -> str:
+    """Текст ответа по строкам результата build_rows_sql"""
+    max_days = max_days or settings.series_max_days
+    names = metric_names(args)
+    if args.get("group_by") != "day":
+        values = rows[0] if rows else [None] * len(names)
+        return f"{title}\n" + "\n".join(f"{name}: {values_text([value])}" for name, value in zip(names, values))
+
+    days = fill_days(args, rows)
+    lines = [f"📊 По дням ({' / '.join(names)}):"]
+    lines += [f"{day}: {values_text(values)}" for day, *values in days[:max_days]]
+    if len(days) > max_days:
+        lines.append(f"… еще {len(days) - max_days} дн. - для полной таблицы попросите выгрузку")
+    # Разные видео по дням не складываются: одно видео может расти несколько дней
+    if args["intent"] != "UNIQUE_ACTIVE":
+        totals = [sum(value or 0 for value in column) for column in zip(*(values for _, *values in days))]
+        lines.append(f"Итого: {values_text(totals or [0] * len(names))}")
+    return "\n".join(lines)
@@ -1,10 +1,27 @@
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+import time
+from aiogram import Bot, Dispatcher, Router, types
+from aiogram.filters import Command, CommandObject
 from src.config import settings
-from src.database import init_db, execute_scalar
-from src.llm_engine import get_sql_query
+from src.database import init_db, replicas, warm_pool
+from src.llm_engine import init_client
+from src.speculation import answer
+from src import metrics, profiler
+from src.watchdog import watchdog
+from src.webhook import run_webhook
+from src.sender import Sender
+from src.middlewares import FairnessMiddleware
+from src.pipeline import WorkQueue
+from src.deadline import Deadline, DeadlineExceeded
+from src.digest import digests
+from src.cost_guard import QueryTooExpensive
+from src.export import Export
+from src.answers import format_rows
+from src.querylog import RequestTrace, query_log, top_questions, slowest_shapes, token_usage
+from src.shared_cache import shared_cache
+from src.startup import startup_timer
+from src.warmup import EXAMPLE_QUESTIONS, warmer
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +29,11 @@ logging.basicConfig(level=logging.INFO)
 # Инициализация бота и диспетчера
 bot = Bot(token=settings.bot_token)
 dp = Dispatcher()
+sender = Sender(bot)
+
+# Вопросы к аналитике: квоты, честная очередь и схлопывание дублей
+questions = Router(name="questions")
+questions.message.middleware(FairnessMiddleware(sender))
 
 
 @dp.message(Command("start"))
@@ -20,68 +42,282 @@ async def cmd_start(message: types.Message):
     await message.answer(
         "👋 Привет! Я бот для аналитики видео.\n\n"
         "Задайте мне вопрос о статистике видео, например:\n"
-        "• Сколько всего видео?\n"
-        "• Сколько всего просмотров?\n"
-        "• Сколько лайков прибавилось 28 ноября 2025?\n"
-        "• Сколько комментариев было за 27 ноября 2025?"
+        + "\n".join(f"• {question}" for question in EXAMPLE_QUESTIONS)
+        + ("\n\nЕжедневный дайджест за вчера: /subscribe" if settings.digest_enabled else "")
     )
 
 
-@dp.message()
-async def handle_text_message(message: types.Message):
-    """Обработчик текстовых сообщений"""
+def is_admin(message: types.Message) -> bool:
+    """Проверка, что сообщение от администратора бота"""
+    return message.from_user is not None and message.from_user.id in settings.admin_ids
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message, command: CommandObject):
+    """Служебная команда: /profile [секунды] [collapsed|speedscope]"""
+    if not is_admin(message):
+        return
+
+    args = (command.args or "").split()
     try:
-        # Отправляем сообщение о том, что обрабатываем запрос
-        processing_msg = await message.answer("🔄 Обрабатываю ваш запрос...")
-        
-        # Генерируем SQL запрос с помощью LLM
-        generated_sql = await get_sql_query(message.text)
-        print(f"Сгенерированный SQL: {generated_sql}")
-        
-        # Выполняем SQL запрос
-        result = await execute_scalar(generated_sql)
-        
-        # Удаляем сообщение об обработке
-        await bot.delete_message(
-            chat_id=message.chat.id,
-            message_id=processing_msg.message_id
+        seconds = float(args[0]) if args else 10.0
+    except ValueError:
+        await message.answer("Использование: /profile [секунды] [collapsed|speedscope]")
+        return
+    fmt = args[1] if len(args) > 1 else "collapsed"
+    if fmt not in ("collapsed", "speedscope"):
+        await message.answer("Формат профиля: collapsed или speedscope")
+        return
+
+    if profiler.is_running():
+        await message.answer("⏳ Профилирование уже идет, дождитесь его окончания.")
+        return
+
+    await message.answer(
+        f"🔬 Профилирую {min(seconds, settings.profiler_max_seconds):g} с, процесс {profiler.process_label()}..."
+    )
+    report = await profiler.profile(seconds, fmt)
+    await message.answer_document(
+        types.FSInputFile(report["path"]),
+        caption=(
+            f"Процесс: {report['process']}\n"
+            f"Семплов: {report['samples']}\n"
+            f"Задач asyncio: {report['tasks_before']} → {report['tasks_after']}\n"
+            f"Лаг event loop: ср. {report['lag_avg_ms']:.1f} мс, макс. {report['lag_max_ms']:.1f} мс"
         )
-        
+    )
+
+
+@dp.message(Command("metrics"))
+async def cmd_metrics(message: types.Message):
+    """Служебная команда: метрики процесса в формате Prometheus"""
+    if not is_admin(message):
+        return
+
+    text = metrics.render()
+    if watchdog.blocks:
+        _, stalled, stack = watchdog.blocks[-1]
+        text += f"\n# last blocking call ({stalled * 1000:.0f} ms): {stack[-1] if stack else '?'}\n"
+    await message.answer(f"<pre>{text[-4000:]}</pre>", parse_mode="HTML")
+
+
+@dp.message(Command("querylog"))
+async def cmd_querylog(message: types.Message, command: CommandObject):
+    """Служебная команда: /querylog [дней] - частые вопросы и самые медленные формы SQL"""
+    if not is_admin(message):
+        return
+
+    try:
+        days = int(command.args) if command.args else 7
+    except ValueError:
+        await message.answer("Использование: /querylog [дней]")
+        return
+
+    lines = [f"Частые вопросы за {days} дн. (раз, доля LLM, ср. мс):"]
+    for question, asked, llm_share, avg_ms in await top_questions(10, days):
+        lines.append(f"{asked} | {float(llm_share or 0):.0%} | {float(avg_ms or 0):.0f} | {question[:80]}")
+    lines.append("\nМедленные формы SQL (раз, p95 SQL мс, p95 всего мс):")
+    for template, executed, p95_sql, p95_total in await slowest_shapes(10, days):
+        lines.append(f"{executed} | {float(p95_sql or 0):.0f} | {float(p95_total or 0):.0f} | {template[:120]}")
+    llm_questions, prompt_tokens, completion_tokens, avg_prompt = await token_usage(days)
+    lines.append(f"\nТокены LLM: {llm_questions} вопросов, prompt {int(prompt_tokens or 0)}, "
+                 f"completion {int(completion_tokens or 0)}, prompt на вопрос {float(avg_prompt or 0):.0f}")
+    await message.answer("\n".join(lines)[-4000:])
+
+
+@dp.message(Command("subscribe"))
+async def cmd_subscribe(message: types.Message):
+    """Подписка чата на ежедневный дайджест"""
+    if not settings.digest_enabled:
+        await message.answer("Дайджесты отключены.")
+        return
+    if await digests.subscribe(message.chat.id):
+        await message.answer(
+            f"📬 Подписка оформлена: каждый день в {settings.digest_time} - прирост просмотров, "
+            "лайков и комментариев за вчера.\nОтписаться: /unsubscribe"
+        )
+    else:
+        await message.answer("Этот чат уже подписан на дайджест. Отписаться: /unsubscribe")
+
+
+@dp.message(Command("unsubscribe"))
+async def cmd_unsubscribe(message: types.Message):
+    """Отписка чата от ежедневного дайджеста"""
+    if await digests.unsubscribe(message.chat.id):
+        await message.answer("Подписка на дайджест отменена.")
+    else:
+        await message.answer("Этот чат не подписан на дайджест. Подписаться: /subscribe")
+
+
+BUSY_TEXT = "⏳ Бот сейчас перегружен. Повторите вопрос через минуту."
+
+
+@questions.message()
+async def handle_text_message(message: types.Message):
+    """Обработчик текстовых сообщений: ставит вопрос в очередь"""
+    user_id = message.from_user.id if message.from_user else message.chat.id
+    # Бюджет времени отсчитывается с момента постановки в очередь
+    deadline = Deadline(settings.request_timeout)
+    if not work_queue.submit(user_id, (message, deadline, RequestTrace(message.text))):
+        await sender.send_message(message.chat.id, BUSY_TEXT)
+
+
+async def reply_export(progress, export: Export, trace: RequestTrace):
+    """Отправить выгрузку документом и удалить временный файл"""
+    try:
+        if export.rows:
+            trace.outcome = "ok"
+            await progress.reply_document(types.FSInputFile(export.path, filename=export.filename), export.caption())
+        else:
+            trace.outcome = "empty"
+            await progress.reply("📊 По вашему запросу данных для выгрузки не найдено.")
+    finally:
+        export.remove()
+
+
+async def process_question(job: tuple):
+    """Ответ на вопрос (выполняется воркером очереди)"""
+    message, deadline, trace = job
+    trace.mark("queue", time.perf_counter() - trace.started)
+    # «Печатает...», а если ответ задерживается - сообщение о прогрессе,
+    # которое потом редактируется в ответ
+    progress = sender.progress(message.chat.id)
+    try:
+        async with progress:
+            # Извлекаем параметры с помощью LLM и выполняем SQL запрос;
+            # угаданный заранее запрос выполняется параллельно с LLM
+            result = await answer(message.text, deadline, trace)
+            if isinstance(result, Export):
+                # Выгрузка: строки пачками из курсора во временный файл
+                with trace.stage("sql"):
+                    await result.write()
+
         # Отправляем результат
-        if result is not None:
-            await message.answer(f"📊 Результат: {result}")
+        if isinstance(result, Export):
+            await reply_export(progress, result, trace)
+        elif isinstance(result, list) and result:
+            # Несколько метрик или ряд по дням - одним сообщением
+            trace.outcome = "ok"
+            await progress.reply(format_rows(trace.args, result))
+        elif result is not None and not isinstance(result, list):
+            trace.outcome = "ok"
+            await progress.reply(f"📊 Результат: {result}")
         else:
-            await message.answer("📊 По вашему запросу данных не найдено.")
+            trace.outcome = "empty"
+            await progress.reply("📊 По вашему запросу данных не найдено.")
+            
+    except DeadlineExceeded as e:
+        print(f"Превышено время обработки: {e}")
+        trace.outcome = "deadline"
+        metrics.inc("deadline_exceeded_total")
+        await progress.reply("⏱ Не удалось ответить вовремя. Попробуйте повторить вопрос позже.")
+
+    except QueryTooExpensive as e:
+        # Запрос не выполнялся: подсказываем, как сузить вопрос
+        trace.outcome = "too_expensive"
+        await progress.reply(str(e))
             
     except Exception as e:
         print(f"Ошибка при обработке сообщения: {e}")
-        
-        # Удаляем сообщение об обработке, если оно существует
-        try:
-            await bot.delete_message(
-                chat_id=message.chat.id,
-                message_id=processing_msg.message_id
-            )
-        except:
-            pass
+        trace.outcome = "error"
         
         # Отправляем более информативное сообщение об ошибке
         if "сервис временно перегружен" in str(e).lower():
-            await message.answer("⏳ Сервис временно перегружен. Попробуйте задать вопрос через несколько минут.")
+            await progress.reply("⏳ Сервис временно перегружен. Попробуйте задать вопрос через несколько минут.")
         elif "превышен лимит запросов" in str(e).lower():
-            await message.answer("⚠️ Превышен лимит запросов к модели. Попробуйте позже.")
+            await progress.reply("⚠️ Превышен лимит запросов к модели. Попробуйте позже.")
         else:
-            await message.answer("❌ Не удалось обработать запрос. Попробуйте переформулировать вопрос.")
+            await progress.reply("❌ Не удалось обработать запрос. Попробуйте переформулировать вопрос.")
+
+    finally:
+        # Запись в журнал не ждет БД: только буфер в памяти
+        if settings.query_log_enabled:
+            query_log.record(trace)
+
+
+# Роутер вопросов подключается последним: служебные команды обрабатываются раньше
+dp.include_router(questions)
+
+# Вопросы обрабатывает фиксированное число воркеров, по кругу между пользователями
+work_queue = WorkQueue(process_question, settings.queue_workers, settings.queue_max_size)
+
+
+@dp.startup()
+async def on_startup():
+    work_queue.start()
+    replicas.start()
+    if settings.query_log_enabled:
+        query_log.start()
+    # Общий кэш подключается до прогрева: посчитанное другими процессами не пересчитывается
+    if settings.shared_cache_enabled:
+        async with startup_timer.phase("shared_cache"):
+            await shared_cache.start()
+    # Прогрев кэшей до начала обслуживания (в пределах warmup_budget)
+    if settings.warmup_enabled:
+        async with startup_timer.phase("warmup"):
+            await warmer.start()
+    # Рассылка дайджестов; пропущенные за время простоя досылаются сразу
+    if settings.digest_enabled:
+        digests.start(sender)
+
+
+@dp.shutdown()
+async def on_shutdown():
+    await digests.stop()
+    await warmer.stop()
+    await shared_cache.stop()
+    await replicas.stop()
+    await work_queue.stop()
+    if settings.query_log_enabled:
+        await query_log.stop()
+    # Поток сторожа event loop'а - и в главном процессе, и в воркерах
+    await watchdog.stop()
+
+
+async def prepare(schema: bool = True):
+    """Независимые этапы запуска параллельно: схема БД, пул соединений, клиент LLM, сессия бота.
+
+    schema=False - схему уже проверил главный процесс (несколько воркеров).
+    """
+    phases = {
+        "db_pool": warm_pool(),
+        "llm_client": asyncio.to_thread(init_client),
+        # Первый запрос к Telegram: открывает сессию и проверяет токен
+        "bot_session": bot.get_me(),
+    }
+    if schema:
+        phases["schema"] = init_db()
+    await startup_timer.parallel(**phases)
+
+
+def report_serving():
+    """Сообщение о запуске и время этапов - когда бот уже принимает обновления"""
+    print("Бот запущен...")
+    print(startup_timer.report())
+
+
+async def announce_polling():
+    # Последний обработчик startup: start_polling начинает опрос сразу после них,
+    # отчет печатается на следующем шаге event loop'а
+    asyncio.get_running_loop().call_soon(report_serving)
 
 
 async def main():
     """Главная функция запуска бота"""
-    # Инициализируем базу данных
-    await init_db()
+    startup_timer.mark("imports", time.perf_counter() - startup_timer.started)
+    await prepare()
     
-    # Запускаем бота
-    print("Бот запущен...")
-    await dp.start_polling(bot)
+    # Следим за лагом event loop'а и блокирующими вызовами
+    if settings.loop_watchdog_enabled:
+        watchdog.start()
+    
+    # Запускаем бота; обработчики startup (прогрев, общий кэш) выполняются
+    # внутри, о запуске сообщается после них
+    if settings.bot_mode == "webhook":
+        await run_webhook(dp, bot, on_serving=report_serving)
+    else:
+        dp.startup.register(announce_polling)
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
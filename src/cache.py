@@ -0,0 +1,57 @@
+"""
+Кэш ответов: результат SQL запроса по его тексту.
+
+Ответ зависит только от SQL и загруженных данных, поэтому кэш сбрасывается
+при смене версии данных (таблица data_version, ее увеличивает загрузчик),
+а записи дополнительно живут не дольше answer_cache_ttl секунд.
+"""
+import time
+from collections import OrderedDict
+from src import metrics
+from src.config import settings
+
+# Отличает «нет в кэше» от закэшированного None (данных не найдено)
+MISSING = object()
+
+
+class AnswerCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # SQL -> (время записи, результат), порядок - от давно использованных
+        self.entries = OrderedDict()
+        self.data_version = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, sql: str):
+        item = self.entries.get(sql)
+        if item is None or time.monotonic() - item[0] > self.ttl:
+            if item is not None:
+                del self.entries[sql]
+            metrics.inc("answer_cache_total", outcome="miss")
+            return MISSING
+        self.entries.move_to_end(sql)
+        metrics.inc("answer_cache_total", outcome="hit")
+        return item[1]
+
+    def put(self, sql: str, result):
+        self.entries[sql] = (time.monotonic(), result)
+        self.entries.move_to_end(sql)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        metrics.set_gauge("answer_cache_size", len(self.entries))
+
+    def set_data_version(self, version) -> bool:
+        """Запомнить версию данных; True, если она сменилась и кэш сброшен"""
+        if version == self.data_version:
+            return False
+        if self.data_version is not None:
+            self.entries.clear()
+            metrics.set_gauge("answer_cache_size", 0)
+        self.data_version = version
+        return True
+
+
+answer_cache = AnswerCache(settings.answer_cache_ttl, settings.answer_cache_max_entries)
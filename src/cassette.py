@@ -0,0 +1,181 @@
+"""
+Record/replay cassettes for LLM calls.
+
+Wraps the AsyncOpenAI client so that tests and benchmarks can run offline:
+in record mode every chat completion is forwarded to the real API and the
+request/response pair is saved together with its latency; in replay mode the
+saved responses are served locally, instantly or with the recorded latency.
+
+compare_cassettes() checks a prompt variant against the recorded question set:
+record the same questions once per prompt mode into two cassettes (keys do not
+depend on the system prompt or the schema), then compare extractions and tokens.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay")
+
+
+class CassetteMissError(RuntimeError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def request_key(request: dict) -> str:
+    """Stable key of a chat completion request.
+
+    The system prompt is left out on purpose: it embeds today's date, and
+    a cassette recorded yesterday must still match today's requests.
+    """
+    payload = {
+        "model": request.get("model"),
+        "messages": [m for m in request.get("messages", []) if m.get("role") != "system"],
+        "tools": [t["function"]["name"] for t in request.get("tools") or []],
+        "tool_choice": request.get("tool_choice"),
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class Cassette:
+    """JSON file with recorded request/response pairs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def put(self, key: str, entry: dict):
+        self.entries[key] = entry
+
+    def snapshot(self) -> dict:
+        return {"version": 1, "entries": dict(self.entries)}
+
+    def save(self, data: dict = None):
+        """Write the whole file; data is a snapshot() taken on the event loop if saving in a thread."""
+        data = data or self.snapshot()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class CassetteClient:
+    """Drop-in replacement for the parts of AsyncOpenAI used by llm_engine."""
+
+    def __init__(self, client, cassette: Cassette, mode: str, replay_latency: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.client = client
+        self.cassette = cassette
+        self.mode = mode
+        self.replay_latency = replay_latency
+        # Saves run in a thread one at a time, in the order the responses were recorded
+        self._save_lock = asyncio.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs) -> ChatCompletion:
+        key = request_key(kwargs)
+
+        if self.mode == "replay":
+            entry = self.cassette.get(key)
+            if entry is None:
+                raise CassetteMissError(f"No recorded response for request {key} in {self.cassette.path}")
+            if self.replay_latency:
+                await asyncio.sleep(entry["elapsed"])
+            return ChatCompletion.model_validate(entry["response"])
+
+        if self.client is None:
+            raise RuntimeError("OpenAI client not initialized")
+
+        start = time.perf_counter()
+        response = await self.client.chat.completions.create(**kwargs)
+        elapsed = time.perf_counter() - start
+
+        self.cassette.put(key, {
+            "request": {k: v for k, v in kwargs.items() if k != "tools"},
+            "response": response.model_dump(mode="json"),
+            "elapsed": round(elapsed, 4),
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        })
+        await self._save()
+        logger.info(f"Recorded LLM response {key} ({elapsed:.2f}s)")
+        return response
+
+    async def _save(self):
+        # The whole file is rewritten on every recorded request: keep that off the event loop
+        data = self.cassette.snapshot()
+        async with self._save_lock:
+            await asyncio.to_thread(self.cassette.save, data)
+
+
+def entry_arguments(entry: dict):
+    """Tool call arguments of a recorded response, or None if it has none"""
+    try:
+        call = entry["response"]["choices"][0]["message"]["tool_calls"][0]
+        return json.loads(call["function"]["arguments"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def entry_tokens(entry: dict) -> tuple:
+    usage = entry["response"].get("usage") or {}
+    return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+
+
+def compare_cassettes(reference: Cassette, candidate: Cassette, canonical=None) -> dict:
+    """Agreement of candidate extractions with the reference on shared questions.
+
+    canonical maps arguments to a comparable form (e.g. the built SQL), so
+    that equivalent extractions with different optional fields still match.
+    """
+    canonical = canonical or (lambda args: json.dumps(args, sort_keys=True))
+    report = {"questions": 0, "matched": 0, "mismatches": [], "tokens": {"reference": [0, 0], "candidate": [0, 0]}}
+    for key, entry in reference.entries.items():
+        other = candidate.get(key)
+        if other is None:
+            continue
+        report["questions"] += 1
+        expected, actual = entry_arguments(entry), entry_arguments(other)
+        try:
+            same = expected is not None and actual is not None and canonical(expected) == canonical(actual)
+        except Exception:
+            same = False
+        if same:
+            report["matched"] += 1
+        else:
+            question = entry["request"]["messages"][-1]["content"]
+            report["mismatches"].append((question, expected, actual))
+        for name, item in (("reference", entry), ("candidate", other)):
+            prompt, completion = entry_tokens(item)
+            report["tokens"][name][0] += prompt
+            report["tokens"][name][1] += completion
+    report["accuracy"] = report["matched"] / report["questions"] if report["questions"] else None
+    return report
+
+
+def wrap_client(client, mode: str, path: str, replay_latency: bool = False):
+    """Wrap the client according to the cassette mode ('off' returns it as is)."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    if mode == "off":
+        return client
+    logger.info(f"LLM cassette {mode} mode: {path}")
+    return CassetteClient(client, Cassette(path), mode, replay_latency)
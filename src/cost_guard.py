@@ -0,0 +1,170 @@
+"""
+Оценка стоимости запроса перед выполнением (EXPLAIN).
+
+Извлеченные параметры могут дать запрос, который надолго займет соединение
+пула - например, COUNT(DISTINCT video_id) по всем снимкам без фильтров.
+Перед выполнением запрос оценивается планировщиком (EXPLAIN без ANALYZE:
+стоимость и ожидаемое число строк), и по стоимости выбирается путь:
+
+- fast - обычный путь (реплика или основная БД, шарды);
+- heavy - дороже cost_guard_heavy_cost: выполняется в отдельной полосе не
+  более чем cost_guard_heavy_concurrency запросов одновременно, чтобы
+  тяжелые запросы не занимали весь пул и не задерживали остальных;
+- refuse - дороже cost_guard_max_cost: запрос не выполняется, пользователь
+  получает подсказку, как сузить вопрос (период, креатор).
+
+Оценки кэшируются по шаблону запроса (литералы заменены на ?, см.
+src.querylog) и длине периода: запросы одной формы за сопоставимый период
+стоят примерно одинаково, и EXPLAIN выполняется один раз на cost_guard_plan_ttl.
+Если оценить не удалось (ошибка, таймаут cost_guard_explain_timeout),
+запрос выполняется обычным путем - проверка не должна мешать ответу; неудача
+запоминается на cost_guard_failure_ttl, чтобы, пока EXPLAIN недоступен,
+каждый вопрос не ждал его таймаута заново.
+
+Через проверку проходят все запросы к данным: ответы, прогрев кэша
+(src.warmup) и выгрузки (src.export).
+"""
+import asyncio
+import logging
+import re
+import time
+from datetime import date
+from src import metrics
+from src.config import settings
+from src.database import explain
+from src.deadline import Deadline, NO_DEADLINE
+from src.querylog import sql_template
+
+logger = logging.getLogger(__name__)
+
+DATE_LITERAL_RE = re.compile(r"'(\d{4}-\d{2}-\d{2})'")
+
+
+class QueryTooExpensive(Exception):
+    """Запрос слишком дорогой; текст исключения - подсказка пользователю"""
+
+
+class Plan:
+    __slots__ = ("cost", "rows", "route")
+
+    def __init__(self, cost: float, rows: float, route: str):
+        self.cost = cost
+        self.rows = rows
+        self.route = route
+
+
+def plan_key(sql: str) -> tuple:
+    """Шаблон запроса и порядок длины периода в днях (1, 2-3, 4-7, ...)"""
+    dates = [date.fromisoformat(value) for value in DATE_LITERAL_RE.findall(sql)]
+    span = (max(dates) - min(dates)).days + 1 if dates else 0
+    return sql_template(sql), span.bit_length()
+
+
+def narrowing_hint(args: dict) -> str:
+    """Как сузить вопрос, чтобы запрос стал дешевле"""
+    hints = []
+    if not (args.get("date_exact") or args.get("date_from")):
+        hints.append("укажите период, например «с 1 по 7 ноября 2025»")
+    elif args.get("date_from"):
+        hints.append("сократите период")
+    if not args.get("creator_id"):
+        hints.append("ограничьтесь одним креатором (id)")
+    return ("🐢 Такой запрос слишком тяжелый: он просматривает слишком много данных.\n"
+            "Чтобы получить ответ, " + " или ".join(hints or ["переформулируйте вопрос"]) + ".")
+
+
+class CostGuard:
+    def __init__(self, heavy_cost: float, max_cost: float, heavy_concurrency: int, plan_ttl: float,
+                 failure_ttl: float = 30.0):
+        self.heavy_cost = heavy_cost
+        self.max_cost = max_cost
+        self.plan_ttl = plan_ttl
+        self.failure_ttl = failure_ttl
+        self.heavy = asyncio.Semaphore(heavy_concurrency)
+        # plan_key -> (срок годности, Plan)
+        self.plans = {}
+
+    def route_for(self, cost: float) -> str:
+        if cost > self.max_cost:
+            return "refuse"
+        if cost > self.heavy_cost:
+            return "heavy"
+        return "fast"
+
+    async def plan(self, sql: str, deadline: Deadline = NO_DEADLINE) -> Plan:
+        key = plan_key(sql)
+        item = self.plans.get(key)
+        if item is not None and time.monotonic() < item[0]:
+            metrics.inc("cost_guard_plans_total", outcome="cached")
+            return item[1]
+
+        remaining = deadline.remaining()
+        timeout = settings.cost_guard_explain_timeout
+        start = time.perf_counter()
+        try:
+            top = await explain(sql, Deadline(timeout if remaining is None else min(timeout, remaining)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Без оценки выполняем обычным путем; следующая попытка - через failure_ttl
+            logger.warning(f"EXPLAIN failed, running unguarded: {e}")
+            metrics.inc("cost_guard_plans_total", outcome="error")
+            plan = Plan(None, None, "fast")
+            self.plans[key] = (time.monotonic() + self.failure_ttl, plan)
+            return plan
+        finally:
+            metrics.observe("cost_guard_explain_seconds", time.perf_counter() - start)
+
+        plan = Plan(float(top["Total Cost"]), float(top["Plan Rows"]), self.route_for(float(top["Total Cost"])))
+        self.plans[key] = (time.monotonic() + self.plan_ttl, plan)
+        metrics.inc("cost_guard_plans_total", outcome="explained")
+        metrics.set_gauge("cost_guard_plans", len(self.plans))
+        return plan
+
+    async def run(self, sql: str, execute, args: dict, deadline: Deadline = NO_DEADLINE):
+        """Выполнить execute() (корутинная функция без аргументов) по пути, выбранному оценкой"""
+        plan = await self.plan(sql, deadline)
+        metrics.inc("cost_guard_queries_total", route=plan.route)
+        if plan.route == "refuse":
+            logger.info(f"Query refused (cost {plan.cost:.0f}, rows {plan.rows:.0f}): {sql}")
+            raise QueryTooExpensive(narrowing_hint(args))
+        if plan.route == "fast":
+            return await execute()
+
+        logger.info(f"Heavy query (cost {plan.cost:.0f}, rows {plan.rows:.0f}) queued to the heavy lane")
+        await self._acquire_heavy(deadline)
+        try:
+            return await execute()
+        finally:
+            self.heavy.release()
+
+    async def _acquire_heavy(self, deadline: Deadline):
+        """Место в полосе тяжелых запросов в пределах бюджета.
+
+        wait_for может отменить ожидание уже после того, как место получено, и
+        тогда оно не вернулось бы в семафор: ожидание идет отдельной задачей под
+        shield, а при отмене или исчерпании бюджета полученное место освобождается.
+        """
+        deadline.check("heavy query slot")
+        if not self.heavy.locked():
+            # Свободное место берется сразу, без ожидания - отменять нечего
+            await self.heavy.acquire()
+            return
+        acquire = asyncio.ensure_future(self.heavy.acquire())
+        try:
+            await deadline.run(asyncio.shield(acquire), "heavy query slot")
+        except BaseException:
+            if acquire.done() and not acquire.cancelled() and acquire.exception() is None:
+                self.heavy.release()
+            else:
+                acquire.cancel()
+            raise
+
+
+cost_guard = CostGuard(
+    settings.cost_guard_heavy_cost,
+    settings.cost_guard_max_cost,
+    settings.cost_guard_heavy_concurrency,
+    settings.cost_guard_plan_ttl,
+    settings.cost_guard_failure_ttl
+)
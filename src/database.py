@@ -1,35 +1,52 @@
-import asyncpg
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import json
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
 from src.config import settings
+from src.deadline import Deadline, NO_DEADLINE
+from src.routing import Node, ReplicaRouter, ShardSet, is_additive
 
 
-# Создаем асинхронный движок
-engine = create_async_engine(settings.database_url, echo=True)
-async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Реплики для чтения и шарды video_snapshots (пустые списки - только основная БД).
+# Движки создаются при первом обращении (init_db / warm_pool при запуске), не при импорте
+replicas = ReplicaRouter(
+    Node("primary", settings.database_url, echo=True),
+    [Node(f"replica{i}", url) for i, url in enumerate(settings.db_replicas)],
+    strategy=settings.db_replica_strategy,
+    max_lag=settings.db_replica_max_lag,
+    check_interval=settings.db_replica_check_interval
+)
+shards = ShardSet([Node(f"shard{i}", url) for i, url in enumerate(settings.db_shards)])
+
+
+def get_engine() -> AsyncEngine:
+    """Асинхронный движок основной БД"""
+    return replicas.primary.engine
 
 
 async def get_db_session() -> AsyncSession:
     """Получить сессию базы данных"""
-    async with async_session_maker() as session:
+    async with AsyncSession(get_engine(), expire_on_commit=False) as session:
         yield session
 
 
-async def init_db():
-    """Инициализация базы данных - создание таблиц"""
-    # Создаем подключение к PostgreSQL
-    conn = await asyncpg.connect(
-        user=settings.postgres_user,
-        password=settings.postgres_password,
-        database=settings.postgres_db,
-        host=settings.postgres_host,
-        port=settings.postgres_port
-    )
+# Таблица версии схемы: номер последней примененной миграции (одна строка)
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    id INT PRIMARY KEY CHECK (id = 1),
+    version INT NOT NULL,
+    applied_at TIMESTAMP DEFAULT NOW()
+)
+"""
 
-    try:
-        # SQL DDL для создания таблиц согласно PRD
-        create_videos_table = """
+# Миграции: (версия, описание, команды). Команды выполняются по одной
+# (asyncpg не выполняет несколько команд в одном запросе с параметрами),
+# новые миграции только добавляются в конец. Первая миграция написана через
+# IF NOT EXISTS, поэтому подходит и для баз, созданных до появления версий.
+MIGRATIONS = [
+    (1, "videos, video_snapshots, query_log, data_version, shared_cache", [
+        """
         CREATE TABLE IF NOT EXISTS videos (
             id UUID PRIMARY KEY,
             creator_id UUID,
@@ -40,10 +57,9 @@ async def init_db():
             reports_count BIGINT,
             created_at TIMESTAMP DEFAULT NOW(),
             updated_at TIMESTAMP DEFAULT NOW()
-        );
+        )
+        """,
         """
-
-        create_snapshots_table = """
         CREATE TABLE IF NOT EXISTS video_snapshots (
             id UUID PRIMARY KEY,
             video_id UUID REFERENCES videos(id),
@@ -57,41 +73,224 @@ async def init_db():
             delta_reports_count BIGINT,
             created_at TIMESTAMP,
             updated_at TIMESTAMP
-        );
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_snap_time ON video_snapshots(created_at)",
+        # Журнал вопросов (src/querylog.py)
+        """
+        CREATE TABLE IF NOT EXISTS query_log (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL,
+            question TEXT NOT NULL,
+            args JSONB,
+            sql_template TEXT,
+            path TEXT,
+            outcome TEXT NOT NULL,
+            queue_ms REAL,
+            llm_ms REAL,
+            sql_ms REAL,
+            total_ms REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_query_log_time ON query_log(created_at)",
+        # Версия данных: увеличивается загрузчиком, по ней сбрасывается кэш ответов
         """
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INT PRIMARY KEY CHECK (id = 1),
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        "INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING",
+        # Общий кэш процессов (src/shared_cache.py): UNLOGGED - без записи в WAL,
+        # после сбоя сервера таблица просто окажется пустой
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS shared_cache (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value JSONB NOT NULL,
+            data_version BIGINT,
+            expires_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_shared_cache_expires ON shared_cache(expires_at)",
+    ]),
+    (2, "query_log: LLM tokens per question", [
+        "ALTER TABLE query_log ADD COLUMN IF NOT EXISTS prompt_tokens INT",
+        "ALTER TABLE query_log ADD COLUMN IF NOT EXISTS completion_tokens INT",
+    ]),
+    # Подписки на ежедневный дайджест (src/digest.py): last_sent - последний отправленный день
+    (3, "digest_subscriptions", [
+        """
+        CREATE TABLE IF NOT EXISTS digest_subscriptions (
+            chat_id BIGINT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT NOW(),
+            last_sent DATE
+        )
+        """,
+    ]),
+]
 
-        create_index = """
-        CREATE INDEX IF NOT EXISTS idx_snap_time ON video_snapshots(created_at);
+# video_snapshots на шардах: без внешнего ключа, таблица videos там не хранится
+SHARD_MIGRATIONS = [
+    (1, "video_snapshots", [
         """
+        CREATE TABLE IF NOT EXISTS video_snapshots (
+            id UUID PRIMARY KEY,
+            video_id UUID NOT NULL,
+            views_count BIGINT,
+            likes_count BIGINT,
+            comments_count BIGINT,
+            reports_count BIGINT,
+            delta_views_count BIGINT,
+            delta_likes_count BIGINT,
+            delta_comments_count BIGINT,
+            delta_reports_count BIGINT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_snap_time ON video_snapshots(created_at)",
+    ]),
+]
 
-        # Выполняем SQL по отдельности
-        await conn.execute(create_videos_table)
-        print("[OK] Таблица 'videos' создана")
+SCHEMA_VERSION = MIGRATIONS[-1][0]
 
-        await conn.execute(create_snapshots_table)
-        print("[OK] Таблица 'video_snapshots' создана")
+# Ключ advisory lock: одновременно стартующие процессы не применяют миграции дважды
+MIGRATION_LOCK = 0x76696473
 
-        await conn.execute(create_index)
-        print("[OK] Индекс 'idx_snap_time' создан")
 
-        print("\nБаза данных успешно инициализирована")
+async def read_schema_version(target_engine) -> int:
+    """Версия схемы одним запросом (0 - схема еще не создавалась)"""
+    async with target_engine.connect() as conn:
+        try:
+            return await conn.scalar(text("SELECT version FROM schema_version WHERE id = 1")) or 0
+        except ProgrammingError:
+            return 0
+
+
+async def migrate(target_engine, migrations: list, name: str) -> int:
+    """Применить недостающие миграции; возвращает число примененных"""
+    latest = migrations[-1][0]
+    current = await read_schema_version(target_engine)
+    if current >= latest:
+        print(f"[OK] Схема '{name}' актуальна (версия {current})")
+        return 0
+
+    applied = 0
+    async with target_engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK})
+        await conn.execute(text(SCHEMA_VERSION_DDL))
+        # Пока ждали блокировку, миграции мог применить другой процесс
+        current = await conn.scalar(text("SELECT version FROM schema_version WHERE id = 1")) or 0
+        for version, description, statements in migrations:
+            if version <= current:
+                continue
+            for statement in statements:
+                await conn.execute(text(statement))
+            print(f"[OK] Схема '{name}': миграция {version} ({description})")
+            applied += 1
+        await conn.execute(text("""
+            INSERT INTO schema_version (id, version) VALUES (1, :version)
+            ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, applied_at = NOW()
+        """), {"version": max(current, latest)})
+    return applied
+
+
+async def init_db() -> int:
+    """Инициализация базы данных: проверка версии схемы и недостающие миграции.
 
+    Для актуальной схемы это один запрос на соединении из пула (оно же
+    прогревает пул), на каждом шарде - так же. Возвращает число примененных
+    миграций.
+    """
+    try:
+        applied = await migrate(get_engine(), MIGRATIONS, "primary")
+        for shard in shards.shards:
+            applied += await migrate(shard.engine, SHARD_MIGRATIONS, shard.name)
     except Exception as e:
         print(f"Ошибка при инициализации базы данных: {e}")
         raise
+    if applied:
+        print("\nБаза данных успешно инициализирована")
+    return applied
+
+
+async def warm_pool(size: int = None) -> int:
+    """Открыть соединения пула заранее, чтобы первые вопросы не ждали подключения"""
+    engine = get_engine()
+    size = size or engine.pool.size()
+    results = await asyncio.gather(*(engine.connect() for _ in range(size)), return_exceptions=True)
+    connections = [conn for conn in results if not isinstance(conn, BaseException)]
+    try:
+        for error in results:
+            if isinstance(error, BaseException):
+                raise error
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in connections))
     finally:
-        await conn.close()
+        await asyncio.gather(*(conn.close() for conn in connections))
+    return size
 
 
-async def execute_scalar(query: str) -> any:
-    """Выполнить SQL запрос и вернуть одно значение"""
-    async with engine.connect() as conn:
-        result = await conn.execute(text(query))
-        return result.scalar()
+async def execute_scalar(query: str, deadline: Deadline = NO_DEADLINE) -> any:
+    """Выполнить SQL запрос и вернуть одно значение.
+
+    Агрегаты по video_snapshots при настроенных шардах выполняются на всех
+    шардах, остальные запросы - на реплике или основной БД (src.routing).
+    Ожидание соединения из пула и сам запрос ограничены бюджетом deadline;
+    на сервере запрос ограничивается statement_timeout на остаток бюджета.
+    """
+    if len(shards) and is_additive(query):
+        return await shards.scatter(query, deadline)
+    return await replicas.scalar(query, deadline)
+
+
+async def execute_rows(query: str, deadline: Deadline = NO_DEADLINE, keys: int = 0) -> list:
+    """Выполнить SQL запрос и вернуть все строки списками.
+
+    Для ответов из нескольких агрегатов и рядов по дням; маршрутизация как
+    у execute_scalar. keys - число ключевых колонок (день), по которым
+    складываются строки шардов.
+    """
+    if len(shards) and is_additive(query):
+        return await shards.scatter_rows(query, deadline, keys)
+    return await replicas.rows(query, deadline)
+
+
+async def explain(query: str, deadline: Deadline = NO_DEADLINE) -> dict:
+    """Оценка планировщика для запроса (EXPLAIN без выполнения): верхний узел плана.
+
+    Запрос оценивается там, где будет выполняться: агрегаты по шардам - на
+    первом шарде (шарды выполняют его параллельно), остальное - на реплике
+    или основной БД.
+    """
+    node = shards.shards[0] if len(shards) and is_additive(query) else replicas.pick()
+    raw = await node.scalar(f"EXPLAIN (FORMAT JSON) {query}", deadline)
+    plan = json.loads(raw) if isinstance(raw, str) else raw
+    return plan[0]["Plan"]
+
+
+async def stream_query(query: str, chunk_rows: int, deadline: Deadline = NO_DEADLINE):
+    """Строки запроса пачками по chunk_rows через серверный курсор.
+
+    В памяти одновременно не больше одной пачки, сколько бы строк ни вернул
+    запрос. Выполняется на реплике (если есть) или основной БД; при досрочном
+    выходе из цикла генератор нужно закрыть (contextlib.aclosing), чтобы
+    вернуть соединение в пул.
+    """
+    node = replicas.pick()
+    async with node.engine.connect() as conn:
+        remaining = deadline.remaining()
+        if remaining is not None:
+            await conn.execute(text(f"SET LOCAL statement_timeout = {max(1, int(remaining * 1000))}"))
+        result = await conn.stream(text(query).execution_options(yield_per=chunk_rows))
+        async for rows in result.partitions():
+            yield rows
 
 
 async def execute_query(query: str) -> list:
     """Выполнить SQL запрос и вернуть список результатов"""
-    async with engine.connect() as conn:
+    async with get_engine().connect() as conn:
         result = await conn.execute(text(query))
         return result.fetchall()
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+Бюджет времени на обработку одного вопроса.
+
+Deadline создается, когда вопрос ставится в очередь, и передается через
+все этапы: вызов LLM, паузы между повторами, получение соединения из пула
+и сам SQL запрос (statement_timeout). Когда бюджет исчерпан, текущая
+операция отменяется и бросается DeadlineExceeded.
+"""
+import asyncio
+import time
+from typing import Awaitable, Optional
+
+
+class DeadlineExceeded(RuntimeError):
+    """Бюджет времени на вопрос исчерпан"""
+
+
+class Deadline:
+    def __init__(self, seconds: Optional[float] = None):
+        # None - без ограничения по времени
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> Optional[float]:
+        """Сколько секунд осталось (None - без ограничения)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage: str):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+    async def run(self, awaitable: Awaitable, stage: str):
+        """Дождаться awaitable в пределах бюджета, иначе отменить его"""
+        if self.expired():
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Deadline exceeded during {stage}")
+
+
+# Для вызовов без бюджета
+NO_DEADLINE = Deadline()
@@ -0,0 +1,186 @@
+"""
+Ежедневный дайджест для подписанных чатов (/subscribe, /unsubscribe).
+
+Вопрос «как выросли просмотры и лайки вчера» многие задают каждое утро, и
+каждый раз это вызов LLM и запрос к данным. Дайджест считается без LLM:
+параметры заданы заранее (прирост просмотров, лайков и комментариев за
+день - один запрос из нескольких агрегатов, см. llm_engine.build_rows_sql),
+результат считается один раз на день и берется из кэша ответов, если
+уже посчитан. Готовый текст рассылается всем подписчикам через Sender,
+то есть в пределах лимитов Telegram.
+
+Подписки хранятся в таблице digest_subscriptions вместе с днем последней
+отправки (last_sent). Планировщик раз в digest_check_interval проверяет,
+есть ли подписчики, которым не отправлен дайджест за последний день (после
+digest_time - за вчера). После простоя досылаются пропущенные дни, но не
+больше digest_catchup_days. Подписчики забираются пачками через
+UPDATE ... FOR UPDATE SKIP LOCKED: при нескольких процессах бота каждый
+дайджест отправляет ровно один из них. Отметка ставится до отправки, поэтому
+сообщение, не доставленное из-за ошибки, повторно не отправляется (не больше
+одного раза). Чаты, заблокировавшие бота, отписываются.
+"""
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+from aiogram.exceptions import TelegramForbiddenError
+from sqlalchemy import text
+from src import metrics
+from src.answers import format_rows
+from src.cache import answer_cache
+from src.config import settings
+from src.database import get_engine
+from src.llm_engine import build_sql
+from src.speculation import execute_cached
+
+logger = logging.getLogger(__name__)
+
+DIGEST_METRICS = ["delta_views_count", "delta_likes_count", "delta_comments_count"]
+
+PENDING_SQL = """
+    SELECT EXISTS (SELECT 1 FROM digest_subscriptions WHERE last_sent IS NULL OR last_sent < :day)
+"""
+CLAIM_SQL = """
+    UPDATE digest_subscriptions SET last_sent = :day
+    WHERE chat_id IN (
+        SELECT chat_id FROM digest_subscriptions
+        WHERE last_sent IS NULL OR last_sent < :day
+        ORDER BY chat_id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING chat_id
+"""
+SUBSCRIBE_SQL = """
+    INSERT INTO digest_subscriptions (chat_id, last_sent) VALUES (:chat_id, :last_sent)
+    ON CONFLICT (chat_id) DO NOTHING
+"""
+UNSUBSCRIBE_SQL = "DELETE FROM digest_subscriptions WHERE chat_id = :chat_id"
+
+
+def digest_args(day: date) -> dict:
+    return {
+        "intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots", "metric_field": DIGEST_METRICS[0],
+        "metric_fields": DIGEST_METRICS, "date_exact": day.isoformat()
+    }
+
+
+class DigestScheduler:
+    def __init__(self, send_time: str, catchup_days: int, batch_size: int, check_interval: float):
+        self.send_time = time.fromisoformat(send_time)
+        self.catchup_days = catchup_days
+        self.batch_size = batch_size
+        self.check_interval = check_interval
+        self.sender = None
+        # (версия данных, день) -> готовый текст; считается один раз на процесс и версию данных
+        self.texts = {}
+        self._task = None
+
+    def due_day(self, now: datetime) -> date:
+        """Последний день, дайджест за который уже пора отправить"""
+        return now.date() - timedelta(days=1 if now.time() >= self.send_time else 2)
+
+    async def _execute(self, sql: str, params: dict) -> list:
+        async with get_engine().begin() as conn:
+            result = await conn.execute(text(sql), params)
+            return result.fetchall() if result.returns_rows else []
+
+    async def _pending(self, day: date) -> bool:
+        return bool((await self._execute(PENDING_SQL, {"day": day}))[0][0])
+
+    async def _claim(self, day: date) -> list:
+        """Забрать пачку подписчиков без дайджеста за day (отметка ставится сразу)"""
+        return [row[0] for row in await self._execute(CLAIM_SQL, {"day": day, "limit": self.batch_size})]
+
+    async def subscribe(self, chat_id: int, now: datetime = None) -> bool:
+        """Подписать чат; False - уже подписан. Первый дайджест - за следующий день"""
+        last_sent = self.due_day(now or datetime.now())
+        async with get_engine().begin() as conn:
+            result = await conn.execute(text(SUBSCRIBE_SQL), {"chat_id": chat_id, "last_sent": last_sent})
+            return result.rowcount > 0
+
+    async def unsubscribe(self, chat_id: int) -> bool:
+        async with get_engine().begin() as conn:
+            result = await conn.execute(text(UNSUBSCRIBE_SQL), {"chat_id": chat_id})
+            return result.rowcount > 0
+
+    async def compute(self, day: date) -> str:
+        """Текст дайджеста за день: один запрос без LLM, результат через кэш ответов.
+
+        Текст привязан к версии данных (answer_cache.data_version): после
+        перезагрузки данных он считается заново, как и ответы в кэше.
+        """
+        version = answer_cache.data_version
+        key = (version, day)
+        if key not in self.texts:
+            args = digest_args(day)
+            rows = await execute_cached(args, build_sql(args))
+            self.texts = {
+                (v, d): t for (v, d), t in self.texts.items()
+                if v == version and d > day - timedelta(days=self.catchup_days)
+            }
+            self.texts[key] = format_rows(args, rows, title=f"📬 Дайджест за {day.strftime('%d.%m.%Y')}:")
+            metrics.inc("digest_computed_total")
+        return self.texts[key]
+
+    async def _send(self, chat_id: int, message: str) -> bool:
+        try:
+            await self.sender.send_message(chat_id, message)
+            return True
+        except TelegramForbiddenError:
+            # Бот заблокирован или удален из чата - рассылать больше некуда
+            logger.info(f"Chat {chat_id} blocked the bot, unsubscribing from digests")
+            await self.unsubscribe(chat_id)
+        except Exception as e:
+            logger.warning(f"Digest to chat {chat_id} failed: {e}")
+        return False
+
+    async def run_due(self, now: datetime = None) -> dict:
+        """Разослать все причитающиеся дайджесты, начиная с самого старого пропущенного дня"""
+        due = self.due_day(now or datetime.now())
+        report = {"days": 0, "sent": 0, "failed": 0}
+        for offset in range(self.catchup_days - 1, -1, -1):
+            day = due - timedelta(days=offset)
+            if not await self._pending(day):
+                continue
+            message = await self.compute(day)
+            report["days"] += 1
+            while True:
+                chat_ids = await self._claim(day)
+                if not chat_ids:
+                    break
+                results = await asyncio.gather(*(self._send(chat_id, message) for chat_id in chat_ids))
+                report["sent"] += sum(results)
+                report["failed"] += len(results) - sum(results)
+        if report["days"]:
+            metrics.inc("digest_messages_total", report["sent"], outcome="sent")
+            metrics.inc("digest_messages_total", report["failed"], outcome="failed")
+            logger.info(f"Digests sent: {report}")
+        return report
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_due()
+            except Exception as e:
+                logger.warning(f"Digest run failed: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    def start(self, sender):
+        """Запустить планировщик; первый прогон сразу досылает пропущенное за время простоя"""
+        self.sender = sender
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+digests = DigestScheduler(
+    settings.digest_time,
+    settings.digest_catchup_days,
+    settings.digest_batch_size,
+    settings.digest_check_interval
+)
@@ -0,0 +1,138 @@
+"""
+Выгрузка разбивок (intent EXPORT) в CSV-файл.
+
+Строки читаются серверным курсором пачками по export_chunk_rows
+(database.stream_query), каждая пачка сразу кодируется в CSV и дописывается
+во временный файл - в памяти не больше одной пачки, сколько бы строк ни
+вернул запрос. Выгрузка обрезается на export_max_rows строках или
+export_max_bytes байтах (боты могут отправлять документы до 50 МБ),
+а время ограничено export_timeout. Перед чтением запрос проходит оценку
+стоимости (src.cost_guard): тяжелая выгрузка ждет места в полосе тяжелых
+запросов, слишком дорогая не выполняется. Готовый файл отправляется
+документом и удаляется.
+"""
+import asyncio
+import codecs
+import csv
+import io
+import logging
+import os
+import tempfile
+import time
+from contextlib import aclosing
+from src import metrics
+from src.config import settings
+from src.cost_guard import cost_guard
+from src.database import stream_query
+from src.deadline import Deadline, DeadlineExceeded
+from src.llm_engine import metric_list
+
+logger = logging.getLogger(__name__)
+
+# BOM: Excel тогда открывает UTF-8 CSV с кириллицей корректно
+BOM = codecs.BOM_UTF8
+
+
+def encode_rows(rows) -> list:
+    """Строки CSV в байтах, по одной на строку результата"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    lines = []
+    for row in rows:
+        writer.writerow(row)
+        lines.append(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+    return lines
+
+
+class Export:
+    """Результат answer() для EXPORT: SQL выгрузки и, после write(), файл"""
+
+    def __init__(self, sql: str, args: dict):
+        self.sql = sql
+        self.args = args
+        self.path = None
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = False
+        self.limits = (settings.export_max_rows, settings.export_max_bytes)
+
+    @property
+    def filename(self) -> str:
+        parts = ["-".join(metric_list(self.args)), "by", self.args["group_by"]]
+        if self.args.get("date_exact"):
+            parts.append(self.args["date_exact"])
+        elif self.args.get("date_from"):
+            parts += [self.args["date_from"], self.args["date_to"]]
+        return "_".join(parts) + ".csv"
+
+    async def write(self, max_rows: int = None, max_bytes: int = None, chunk_rows: int = None,
+                    deadline: Deadline = None):
+        """Записать результат во временный файл пачками из курсора"""
+        max_rows = max_rows or settings.export_max_rows
+        max_bytes = max_bytes or settings.export_max_bytes
+        chunk_rows = chunk_rows or settings.export_chunk_rows
+        self.limits = (max_rows, max_bytes)
+        deadline = deadline or Deadline(settings.export_timeout)
+        if settings.cost_guard_enabled:
+            await cost_guard.run(self.sql, lambda: self._write(max_rows, max_bytes, chunk_rows, deadline),
+                                 self.args, deadline)
+        else:
+            await self._write(max_rows, max_bytes, chunk_rows, deadline)
+
+    async def _write(self, max_rows: int, max_bytes: int, chunk_rows: int, deadline: Deadline):
+        start = time.perf_counter()
+        fd, self.path = tempfile.mkstemp(prefix="export_", suffix=".csv")
+        file = os.fdopen(fd, "wb")
+        try:
+            async with aclosing(stream_query(self.sql, chunk_rows, deadline)) as chunks:
+                async for rows in chunks:
+                    if deadline.expired():
+                        raise DeadlineExceeded("Deadline exceeded while exporting")
+                    # Лимит строк уже набран, а строки еще есть
+                    if self.rows >= max_rows:
+                        self.truncated = True
+                        break
+                    data = []
+                    if not self.bytes:
+                        header = BOM + encode_rows([rows[0]._fields])[0]
+                        data.append(header)
+                        self.bytes += len(header)
+                    taken = rows[:max_rows - self.rows]
+                    self.truncated = len(taken) < len(rows)
+                    written = 0
+                    for line in encode_rows(taken):
+                        if self.bytes + len(line) > max_bytes:
+                            self.truncated = True
+                            break
+                        data.append(line)
+                        self.bytes += len(line)
+                        written += 1
+                    await asyncio.to_thread(file.write, b"".join(data))
+                    self.rows += written
+                    metrics.inc("export_rows_total", written)
+                    if self.truncated:
+                        break
+        except BaseException:
+            file.close()
+            self.remove()
+            raise
+        file.close()
+
+        metrics.inc("exports_total", outcome="truncated" if self.truncated else "ok")
+        metrics.observe("export_seconds", time.perf_counter() - start)
+        logger.info(f"Export {self.filename}: {self.rows} rows, {self.bytes} bytes"
+                    + (" (truncated)" if self.truncated else ""))
+
+    def caption(self) -> str:
+        text = f"📎 Выгрузка: {self.rows} строк"
+        if self.truncated:
+            max_rows, max_bytes = self.limits
+            text += f"\n⚠️ Обрезано по лимиту ({max_rows} строк / {max_bytes / 2 ** 20:g} МБ) - сузьте период"
+        return text
+
+    def remove(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
@@ -1,26 +1,57 @@
 import os
+import re
 import json
+import time
+import asyncio
 import logging
-from datetime import datetime
-from openai import AsyncOpenAI
+from datetime import date, datetime
+from typing import Optional
+from src import metrics
 from src.config import settings
+from src.deadline import Deadline, DeadlineExceeded, NO_DEADLINE
+from src.similarity import SimilarityIndex
+from src.shared_cache import shared_cache
 
 # Configure Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Config
-try:
-    client = AsyncOpenAI(
-        api_key=settings.openai_api_key,
-        base_url=settings.openai_base_url
+# Created on first use or by init_client() at startup, in parallel with the
+# other startup work: importing openai and building the endpoint pool takes
+# about half a second, so it is not done as an import side effect.
+client = None
+
+
+def init_client():
+    """Create the LLM client once; returns None if it cannot be created"""
+    global client
+    if client is not None:
+        return client
+    from src.cassette import wrap_client
+    from src.llm_pool import EndpointPool
+
+    try:
+        # One or more endpoints with hedging, failover and circuit breakers
+        pool = EndpointPool.from_settings()
+        logger.info(f"AsyncOpenAI client initialized successfully ({len(pool.endpoints)} endpoint(s))")
+    except Exception as e:
+        logger.error(f"Failed to initialize AsyncOpenAI: {e}")
+        import traceback
+        traceback.print_exc()
+        pool = None
+
+    # Record/replay layer for tests and benchmarks (no-op when mode is 'off')
+    client = wrap_client(
+        pool,
+        settings.llm_cassette_mode,
+        settings.llm_cassette_path,
+        settings.llm_cassette_latency
     )
-    logger.info("AsyncOpenAI client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize AsyncOpenAI: {e}")
-    import traceback
-    traceback.print_exc()
-    client = None
+    return client
+
+
+# Validated extractions of past questions, reused for close rephrasings
+similar_questions = SimilarityIndex(settings.similarity_threshold, settings.similarity_max_entries)
 
 # --- TOOL DEFINITION (The Router) ---
 TOOLS = [
@@ -34,8 +65,13 @@ TOOLS = [
                 "properties": {
                     "intent": {
                         "type": "string",
-                        "enum": ["TOTAL_STATIC", "GROWTH_DYNAMIC", "UNIQUE_ACTIVE"],
-                        "description": "TOTAL_STATIC for 'How many videos total'. GROWTH_DYNAMIC for 'How many views added/grew'. UNIQUE_ACTIVE for 'How many DIFFERENT videos got views'."
+                        "enum": ["TOTAL_STATIC", "GROWTH_DYNAMIC", "UNIQUE_ACTIVE", "EXPORT"],
+                        "description": "TOTAL_STATIC for 'How many videos total'. GROWTH_DYNAMIC for 'How many views added/grew'. UNIQUE_ACTIVE for 'How many DIFFERENT videos got views'. EXPORT for 'Export/download a breakdown as a file'."
+                    },
+                    "group_by": {
+                        "type": "string",
+                        "enum": ["day", "video"],
+                        "description": "EXPORT: one row per day or one row per video. Other intents: 'day' for a per-day series in the reply."
                     },
                     "target_table": {
                         "type": "string",
@@ -47,6 +83,14 @@ TOOLS = [
                         "enum": ["id", "views_count", "likes_count", "delta_views_count", "delta_likes_count", "delta_comments_count"],
                         "description": "The database column to measure. For growth, use delta_*."
                     },
+                    "metric_fields": {
+                        "type": "array",
+                        "items": {
+                            "type": "string",
+                            "enum": ["id", "views_count", "likes_count", "delta_views_count", "delta_likes_count", "delta_comments_count"]
+                        },
+                        "description": "All columns when the question asks about several metrics at once; metric_field is the first of them."
+                    },
                     "date_exact": {
                         "type": "string",
                         "format": "date",
@@ -73,14 +117,60 @@ TOOLS = [
     }
 ]
 
-async def get_sql_query(user_text: str) -> str:
-    """Generate SQL query using Function Calling approach"""
-    if client is None:
-        raise RuntimeError("OpenAI client not initialized")
+METRIC_ENUM = TOOLS[0]["function"]["parameters"]["properties"]["metric_field"]["enum"]
+
+# Compact mode (llm_prompt_mode=compact): the same parameters and enums with terse
+# descriptions, sent together with build_compact_prompt(). Kept separate from TOOLS,
+# which stays the reference schema for validate_args.
+COMPACT_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "build_sql_query",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "intent": {"type": "string", "enum": ["TOTAL_STATIC", "GROWTH_DYNAMIC", "UNIQUE_ACTIVE", "EXPORT"]},
+                    "group_by": {"type": "string", "enum": ["day", "video"]},
+                    "target_table": {"type": "string", "enum": ["videos", "video_snapshots"]},
+                    "metric_field": {"type": "string", "enum": METRIC_ENUM},
+                    "metric_fields": {"type": "array", "items": {"type": "string", "enum": METRIC_ENUM}},
+                    "date_exact": {"type": "string", "format": "date"},
+                    "date_from": {"type": "string", "format": "date"},
+                    "date_to": {"type": "string", "format": "date"},
+                    "creator_id": {"type": "string"}
+                },
+                "required": ["intent", "target_table", "metric_field"]
+            }
+        }
+    }
+]
+
+# Consistency rules between intent, table and metric
+DELTA_FIELDS = {"delta_views_count", "delta_likes_count", "delta_comments_count"}
+UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$")
+# Signals in the question that the extraction must reflect
+DATE_HINT_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}|\b\d{1,2}\s+(январ|феврал|март|апрел|ма[яй]|июн|июл|август|сентябр|октябр|ноябр|декабр)",
+    re.IGNORECASE
+)
+CREATOR_HINT_RE = re.compile(r"\b[0-9a-fA-F]{32}\b|\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-")
+
 
+def metric_list(args: dict) -> list:
+    """Requested metrics in order: metric_field first, then the rest of metric_fields"""
+    return list(dict.fromkeys([args["metric_field"], *(args.get("metric_fields") or [])]))
+
+
+def returns_rows(args: dict) -> bool:
+    """Several metrics or a per-day series: answered with rows from one query, not a scalar"""
+    return args["intent"] != "EXPORT" and (args.get("group_by") == "day" or len(metric_list(args)) > 1)
+
+
+def build_system_prompt() -> str:
     today_str = datetime.now().strftime("%Y-%m-%d")
 
-    system_prompt = f"""You are a parameter extractor for video analytics. Today is {today_str}.
+    return f"""You are a parameter extractor for video analytics. Today is {today_str}.
 Map user questions to the 'build_sql_query' function.
 
 RULES:
@@ -89,71 +179,384 @@ RULES:
 3. 'Сколько РАЗНЫХ видео смотрели?' -> intent='UNIQUE_ACTIVE', table='video_snapshots', field='delta_views_count'
 4. For dates like '28 ноября', extract '{today_str.split("-")[0]}-11-28'.
 5. Always provide intent, target_table, and metric_field.
+6. 'Выгрузи прирост просмотров по дням за ноябрь' -> intent='EXPORT', group_by='day', table='video_snapshots', field='delta_views_count', date_from/date_to for the month
+7. 'Выгрузи видео креатора с просмотрами' -> intent='EXPORT', group_by='video', table='videos', field='views_count'
+8. 'На сколько выросли просмотры и лайки за неделю?' -> intent='GROWTH_DYNAMIC', table='video_snapshots', field='delta_views_count', metric_fields=['delta_views_count', 'delta_likes_count']
+9. 'Прирост просмотров по дням за неделю' -> intent='GROWTH_DYNAMIC', group_by='day', table='video_snapshots', field='delta_views_count', date_from/date_to
 """
 
+
+def build_compact_prompt() -> str:
+    """Short rule set for compact mode: one line per intent, dates as YYYY-MM-DD"""
+    today_str = datetime.now().strftime("%Y-%m-%d")
+
+    return f"""Extract build_sql_query args. Today {today_str}; dates YYYY-MM-DD, default year {today_str[:4]}.
+TOTAL_STATIC+videos: totals (id=count, views_count, likes_count)
+GROWTH_DYNAMIC+video_snapshots+delta_*: growth
+UNIQUE_ACTIVE+video_snapshots+delta_*: count of different videos with growth
+EXPORT+group_by: file export
+Several metrics: metric_fields. Per day: group_by=day + date_from/date_to.
+"""
+
+
+def prompt_and_tools() -> tuple:
+    """System prompt and tool schema for the configured llm_prompt_mode"""
+    if settings.llm_prompt_mode == "compact":
+        return build_compact_prompt(), COMPACT_TOOLS
+    return build_system_prompt(), TOOLS
+
+
+def record_usage(response, tier: str, trace=None):
+    """Count prompt/completion tokens of one response, per process and per request"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for kind, tokens in (("prompt", usage.prompt_tokens), ("completion", usage.completion_tokens)):
+        metrics.inc("llm_tokens_total", tokens or 0, kind=kind, tier=tier, mode=settings.llm_prompt_mode)
+        metrics.observe("llm_request_tokens", tokens or 0, kind=kind, mode=settings.llm_prompt_mode)
+    if trace is not None:
+        trace.prompt_tokens = (trace.prompt_tokens or 0) + (usage.prompt_tokens or 0)
+        trace.completion_tokens = (trace.completion_tokens or 0) + (usage.completion_tokens or 0)
+
+
+def schema_problems(args: dict) -> list:
+    """Fields outside the TOOLS schema: missing, unknown or not one of the enum values"""
+    problems = []
+    schema = TOOLS[0]["function"]["parameters"]
+
+    for field in schema["required"]:
+        if not args.get(field):
+            problems.append(f"missing {field}")
+    for field, value in args.items():
+        spec = schema["properties"].get(field)
+        if spec is None:
+            problems.append(f"unknown field {field}")
+        elif "enum" in spec and value not in spec["enum"]:
+            problems.append(f"invalid {field}={value}")
+        elif "items" in spec and (not isinstance(value, list) or any(item not in spec["items"]["enum"] for item in value)):
+            problems.append(f"invalid {field}={value}")
+    return problems
+
+
+def parse_date(value) -> Optional[date]:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def literal_problems(args: dict) -> list:
+    """Dates and creator id that would be put into the SQL text but are not well-formed"""
+    problems = []
+    for field in ("date_exact", "date_from", "date_to"):
+        if args.get(field) and parse_date(args[field]) is None:
+            problems.append(f"invalid {field}={args[field]}")
+    if args.get("creator_id") and not (isinstance(args["creator_id"], str) and UUID_RE.match(args["creator_id"])):
+        problems.append(f"invalid creator_id={args['creator_id']}")
+    return problems
+
+
+def validate_args(args: dict, user_text: str = "") -> list:
+    """Check extracted arguments against the TOOLS schema and consistency rules.
+
+    Returns a list of problems; an empty list means the extraction can be trusted.
+    """
+    problems = schema_problems(args)
+    if problems:
+        return problems
+
+    intent, table = args["intent"], args["target_table"]
+    if intent in ("GROWTH_DYNAMIC", "UNIQUE_ACTIVE") and table != "video_snapshots":
+        problems.append(f"{intent} requires video_snapshots")
+    for metric in metric_list(args):
+        if intent in ("GROWTH_DYNAMIC", "UNIQUE_ACTIVE"):
+            if metric not in DELTA_FIELDS:
+                problems.append(f"{intent} requires a delta_* metric, got {metric}")
+        elif table == "videos" and metric in DELTA_FIELDS:
+            problems.append(f"videos has no {metric} column")
+        if intent == "EXPORT" and table == "video_snapshots" and metric not in DELTA_FIELDS:
+            problems.append("video_snapshots exports need a delta_* metric")
+    if intent == "EXPORT" and not args.get("group_by"):
+        problems.append("EXPORT requires group_by")
+    if intent != "EXPORT" and args.get("group_by") == "video":
+        problems.append("group_by=video goes with EXPORT only")
+    if returns_rows(args) and args.get("group_by") == "day" and not args.get("date_from"):
+        problems.append("a per-day series needs date_from and date_to")
+
+    problems.extend(literal_problems(args))
+    dates = {}
+    for field in ("date_exact", "date_from", "date_to"):
+        if args.get(field) and parse_date(args[field]) is not None:
+            dates[field] = parse_date(args[field])
+    if bool(args.get("date_from")) != bool(args.get("date_to")):
+        problems.append("date range needs both date_from and date_to")
+    if "date_from" in dates and "date_to" in dates and dates["date_from"] > dates["date_to"]:
+        problems.append("date_from is after date_to")
+
+    # Low confidence: the question mentions a date or a creator the extraction missed
+    if user_text:
+        if DATE_HINT_RE.search(user_text) and not dates:
+            problems.append("question mentions a date but none was extracted")
+        if CREATOR_HINT_RE.search(user_text) and not args.get("creator_id"):
+            problems.append("question mentions a creator but none was extracted")
+
+    return problems
+
+
+def build_sql(args: dict) -> str:
+    """Python SQL Construction Step (Safe & Valid)
+
+    Column and table names come from the enums and dates/creator id are checked
+    for their format: arguments that fail these checks are refused with
+    ValueError, even when the rest of the extraction was only untrusted.
+    """
+    problems = schema_problems(args) or literal_problems(args)
+    if problems:
+        raise ValueError(f"Cannot build SQL from the extraction: {'; '.join(problems)}")
+
+    sql = ""
+    conditions = []
+
+    # Date Logic
+    date_col = "video_created_at" if args['target_table'] == "videos" else "created_at"
+
+    if args.get('date_exact'):
+        conditions.append(f"{date_col}::DATE = '{args['date_exact']}'")
+    elif args.get('date_from') and args.get('date_to'):
+        conditions.append(f"{date_col}::DATE >= '{args['date_from']}' AND {date_col}::DATE <= '{args['date_to']}'")
+
+    # Creator Logic
+    if args.get('creator_id'):
+        if args['intent'] == 'EXPORT' and args['target_table'] == 'video_snapshots':
+            # Snapshots have no creator_id: take the creator's videos from videos
+            conditions.append(f"video_id IN (SELECT id FROM videos WHERE creator_id = '{args['creator_id']}')")
+        else:
+            conditions.append(f"creator_id = '{args['creator_id']}'")
+
+    where_str = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    if args['intent'] == 'EXPORT':
+        return build_export_sql(args, date_col, where_str)
+    if returns_rows(args):
+        return build_rows_sql(args, date_col, where_str)
+
+    # Query Assembly
+    if args['intent'] == 'TOTAL_STATIC':
+        # "Сколько видео..." -> COUNT(id)
+        # "Сколько просмотров..." -> SUM(views_count)
+        agg = "COUNT" if args['metric_field'] == 'id' else "SUM"
+        sql = f"SELECT {agg}({args['metric_field']}) FROM {args['target_table']}{where_str}"
+
+    elif args['intent'] == 'GROWTH_DYNAMIC':
+        # "На сколько выросли..." -> SUM(delta_*)
+        sql = f"SELECT COALESCE(SUM({args['metric_field']}), 0) FROM {args['target_table']}{where_str}"
+
+    elif args['intent'] == 'UNIQUE_ACTIVE':
+        # "Сколько разных видео..." -> COUNT(DISTINCT video_id) WHERE delta > 0
+        if where_str:
+            where_str += f" AND {args['metric_field']} > 0"
+        else:
+            where_str = f" WHERE {args['metric_field']} > 0"
+
+        sql = f"SELECT COUNT(DISTINCT video_id) FROM {args['target_table']}{where_str}"
+
+    return sql
+
+
+def aggregate(intent: str, metric: str) -> str:
+    """One metric as an aggregate; UNIQUE_ACTIVE filters per column so several fit one scan"""
+    if intent == 'TOTAL_STATIC':
+        return "COUNT(id)" if metric == 'id' else f"SUM({metric})"
+    if intent == 'GROWTH_DYNAMIC':
+        return f"COALESCE(SUM({metric}), 0)"
+    return f"COUNT(DISTINCT video_id) FILTER (WHERE {metric} > 0)"
+
+
+def build_rows_sql(args: dict, date_col: str, where_str: str) -> str:
+    """Several metrics and/or a per-day series computed in a single scan"""
+    columns = ", ".join(f"{aggregate(args['intent'], metric)} AS {metric}" for metric in metric_list(args))
+    if args.get('group_by') == 'day':
+        return (f"SELECT to_char(date_trunc('day', {date_col}), 'YYYY-MM-DD') AS day, {columns} "
+                f"FROM {args['target_table']}{where_str} GROUP BY 1 ORDER BY 1")
+    return f"SELECT {columns} FROM {args['target_table']}{where_str}"
+
+
+def build_export_sql(args: dict, date_col: str, where_str: str) -> str:
+    """Breakdown for EXPORT: one row per day or per video"""
+    table, fields = args['target_table'], metric_list(args)
+    if table == 'videos':
+        values = ", ".join(f"{aggregate('TOTAL_STATIC', metric)} AS {metric}" for metric in fields)
+        if args['group_by'] == 'day':
+            return (f"SELECT {date_col}::DATE AS day, {values} "
+                    f"FROM videos{where_str} GROUP BY 1 ORDER BY 1")
+        columns = ", ".join(["id AS video_id, creator_id, video_created_at"] + [metric for metric in fields if metric != 'id'])
+        return f"SELECT {columns} FROM videos{where_str} ORDER BY video_created_at, id"
+
+    key = f"{date_col}::DATE AS day" if args['group_by'] == 'day' else "video_id"
+    values = ", ".join(f"SUM({metric}) AS {metric}" for metric in fields)
+    return (f"SELECT {key}, {values} "
+            f"FROM video_snapshots{where_str} GROUP BY 1 ORDER BY 1")
+
+
+async def call_llm(user_text: str, model: str, deadline: Deadline, trace=None) -> dict:
+    """One LLM Extraction Step; model=None lets the pool use each endpoint's model"""
+    system_prompt, tools = prompt_and_tools()
+    request = dict(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_text}
+        ],
+        tools=tools,
+        tool_choice={"type": "function", "function": {"name": "build_sql_query"}},
+        temperature=0
+    )
+    if model:
+        request["model"] = model
+    if deadline.remaining() is not None:
+        request["timeout"] = deadline.remaining()
+    response = await deadline.run(client.chat.completions.create(**request), "LLM call")
+    record_usage(response, "small" if model else "large", trace)
+
+    tool_call = response.choices[0].message.tool_calls[0]
+    args = json.loads(tool_call.function.arguments)
+    logger.info(f"Extracted Params: {args}")
+    return args
+
+
+async def extract_with_small_model(user_text: str, deadline: Deadline, trace=None):
+    """Cascade tier 1: the small model; None means escalate to the large model"""
+    start = time.perf_counter()
+    try:
+        args = await call_llm(user_text, settings.llm_small_model, deadline, trace)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Small model failed, escalating: {e}")
+        metrics.inc("llm_cascade_total", tier="small", outcome="error")
+        return None
+    finally:
+        metrics.observe("llm_tier_latency_seconds", time.perf_counter() - start, tier="small")
+
+    problems = validate_args(args, user_text)
+    if problems:
+        logger.info(f"Small model extraction rejected ({'; '.join(problems)}), escalating")
+        metrics.inc("llm_cascade_total", tier="small", outcome="escalated")
+        return None
+
+    metrics.inc("llm_cascade_total", tier="small", outcome="accepted")
+    return args
+
+
+def lookup_similar(user_text: str):
+    """Arguments of a known close question with the dates re-filled, or None"""
+    start = time.perf_counter()
+    found = similar_questions.lookup(user_text)
+    metrics.observe("similarity_lookup_seconds", time.perf_counter() - start)
+    if found is None:
+        metrics.inc("similarity_lookups_total", outcome="miss")
+        return None
+
+    args, score = found
+    problems = validate_args(args, user_text)
+    if problems:
+        logger.info(f"Similar question rejected ({'; '.join(problems)})")
+        metrics.inc("similarity_lookups_total", outcome="rejected")
+        return None
+
+    logger.info(f"Reused extraction of a similar question (score {score:.2f}): {args}")
+    metrics.inc("similarity_lookups_total", outcome="hit")
+    return args
+
+
+async def lookup_shared(user_text: str):
+    """Arguments another process extracted for the same question template, or None"""
+    args = await shared_cache.get_args(user_text)
+    if args is None:
+        return None
+    problems = validate_args(args, user_text)
+    if problems:
+        logger.info(f"Shared extraction rejected ({'; '.join(problems)})")
+        return None
+    return args
+
+
+def remember(user_text: str, args: dict):
+    if similar_questions.add(user_text, args):
+        metrics.set_gauge("similarity_index_size", len(similar_questions))
+
+
+async def extract_params(user_text: str, deadline: Deadline = NO_DEADLINE, lookup: bool = True, trace=None) -> dict:
+    """Extract build_sql_query arguments for a question.
+
+    A close rephrasing of an already answered question reuses its extraction,
+    then the cache shared by all bot processes is checked (src.shared_cache);
+    otherwise the small model is tried first (if configured), then the large one.
+    Only extractions that pass validation are remembered and shared. lookup=False skips
+    the index when the caller has already checked it. The answer path is
+    recorded on the optional request trace (src.querylog.RequestTrace).
+    """
+    if settings.similarity_enabled and lookup:
+        args = lookup_similar(user_text)
+        if args is not None:
+            if trace is not None:
+                trace.path = "similarity"
+            return args
+
+    if settings.shared_cache_enabled:
+        args = await lookup_shared(user_text)
+        if args is not None:
+            if trace is not None:
+                trace.path = "shared"
+            if settings.similarity_enabled:
+                remember(user_text, args)
+            return args
+
+    args, trusted, tier = await extract_with_llm(user_text, deadline, trace)
+    if trace is not None:
+        trace.path = f"llm_{tier}"
+    if trusted:
+        if settings.similarity_enabled:
+            remember(user_text, args)
+        if settings.shared_cache_enabled:
+            shared_cache.put_args(user_text, args)
+    return args
+
+
+async def extract_with_llm(user_text: str, deadline: Deadline, trace=None) -> tuple:
+    """(args, passed validation, tier) from the model cascade.
+
+    The deadline bounds the LLM calls and the sleeps between retries; when it
+    runs out the in-flight HTTP request is cancelled and DeadlineExceeded is raised.
+    Token usage of every call is added to the optional request trace.
+    """
+    if init_client() is None:
+        raise RuntimeError("OpenAI client not initialized")
+
+    if settings.llm_small_model:
+        args = await extract_with_small_model(user_text, deadline, trace)
+        if args is not None:
+            return args, True, "small"
+
     max_retries = 3
     for attempt in range(max_retries):
+        start = time.perf_counter()
         try:
-            # 1. LLM Extraction Step
-            response = await client.chat.completions.create(
-                model=settings.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_text}
-                ],
-                tools=TOOLS,
-                tool_choice={"type": "function", "function": {"name": "build_sql_query"}},
-                temperature=0
-            )
-
-            tool_call = response.choices[0].message.tool_calls[0]
-            args = json.loads(tool_call.function.arguments)
-            logger.info(f"Extracted Params: {args}")
-
-            # 2. Python SQL Construction Step (Safe & Valid)
-            sql = ""
-            conditions = []
-
-            # Date Logic
-            date_col = "video_created_at" if args['target_table'] == "videos" else "created_at"
-
-            if args.get('date_exact'):
-                conditions.append(f"{date_col}::DATE = '{args['date_exact']}'")
-            elif args.get('date_from') and args.get('date_to'):
-                conditions.append(f"{date_col}::DATE >= '{args['date_from']}' AND {date_col}::DATE <= '{args['date_to']}'")
-
-            # Creator Logic
-            if args.get('creator_id'):
-                conditions.append(f"creator_id = '{args['creator_id']}'")
-
-            where_str = " WHERE " + " AND ".join(conditions) if conditions else ""
-
-            # Query Assembly
-            if args['intent'] == 'TOTAL_STATIC':
-                # "Сколько видео..." -> COUNT(id)
-                # "Сколько просмотров..." -> SUM(views_count)
-                agg = "COUNT" if args['metric_field'] == 'id' else "SUM"
-                sql = f"SELECT {agg}({args['metric_field']}) FROM {args['target_table']}{where_str}"
-
-            elif args['intent'] == 'GROWTH_DYNAMIC':
-                # "На сколько выросли..." -> SUM(delta_*)
-                sql = f"SELECT COALESCE(SUM({args['metric_field']}), 0) FROM {args['target_table']}{where_str}"
-
-            elif args['intent'] == 'UNIQUE_ACTIVE':
-                # "Сколько разных видео..." -> COUNT(DISTINCT video_id) WHERE delta > 0
-                if where_str:
-                    where_str += f" AND {args['metric_field']} > 0"
-                else:
-                    where_str = f" WHERE {args['metric_field']} > 0"
+            args = await call_llm(user_text, None, deadline, trace)
+            metrics.observe("llm_tier_latency_seconds", time.perf_counter() - start, tier="large")
 
-                sql = f"SELECT COUNT(DISTINCT video_id) FROM {args['target_table']}{where_str}"
+            problems = validate_args(args, user_text)
+            metrics.inc("llm_cascade_total", tier="large", outcome="rejected" if problems else "accepted")
+            if problems:
+                logger.warning(f"Large model extraction has problems: {'; '.join(problems)}")
+            return args, not problems, "large"
 
-            logger.info(f"Constructed SQL: {sql}")
-            return sql
+        except DeadlineExceeded:
+            raise
 
         except Exception as e:
             error_msg = str(e)
             logger.error(f"LLM Error (attempt {attempt + 1}/{max_retries}): {e}")
+            metrics.inc("llm_cascade_total", tier="large", outcome="error")
 
             # Если это последняя попытка, выбрасываем исключение
             if attempt == max_retries - 1:
@@ -166,6 +569,17 @@ RULES:
                 else:
                     raise RuntimeError(f"Ошибка при обработке запроса: {error_msg}")
 
-            # Ждем перед следующей попыткой
-            import asyncio
-            await asyncio.sleep(2 ** attempt)
+            # Ждем перед следующей попыткой, если бюджет времени позволяет
+            backoff = 2 ** attempt
+            remaining = deadline.remaining()
+            if remaining is not None and remaining <= backoff:
+                raise DeadlineExceeded(f"Deadline exceeded: no time left to retry after {error_msg}")
+            await asyncio.sleep(backoff)
+
+
+async def get_sql_query(user_text: str, deadline: Deadline = NO_DEADLINE) -> str:
+    """Generate SQL query using Function Calling approach"""
+    args = await extract_params(user_text, deadline)
+    sql = build_sql(args)
+    logger.info(f"Constructed SQL: {sql}")
+    return sql
@@ -0,0 +1,230 @@
+"""
+Several OpenAI-compatible endpoints behind one client interface.
+
+- hedging: if the primary endpoint has not answered within its latency
+  percentile, the same request is sent to the next endpoint; the first
+  response wins and the other request is cancelled;
+- failover: an error from one endpoint immediately moves the request to the next;
+- circuit breakers: an endpoint that keeps failing gets no traffic for a
+  cooldown period, then a single probe request decides whether it is healthy again.
+
+EndpointPool exposes the same `chat.completions.create(**kwargs)` as
+AsyncOpenAI, so llm_engine and the cassette layer work with it unchanged.
+Model names are per endpoint: a request without a model gets each endpoint's
+`model`, a request for the small cascade tier (LLM_SMALL_MODEL) gets each
+endpoint's `small_model` and only goes to endpoints that have one.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from types import SimpleNamespace
+from urllib.parse import urlparse
+from openai import AsyncOpenAI
+from src import metrics
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+# Latency samples kept per endpoint for the hedge delay percentile
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 10
+
+
+class NoHealthyEndpointError(RuntimeError):
+    """All endpoints are failing or have their circuit breaker open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def available(self) -> bool:
+        """Whether a request may be sent now (does not change state)"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self.probing
+
+    def acquire(self):
+        """Mark that a request is being sent; in half-open state it is the single probe"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancel(self):
+        # A cancelled hedge loser says nothing about health, but frees the probe slot
+        self.probing = False
+
+
+class Endpoint:
+    def __init__(self, name: str, client, model: str, small_model: str = ""):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.small_model = small_model
+        self.breaker = CircuitBreaker(settings.llm_breaker_failures, settings.llm_breaker_cooldown)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def hedge_delay(self) -> float:
+        """How long to wait for this endpoint before hedging to the next one"""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return settings.llm_hedge_default_delay
+        values = sorted(self.latencies)
+        index = min(len(values) - 1, int(settings.llm_hedge_quantile * len(values)))
+        return max(settings.llm_hedge_min_delay, values[index])
+
+    def export_state(self):
+        metrics.set_gauge("llm_breaker_state", STATE_VALUES[self.breaker.state], endpoint=self.name)
+
+    async def call(self, model: str, kwargs: dict):
+        self.breaker.acquire()
+        self.export_state()
+        start = time.perf_counter()
+        try:
+            response = await self.client.chat.completions.create(model=model, **kwargs)
+        except asyncio.CancelledError:
+            self.breaker.record_cancel()
+            metrics.inc("llm_requests_total", endpoint=self.name, outcome="cancelled")
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            self.export_state()
+            metrics.inc("llm_requests_total", endpoint=self.name, outcome="error")
+            raise
+        elapsed = time.perf_counter() - start
+        self.latencies.append(elapsed)
+        self.breaker.record_success()
+        self.export_state()
+        metrics.inc("llm_requests_total", endpoint=self.name, outcome="ok")
+        metrics.observe("llm_latency_seconds", elapsed, endpoint=self.name)
+        return response
+
+
+class EndpointPool:
+    def __init__(self, endpoints: list, hedging: bool = True, small_model: str = ""):
+        self.endpoints = endpoints
+        self.hedging = hedging
+        # Name of the small cascade tier as llm_engine requests it
+        self.small_model = small_model
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @classmethod
+    def from_settings(cls) -> "EndpointPool":
+        """Endpoints from LLM_ENDPOINTS, or the single OPENAI_BASE_URL/MODEL_NAME endpoint"""
+        configs = settings.llm_endpoints or [
+            {"base_url": settings.openai_base_url, "small_model": settings.llm_small_model}
+        ]
+        endpoints = []
+        for config in configs:
+            base_url = config["base_url"]
+            client = AsyncOpenAI(
+                api_key=config.get("api_key", settings.openai_api_key),
+                base_url=base_url,
+                # Retries are handled by get_sql_query and by failover between endpoints
+                max_retries=0
+            )
+            name = config.get("name") or urlparse(base_url).netloc or base_url
+            endpoints.append(Endpoint(
+                name, client, config.get("model", settings.model_name), config.get("small_model", "")
+            ))
+        if settings.llm_small_model and not any(endpoint.small_model for endpoint in endpoints):
+            logger.warning("LLM_SMALL_MODEL is set but no endpoint in LLM_ENDPOINTS has a small_model")
+        return cls(endpoints, hedging=settings.llm_hedge_enabled, small_model=settings.llm_small_model)
+
+    def model_for(self, endpoint: Endpoint, model: str = None):
+        """Model name to request from the endpoint; None if it does not serve the small tier"""
+        if not model:
+            return endpoint.model
+        if self.small_model and model == self.small_model:
+            return endpoint.small_model or None
+        return model
+
+    def _next_endpoint(self, used: set, model: str = None):
+        for endpoint in self.endpoints:
+            if (endpoint not in used and endpoint.breaker.available()
+                    and self.model_for(endpoint, model) is not None):
+                return endpoint
+        return None
+
+    async def create(self, model: str = None, **kwargs):
+        """Chat completion from the first endpoint that answers successfully"""
+        used = set()
+        pending = {}
+        last_error = None
+
+        def launch(endpoint):
+            used.add(endpoint)
+            task = asyncio.create_task(endpoint.call(self.model_for(endpoint, model), kwargs))
+            pending[task] = endpoint
+            return endpoint
+
+        primary = self._next_endpoint(used, model)
+        if primary is None:
+            raise NoHealthyEndpointError("Сервис временно перегружен: все LLM endpoints недоступны")
+        launch(primary)
+        hedge_at = time.monotonic() + primary.hedge_delay()
+
+        try:
+            while pending:
+                timeout = None
+                if self.hedging and len(pending) == 1 and hedge_at != float("inf"):
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Primary is slower than its usual percentile - hedge to the next endpoint
+                    endpoint = self._next_endpoint(used, model)
+                    if endpoint is None:
+                        hedge_at = float("inf")
+                        continue
+                    logger.info(f"Hedging LLM request to {endpoint.name}")
+                    metrics.inc("llm_hedges_total")
+                    launch(endpoint)
+                    continue
+
+                for task in done:
+                    endpoint = pending.pop(task)
+                    if task.exception() is None:
+                        if len(used) > 1:
+                            metrics.inc("llm_hedge_wins_total", endpoint=endpoint.name)
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"LLM endpoint {endpoint.name} failed: {last_error}")
+
+                # Failover: replace the failed request if nothing else is in flight
+                if not pending:
+                    endpoint = self._next_endpoint(used, model)
+                    if endpoint is not None:
+                        metrics.inc("llm_failovers_total")
+                        launch(endpoint)
+                        hedge_at = time.monotonic() + endpoint.hedge_delay()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        raise last_error
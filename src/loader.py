@@ -2,14 +2,35 @@ import json
 import asyncio
 import asyncpg
 from datetime import datetime
+from sqlalchemy import text
 from src.config import settings
+from src.database import shards
+from src.routing import shard_for
+from src.shared_cache import INVALIDATE_CHANNEL
+
+SHARD_INSERT = text("""
+    INSERT INTO video_snapshots (
+        id, video_id, views_count, likes_count, comments_count, reports_count,
+        delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count,
+        created_at, updated_at
+    ) VALUES (
+        :id, :video_id, :views_count, :likes_count, :comments_count, :reports_count,
+        :delta_views_count, :delta_likes_count, :delta_comments_count, :delta_reports_count,
+        :created_at, :updated_at
+    )
+""")
+
+
+def read_json(path: str) -> dict:
+    """Прочитать JSON файл (синхронно, вызывать через asyncio.to_thread)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 
 async def load_data():
     """Загрузка данных из JSON файла в PostgreSQL"""
-    # Читаем JSON файл
-    with open('data/videos.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # Читаем JSON файл в отдельном потоке, чтобы не блокировать event loop
+    data = await asyncio.to_thread(read_json, 'data/videos.json')
     
     # Создаем подключение к PostgreSQL
     conn = await asyncpg.connect(
@@ -80,6 +101,23 @@ async def load_data():
                 )
         
         print(f"Загружено {len(data['videos'])} видео и их снимков")
+
+        # Снимки раскладываются по шардам по хешу video_id
+        if len(shards):
+            await load_shards(data)
+
+        # Новая версия данных: боты сбросят кэш ответов и прогреют его заново
+        version = await conn.fetchval("""
+            INSERT INTO data_version (id, version) VALUES (1, 1)
+            ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1, updated_at = NOW()
+            RETURNING version
+        """)
+        print(f"Версия данных: {version}")
+
+        # Ответы по старым данным больше не нужны; запущенные боты сбрасывают
+        # свои кэши по уведомлению, не дожидаясь опроса версии
+        await conn.execute("DELETE FROM shared_cache WHERE kind = 'answer'")
+        await conn.execute("SELECT pg_notify($1, $2)", INVALIDATE_CHANNEL, str(version))
         
     except Exception as e:
         print(f"Ошибка при загрузке данных: {e}")
@@ -88,5 +126,26 @@ async def load_data():
         await conn.close()
 
 
+async def load_shards(data: dict):
+    """Разложить video_snapshots по шардам (основная БД остается полной копией)"""
+    rows = [[] for _ in shards.shards]
+    for video in data['videos']:
+        for snapshot in video['snapshots']:
+            row = {column: snapshot[column] for column in (
+                'id', 'video_id', 'views_count', 'likes_count', 'comments_count', 'reports_count',
+                'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count'
+            )}
+            row['created_at'] = datetime.fromisoformat(snapshot['created_at'].replace('Z', '+00:00'))
+            row['updated_at'] = datetime.fromisoformat(snapshot['updated_at'].replace('Z', '+00:00'))
+            rows[shard_for(snapshot['video_id'], len(shards))].append(row)
+
+    for shard, shard_rows in zip(shards.shards, rows):
+        async with shard.engine.begin() as conn:
+            await conn.execute(text("DELETE FROM video_snapshots"))
+            if shard_rows:
+                await conn.execute(SHARD_INSERT, shard_rows)
+        print(f"Шард '{shard.name}': {len(shard_rows)} снимков")
+
+
 if __name__ == "__main__":
     asyncio.run(load_data())
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+Метрики процесса в памяти: счетчики, gauge и сводки с перцентилями.
+
+Экспортируются в текстовом формате Prometheus (render) - командой /metrics.
+"""
+import math
+from collections import deque
+
+# Сколько последних наблюдений хранится для расчета перцентилей
+SUMMARY_WINDOW = 2048
+QUANTILES = (0.5, 0.9, 0.99)
+
+_counters = {}
+_gauges = {}
+_summaries = {}
+
+
+class Summary:
+    """Количество, сумма и скользящее окно наблюдений для перцентилей"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.window = deque(maxlen=SUMMARY_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.window.append(value)
+
+    def percentile(self, q: float) -> float:
+        if not self.window:
+            return 0.0
+        values = sorted(self.window)
+        index = min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))
+        return values[index]
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels):
+    key = _key(name, labels)
+    summary = _summaries.get(key)
+    if summary is None:
+        summary = _summaries[key] = Summary()
+    summary.observe(value)
+
+
+def get_counter(name: str, **labels) -> float:
+    return _counters.get(_key(name, labels), 0)
+
+
+def get_summary(name: str, **labels):
+    return _summaries.get(_key(name, labels))
+
+
+def percentile(name: str, q: float, **labels) -> float:
+    summary = get_summary(name, **labels)
+    return summary.percentile(q) if summary else 0.0
+
+
+def _format(name: str, labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for (name, labels), value in sorted(_counters.items()):
+        lines.append(f"{_format(name, labels)} {value:g}")
+    for (name, labels), value in sorted(_gauges.items()):
+        lines.append(f"{_format(name, labels)} {value:g}")
+    for (name, labels), summary in sorted(_summaries.items(), key=lambda item: item[0]):
+        for q in QUANTILES:
+            lines.append(f"{_format(name, labels, (('quantile', q),))} {summary.percentile(q):.6f}")
+        lines.append(f"{_format(name + '_count', labels)} {summary.count}")
+        lines.append(f"{_format(name + '_sum', labels)} {summary.total:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Сбросить все метрики (для тестов)"""
+    _counters.clear()
+    _gauges.clear()
+    _summaries.clear()
@@ -0,0 +1,116 @@
+"""
+Middleware для вопросов: квоты пользователей и схлопывание дублей.
+
+- одинаковые сообщения из одного чата в пределах окна обрабатываются один раз;
+- у каждого пользователя и чата своя квота (token bucket), сверх нее запрос
+  отклоняется с просьбой подождать.
+
+Принятые вопросы обслуживаются по кругу между пользователями очередью
+src.pipeline.WorkQueue.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from src import metrics
+from src.config import settings
+from src.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_TEXT = "⏳ Слишком много запросов. Подождите немного и повторите вопрос."
+
+
+class BoundedLRU(OrderedDict):
+    """Словарь с ограничением размера и вытеснением давно не использованных"""
+
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+
+    def touch(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = self[key] = factory()
+            if len(self) > self.max_size:
+                self.popitem(last=False)
+        else:
+            self.move_to_end(key)
+        return value
+
+    def evict_idle(self, ttl: float, last_used: Callable[[Any], float]):
+        deadline = time.monotonic() - ttl
+        while self:
+            key, value = next(iter(self.items()))
+            if last_used(value) >= deadline:
+                break
+            del self[key]
+
+
+class FairnessMiddleware(BaseMiddleware):
+    def __init__(self, sender):
+        self.sender = sender
+        self.user_buckets = BoundedLRU(settings.fairness_max_users)
+        self.chat_buckets = BoundedLRU(settings.fairness_max_users)
+        # (chat_id, текст) -> время последнего такого сообщения
+        self.recent = BoundedLRU(settings.fairness_max_users)
+        # пользователь -> когда ему последний раз ответили про лимит
+        self.notified = BoundedLRU(settings.fairness_max_users)
+
+    def _decide(self, decision: str):
+        metrics.inc("fairness_decisions_total", decision=decision)
+
+    def _is_duplicate(self, chat_id: int, text: str) -> bool:
+        now = time.monotonic()
+        self.recent.evict_idle(settings.debounce_window, lambda seen: seen)
+        key = (chat_id, " ".join(text.lower().split()))
+        if key in self.recent:
+            return True
+        self.recent[key] = now
+        if len(self.recent) > self.recent.max_size:
+            self.recent.popitem(last=False)
+        return False
+
+    def _within_quota(self, user_id: int, chat_id: int) -> bool:
+        self.user_buckets.evict_idle(settings.fairness_idle_ttl, lambda bucket: bucket.last_used)
+        self.chat_buckets.evict_idle(settings.fairness_idle_ttl, lambda bucket: bucket.last_used)
+        user_bucket = self.user_buckets.touch(
+            user_id, lambda: TokenBucket(settings.user_rate_per_minute / 60, settings.user_burst)
+        )
+        chat_bucket = self.chat_buckets.touch(
+            chat_id, lambda: TokenBucket(settings.chat_rate_per_minute / 60, settings.chat_burst)
+        )
+        return user_bucket.try_acquire() and chat_bucket.try_acquire()
+
+    async def _notify_throttled(self, user_id: int, chat_id: int):
+        # Про лимит сообщаем не чаще раза в окно, иначе сами ответы станут флудом
+        now = time.monotonic()
+        self.notified.evict_idle(settings.debounce_window, lambda sent: sent)
+        if user_id in self.notified:
+            return
+        self.notified[user_id] = now
+        await self.sender.send_message(chat_id, THROTTLED_TEXT)
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        chat_id = event.chat.id
+        user_id = event.from_user.id if event.from_user else chat_id
+
+        if event.text and self._is_duplicate(chat_id, event.text):
+            self._decide("debounced")
+            return None
+
+        if not self._within_quota(user_id, chat_id):
+            self._decide("rate_limited")
+            await self._notify_throttled(user_id, chat_id)
+            return None
+
+        self._decide("admitted")
+        metrics.set_gauge("fairness_tracked_users", len(self.user_buckets))
+        return await handler(event, data)
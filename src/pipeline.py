@@ -0,0 +1,96 @@
+"""
+Ограниченная очередь вопросов перед обработчиком.
+
+Обработчик сообщения только кладет вопрос в очередь и сразу освобождает
+задачу aiogram; вопросы обрабатывают фиксированное число корутин-воркеров.
+Очередь разбита по пользователям и обслуживается по кругу; вопросы одного
+пользователя выполняются строго по одному, в порядке поступления. Если очередь
+заполнена, вопрос не принимается и пользователь сразу получает ответ
+«занято», а не ждет таймаута.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], workers: int, maxsize: int):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        # ключ (пользователь) -> очередь (время постановки, задание)
+        self.pending = {}
+        # Пользователи, чье задание можно взять сейчас; порядок ключей - круг обхода.
+        # Пока задание пользователя выполняется, он вне круга: его вопросы
+        # обрабатываются по одному и ответы приходят в порядке вопросов
+        self.ready = OrderedDict()
+        self.busy = set()
+        self.size = 0
+        self._ready = asyncio.Semaphore(0)
+        self._tasks = []
+
+    def submit(self, key, item) -> bool:
+        """Поставить задание в очередь; False, если очередь заполнена"""
+        if self.size >= self.maxsize:
+            metrics.inc("work_queue_rejected_total")
+            return False
+
+        queue = self.pending.get(key)
+        if queue is None:
+            queue = self.pending[key] = deque()
+        queue.append((time.perf_counter(), item))
+        self.size += 1
+        self._schedule(key)
+        metrics.inc("work_queue_submitted_total")
+        metrics.set_gauge("work_queue_depth", self.size)
+        return True
+
+    def _schedule(self, key):
+        if key in self.pending and key not in self.busy and key not in self.ready:
+            self.ready[key] = None
+            self._ready.release()
+
+    def _pop(self):
+        key, _ = self.ready.popitem(last=False)
+        queue = self.pending[key]
+        enqueued_at, item = queue.popleft()
+        if not queue:
+            del self.pending[key]
+        self.busy.add(key)
+        self.size -= 1
+        metrics.set_gauge("work_queue_depth", self.size)
+        return key, enqueued_at, item
+
+    def _done(self, key):
+        # Пользователь обслужен - в конец круга, если у него еще есть вопросы
+        self.busy.discard(key)
+        self._schedule(key)
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            key, enqueued_at, item = self._pop()
+            metrics.observe("work_queue_wait_seconds", time.perf_counter() - enqueued_at)
+            try:
+                await self.handler(item)
+            except Exception as e:
+                logger.exception(f"Work queue handler failed: {e}")
+            finally:
+                self._done(key)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Work queue started: {self.workers} workers, max {self.maxsize} queued")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
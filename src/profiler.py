@@ -0,0 +1,175 @@
+"""
+Семплирующий профилировщик, управляемый во время работы бота.
+
+Фоновый поток с заданной частотой снимает стек потока event loop'а и копит
+свернутые стеки (collapsed stacks). Результат пишется в файл в формате
+collapsed (flamegraph.pl, speedscope) или speedscope JSON.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from src.config import settings
+
+# Идентификатор потока event loop'а и имя процесса, задаются при старте бота
+# (в главном процессе и в каждом воркере)
+_loop_thread_id = None
+_process_name = "main"
+_lock = asyncio.Lock()
+
+
+def install(process_name: str = "main"):
+    """Запомнить текущий поток как поток event loop'а (вызывать из loop'а)"""
+    global _loop_thread_id, _process_name
+    _loop_thread_id = threading.get_ident()
+    _process_name = process_name
+
+
+def process_label() -> str:
+    """Какой процесс профилируется: имя и pid"""
+    return f"{_process_name} (pid {os.getpid()})"
+
+
+def loop_thread_id() -> int:
+    return _loop_thread_id or threading.get_ident()
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def capture_stack(thread_id: int) -> list:
+    """Стек потока от корня к листу в виде списка имен функций"""
+    frame = sys._current_frames().get(thread_id)
+    stack = []
+    while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    """Фоновый поток, семплирующий стек одного потока"""
+
+    def __init__(self, thread_id: int, hz: int):
+        self.thread_id = thread_id
+        self.interval = 1.0 / hz
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            stack = capture_stack(self.thread_id)
+            if stack:
+                self.samples[";".join(stack)] += 1
+                self.sample_count += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self, name: str) -> str:
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            indexes = []
+            for frame in stack.split(";"):
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(count)
+
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "none",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }],
+            "exporter": "testvideobot"
+        })
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.1) -> list:
+    """Задержки event loop'а: насколько sleep(interval) просыпается позже"""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - start - interval))
+    return lags
+
+
+def is_running() -> bool:
+    return _lock.locked()
+
+
+async def profile(seconds: float, fmt: str = "collapsed") -> dict:
+    """Профилировать event loop в течение seconds секунд и записать результат в файл"""
+    if fmt not in ("collapsed", "speedscope"):
+        raise ValueError(f"Неизвестный формат профиля: {fmt}")
+    seconds = min(seconds, settings.profiler_max_seconds)
+
+    async with _lock:
+        profiler = SamplingProfiler(loop_thread_id(), settings.profiler_hz)
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(stop))
+        tasks_before = len(asyncio.all_tasks())
+
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+            stop.set()
+        lags = await lag_task
+        tasks_after = len(asyncio.all_tasks())
+
+        name = datetime.now().strftime("profile_%Y%m%d_%H%M%S") + f"_{os.getpid()}"
+        os.makedirs(settings.profiler_dir, exist_ok=True)
+        if fmt == "speedscope":
+            path = os.path.join(settings.profiler_dir, f"{name}.speedscope.json")
+            content = profiler.speedscope(name)
+        else:
+            path = os.path.join(settings.profiler_dir, f"{name}.collapsed.txt")
+            content = profiler.collapsed()
+        await asyncio.to_thread(_write_file, path, content)
+
+    return {
+        "path": path,
+        "process": process_label(),
+        "seconds": seconds,
+        "samples": profiler.sample_count,
+        "tasks_before": tasks_before,
+        "tasks_after": tasks_after,
+        "lag_avg_ms": sum(lags) / len(lags) * 1000 if lags else 0.0,
+        "lag_max_ms": max(lags) * 1000 if lags else 0.0,
+    }
+
+
+def _write_file(path: str, content: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
@@ -0,0 +1,232 @@
+"""
+Журнал вопросов в PostgreSQL (таблица query_log).
+
+Для каждого вопроса пишется нормализованный текст, извлеченные параметры,
+шаблон SQL (литералы заменены на ?), путь ответа (similarity / shared /
+speculation / llm_small / llm_large), время этапов и исход. Запись не ждет БД: трассировка
+кладется в буфер в памяти, а фоновая задача сбрасывает его пачками через
+COPY. Если буфер переполнен (БД недоступна), старые записи отбрасываются.
+
+Старые записи удаляются раз в час (query_log_retention_days). Для анализа -
+top_questions(), slowest_shapes() и token_usage() (токены LLM на вопрос).
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+import asyncpg
+from src import metrics
+from src.config import settings
+from src.database import execute_query
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("created_at", "question", "args", "sql_template", "path", "outcome",
+           "queue_ms", "llm_ms", "sql_ms", "total_ms", "prompt_tokens", "completion_tokens")
+STAGES = ("queue", "llm", "sql")
+LITERAL_RE = re.compile(r"'[^']*'")
+
+RETENTION_INTERVAL = 3600
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+def sql_template(sql: Optional[str]) -> Optional[str]:
+    """SQL без литералов: запросы одной формы с разными датами и id совпадают"""
+    return LITERAL_RE.sub("?", sql) if sql else None
+
+
+class RequestTrace:
+    """Что произошло с одним вопросом и сколько заняли этапы"""
+
+    def __init__(self, question: str):
+        self.created_at = datetime.now()
+        self.started = time.perf_counter()
+        self.question = question
+        self.args = None
+        self.sql = None
+        self.path = None
+        self.outcome = None
+        self.stages = {}
+        # Токены всех вызовов LLM для вопроса (None - LLM не вызывалась)
+        self.prompt_tokens = None
+        self.completion_tokens = None
+
+    def mark(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - start)
+
+    def record(self) -> tuple:
+        """Строка для COPY в порядке COLUMNS"""
+        stage_ms = [
+            round(self.stages[stage] * 1000, 3) if stage in self.stages else None for stage in STAGES
+        ]
+        return (
+            self.created_at,
+            normalize_question(self.question or ""),
+            json.dumps(self.args, ensure_ascii=False) if self.args is not None else None,
+            sql_template(self.sql),
+            self.path,
+            self.outcome or "unknown",
+            *stage_ms,
+            round((time.perf_counter() - self.started) * 1000, 3),
+            self.prompt_tokens,
+            self.completion_tokens
+        )
+
+
+class QueryLog:
+    def __init__(self, batch_size: int, flush_interval: float, max_buffer: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=max_buffer)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._conn = None
+        self._last_retention = 0.0
+
+    def record(self, trace: RequestTrace):
+        """Положить запись в буфер; никогда не ждет БД"""
+        if len(self.buffer) == self.buffer.maxlen:
+            metrics.inc("query_log_dropped_total")
+        self.buffer.append(trace.record())
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _connection(self) -> asyncpg.Connection:
+        if self._conn is None or self._conn.is_closed():
+            self._conn = await asyncpg.connect(
+                user=settings.postgres_user,
+                password=settings.postgres_password,
+                database=settings.postgres_db,
+                host=settings.postgres_host,
+                port=settings.postgres_port
+            )
+        return self._conn
+
+    async def _copy(self, records: list):
+        conn = await self._connection()
+        await conn.copy_records_to_table("query_log", records=records, columns=COLUMNS)
+
+    async def _apply_retention(self):
+        conn = await self._connection()
+        await conn.execute(
+            "DELETE FROM query_log WHERE created_at < NOW() - make_interval(days => $1)",
+            settings.query_log_retention_days
+        )
+
+    async def flush(self):
+        """Сбросить буфер в БД пачками; при ошибке записи возвращаются в буфер"""
+        while self.buffer:
+            # Пачка забирается из буфера до COPY: пока он идет, record() может вытеснить старые записи
+            batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            start = time.perf_counter()
+            try:
+                await self._copy(batch)
+            except Exception as e:
+                self._restore(batch)
+                logger.warning(f"Query log flush failed ({len(self.buffer)} records buffered): {e}")
+                metrics.inc("query_log_flush_errors_total")
+                if self._conn is not None and not self._conn.is_closed():
+                    await self._conn.close()
+                self._conn = None
+                return
+            metrics.inc("query_log_written_total", len(batch))
+            metrics.observe("query_log_flush_seconds", time.perf_counter() - start)
+
+    def _restore(self, batch: list):
+        """Вернуть неудавшуюся пачку в начало буфера; что не помещается - самое старое - теряется"""
+        room = self.buffer.maxlen - len(self.buffer)
+        if room < len(batch):
+            metrics.inc("query_log_dropped_total", len(batch) - room)
+            batch = batch[len(batch) - room:]
+        self.buffer.extendleft(reversed(batch))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            metrics.set_gauge("query_log_buffered", len(self.buffer))
+
+            if time.monotonic() - self._last_retention >= RETENTION_INTERVAL:
+                self._last_retention = time.monotonic()
+                try:
+                    await self._apply_retention()
+                except Exception as e:
+                    logger.warning(f"Query log retention failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую задачу и сбросить остаток буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+
+
+async def top_questions(limit: int = 10, days: int = 7) -> list:
+    """Самые частые вопросы: (вопрос, число, доля через LLM, среднее время, мс)"""
+    return await execute_query(f"""
+        SELECT question,
+               COUNT(*) AS asked,
+               AVG((path LIKE 'llm%')::int) AS llm_share,
+               AVG(total_ms) AS avg_ms
+        FROM query_log
+        WHERE created_at >= NOW() - INTERVAL '{int(days)} days'
+        GROUP BY question
+        ORDER BY asked DESC
+        LIMIT {int(limit)}
+    """)
+
+
+async def token_usage(days: int = 7) -> tuple:
+    """Токены LLM за период: (вопросов через LLM, prompt всего, completion всего, prompt в среднем)"""
+    rows = await execute_query(f"""
+        SELECT COUNT(prompt_tokens), SUM(prompt_tokens), SUM(completion_tokens), AVG(prompt_tokens)
+        FROM query_log
+        WHERE created_at >= NOW() - INTERVAL '{int(days)} days'
+    """)
+    return tuple(rows[0])
+
+
+async def slowest_shapes(limit: int = 10, days: int = 7) -> list:
+    """Самые медленные формы SQL: (шаблон, число, p95 SQL, мс, p95 всего, мс)"""
+    return await execute_query(f"""
+        SELECT sql_template,
+               COUNT(*) AS executed,
+               percentile_cont(0.95) WITHIN GROUP (ORDER BY sql_ms) AS p95_sql_ms,
+               percentile_cont(0.95) WITHIN GROUP (ORDER BY total_ms) AS p95_total_ms
+        FROM query_log
+        WHERE created_at >= NOW() - INTERVAL '{int(days)} days' AND sql_template IS NOT NULL
+        GROUP BY sql_template
+        ORDER BY p95_sql_ms DESC NULLS LAST
+        LIMIT {int(limit)}
+    """)
+
+
+query_log = QueryLog(settings.query_log_batch_size, settings.query_log_flush_interval, settings.query_log_max_buffer)
@@ -0,0 +1,50 @@
+"""
+Token bucket для ограничения частоты запросов.
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ведро на capacity токенов, пополняется со скоростью rate токенов в секунду"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.last_used = self.updated
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Взять токены, если они есть, не дожидаясь"""
+        self._refill()
+        self.last_used = self.updated
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1) -> float:
+        """Через сколько секунд будет доступно tokens токенов"""
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """Дождаться токенов; возвращает время ожидания"""
+        waited = 0.0
+        while not self.try_acquire(tokens):
+            delay = self.delay(tokens)
+            waited += delay
+            await asyncio.sleep(delay)
+        return waited
+
+    def pause(self, seconds: float):
+        """Запретить запросы на seconds секунд (например, по retry_after)"""
+        self._refill()
+        # Через seconds секунд в ведре снова будет ровно один токен
+        self.tokens = min(self.tokens, 1.0) - seconds * self.rate
@@ -0,0 +1,238 @@
+"""
+Маршрутизация запросов по нескольким PostgreSQL.
+
+Реплики (db_replicas) - полные копии основной БД только для чтения.
+Запрос уходит на реплику по кругу (round_robin) или на самую быструю
+(least_latency). Реплика, отстающая больше db_replica_max_lag секунд или
+вернувшая ошибку, пропускается до следующей проверки; если подходящих реплик
+нет, запрос выполняется на основной БД.
+
+Шарды (db_shards) хранят video_snapshots, разбитые по хешу video_id
+(shard_for). Агрегат по снимкам выполняется на всех шардах параллельно,
+частичные результаты складываются: SUM и COUNT суммируются, а COUNT(DISTINCT
+video_id) тоже, потому что одно видео целиком лежит на одном шарде. Запросы
+с несколькими агрегатами и рядом по дням складываются по колонкам, строки -
+по ключу (дню).
+"""
+import asyncio
+import logging
+import re
+import time
+import zlib
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from src import metrics
+from src.deadline import Deadline, NO_DEADLINE
+
+logger = logging.getLogger(__name__)
+
+# Запросы, частичные результаты которых можно сложить (в т.ч. ряд по дням)
+ADDITIVE_RE = re.compile(
+    r"^\s*SELECT\s+(to_char\(date_trunc\('day',\s*\w+\),\s*'YYYY-MM-DD'\)\s+AS\s+day,\s*)?"
+    r"(COALESCE\(\s*)?(SUM|COUNT)\(.*\bFROM\s+video_snapshots\b",
+    re.IGNORECASE | re.DOTALL
+)
+
+# Отставание реплики: 0, если все полученное WAL уже применено
+LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() IS NULL OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Вес нового замера в скользящем среднем задержки
+LATENCY_ALPHA = 0.2
+
+
+def shard_for(video_id, shards: int) -> int:
+    """Номер шарда для видео (стабильный между процессами и запусками)"""
+    return zlib.crc32(str(video_id).lower().encode()) % shards
+
+
+def is_additive(query: str) -> bool:
+    return ADDITIVE_RE.match(query) is not None
+
+
+def combine(partials: list):
+    """Сумма частичных SUM/COUNT; None, если ни один шард не вернул значения"""
+    values = [value for value in partials if value is not None]
+    return sum(values) if values else None
+
+
+def combine_rows(partials: list, keys: int = 0) -> list:
+    """Сложить частичные строки шардов по колонкам; первые keys колонок - ключ строки"""
+    merged = {}
+    for rows in partials:
+        for row in rows:
+            key, values = tuple(row[:keys]), row[keys:]
+            if key in merged:
+                merged[key] = [combine(pair) for pair in zip(merged[key], values)]
+            else:
+                merged[key] = list(values)
+    return [list(key) + values for key, values in sorted(merged.items())]
+
+
+class Node:
+    """Один PostgreSQL: выполнение запросов, задержка и отставание"""
+
+    def __init__(self, name: str, url: str = None, engine: AsyncEngine = None, **options):
+        self.name = name
+        self.url = url
+        self.options = options or {"pool_pre_ping": True}
+        self._engine = engine
+        self.latency = None
+        self.lag = 0.0
+        self.healthy = True
+
+    @property
+    def engine(self) -> AsyncEngine:
+        """Движок создается при первом обращении, а не при импорте модуля"""
+        if self._engine is None:
+            self._engine = create_async_engine(self.url, **self.options)
+        return self._engine
+
+    async def _execute(self, query: str, deadline: Deadline, rows: bool = False):
+        conn = await deadline.run(self.engine.connect(), "pool acquisition")
+        try:
+            remaining = deadline.remaining()
+            if remaining is not None:
+                # SET LOCAL действует до конца транзакции, открытой этим соединением
+                timeout_ms = max(1, int(remaining * 1000))
+                await conn.execute(text(f"SET LOCAL statement_timeout = {timeout_ms}"))
+            result = await deadline.run(conn.execute(text(query)), "SQL query")
+            return [list(row) for row in result] if rows else result.scalar()
+        finally:
+            await conn.close()
+
+    async def scalar(self, query: str, deadline: Deadline = NO_DEADLINE):
+        return await self._measure(self._execute(query, deadline))
+
+    async def rows(self, query: str, deadline: Deadline = NO_DEADLINE) -> list:
+        """Все строки результата списками"""
+        return await self._measure(self._execute(query, deadline, rows=True))
+
+    async def _measure(self, execution):
+        start = time.perf_counter()
+        try:
+            value = await execution
+        except Exception:
+            metrics.inc("db_node_queries_total", node=self.name, outcome="error")
+            raise
+        elapsed = time.perf_counter() - start
+        self.latency = elapsed if self.latency is None else (
+            LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * self.latency
+        )
+        metrics.inc("db_node_queries_total", node=self.name, outcome="ok")
+        metrics.observe("db_node_latency_seconds", elapsed, node=self.name)
+        return value
+
+    async def fetch_lag(self) -> float:
+        return float(await self._execute(LAG_QUERY, NO_DEADLINE) or 0)
+
+
+class ReplicaRouter:
+    def __init__(self, primary: Node, replicas: list, strategy: str = "round_robin",
+                 max_lag: float = 5.0, check_interval: float = 5.0):
+        self.primary = primary
+        self.replicas = replicas
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = 0
+        self._task = None
+
+    def candidates(self) -> list:
+        return [node for node in self.replicas if node.healthy and node.lag <= self.max_lag]
+
+    def pick(self) -> Node:
+        """Реплика для следующего запроса или основная БД, если подходящих нет"""
+        candidates = self.candidates()
+        if not candidates:
+            return self.primary
+        if self.strategy == "least_latency":
+            # Реплики без замеров пробуем первыми, чтобы узнать их задержку
+            return min(candidates, key=lambda node: -1 if node.latency is None else node.latency)
+        node = candidates[self._next % len(candidates)]
+        self._next += 1
+        return node
+
+    async def scalar(self, query: str, deadline: Deadline = NO_DEADLINE):
+        return await self._run_query("scalar", query, deadline)
+
+    async def rows(self, query: str, deadline: Deadline = NO_DEADLINE) -> list:
+        return await self._run_query("rows", query, deadline)
+
+    async def _run_query(self, method: str, query: str, deadline: Deadline):
+        node = self.pick()
+        if node is self.primary:
+            return await getattr(node, method)(query, deadline)
+        try:
+            return await getattr(node, method)(query, deadline)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if deadline.expired():
+                raise
+            # Реплика недоступна - до следующей проверки ходим мимо нее
+            logger.warning(f"Replica {node.name} failed, falling back to primary: {e}")
+            node.healthy = False
+            metrics.inc("db_replica_fallbacks_total", node=node.name)
+            return await getattr(self.primary, method)(query, deadline)
+
+    async def check(self):
+        """Обновить отставание и доступность реплик"""
+        for node in self.replicas:
+            try:
+                node.lag = await node.fetch_lag()
+                node.healthy = True
+            except Exception as e:
+                logger.warning(f"Replica {node.name} lag check failed: {e}")
+                node.healthy = False
+            metrics.set_gauge("db_replica_lag_seconds", node.lag, node=node.name)
+            metrics.set_gauge("db_replica_healthy", int(node.healthy), node=node.name)
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self):
+        if self.replicas and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class ShardSet:
+    def __init__(self, shards: list):
+        self.shards = shards
+
+    def __len__(self):
+        return len(self.shards)
+
+    async def scatter(self, query: str, deadline: Deadline = NO_DEADLINE) -> Optional[float]:
+        """Выполнить агрегат на всех шардах параллельно и сложить результаты"""
+        return combine(await self._gather("scalar", query, deadline))
+
+    async def scatter_rows(self, query: str, deadline: Deadline = NO_DEADLINE, keys: int = 0) -> list:
+        """То же для запроса из нескольких агрегатов; строки складываются по первым keys колонкам"""
+        return combine_rows(await self._gather("rows", query, deadline), keys)
+
+    async def _gather(self, method: str, query: str, deadline: Deadline) -> list:
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(getattr(shard, method)(query, deadline)) for shard in self.shards]
+        try:
+            partials = await asyncio.gather(*tasks)
+        finally:
+            # Если один шард упал, остальные запросы не нужны
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        metrics.observe("db_scatter_seconds", time.perf_counter() - start)
+        return partials
@@ -0,0 +1,149 @@
+"""
+Исходящие сообщения в Telegram с учетом лимитов.
+
+Все отправки проходят через token bucket: общий на бота и отдельный на
+каждый чат. При TelegramRetryAfter отправка откладывается на retry_after
+и повторяется - под нагрузкой ответы задерживаются, но не теряются.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from src import metrics
+from src.config import settings
+from src.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TEXT = "🔄 Обрабатываю ваш запрос..."
+
+# Сколько token bucket'ов чатов держать в памяти
+MAX_CHAT_BUCKETS = 10000
+
+
+class Sender:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.global_bucket = TokenBucket(settings.telegram_global_rate, settings.telegram_global_rate)
+        self.chat_buckets = OrderedDict()
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательный chat_id - группа, у групп лимит строже
+            rate = settings.telegram_group_rate if chat_id < 0 else settings.telegram_chat_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, settings.telegram_chat_burst)
+            if len(self.chat_buckets) > MAX_CHAT_BUCKETS:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def call(self, chat_id: int, method: str, make_request):
+        """Выполнить запрос к Telegram в рамках лимитов, повторяя после retry_after"""
+        start = time.perf_counter()
+        chat_bucket = self.chat_bucket(chat_id)
+        while True:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                result = await make_request()
+                break
+            except TelegramRetryAfter as e:
+                logger.warning(f"Telegram flood control in chat {chat_id}: retry after {e.retry_after}s")
+                metrics.inc("telegram_retry_after_total", method=method)
+                chat_bucket.pause(e.retry_after)
+        metrics.inc("telegram_requests_total", method=method)
+        metrics.observe("telegram_send_seconds", time.perf_counter() - start, method=method)
+        return result
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        return await self.call(
+            chat_id, "sendMessage",
+            lambda: self.bot.send_message(chat_id, text, **kwargs)
+        )
+
+    async def edit_message(self, chat_id: int, message_id: int, text: str, **kwargs):
+        return await self.call(
+            chat_id, "editMessageText",
+            lambda: self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+        )
+
+    async def send_document(self, chat_id: int, document, **kwargs):
+        return await self.call(
+            chat_id, "sendDocument",
+            lambda: self.bot.send_document(chat_id, document, **kwargs)
+        )
+
+    async def chat_action(self, chat_id: int, action: str = "typing"):
+        """Индикатор «печатает...»: необязателен, поэтому без ожидания токенов"""
+        if not self.global_bucket.try_acquire():
+            return
+        try:
+            await self.bot.send_chat_action(chat_id, action)
+            metrics.inc("telegram_requests_total", method="sendChatAction")
+        except Exception as e:
+            logger.debug(f"Chat action failed in chat {chat_id}: {e}")
+
+    def progress(self, chat_id: int) -> "Progress":
+        return Progress(self, chat_id, settings.progress_delay)
+
+
+class Progress:
+    """Индикатор обработки запроса.
+
+    Сразу показывает «печатает...». Сообщение о прогрессе отправляется,
+    только если ответ готовится дольше delay секунд, и затем редактируется
+    в ответ. Быстрый ответ уходит одним сообщением.
+    """
+
+    def __init__(self, sender: Sender, chat_id: int, delay: float):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.delay = delay
+        self.message_id = None
+        self._showing = False
+        self._task = None
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._show())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._showing:
+            # Сообщение о прогрессе уже отправляется - дожидаемся его id
+            try:
+                await self._task
+            except Exception as e:
+                logger.debug(f"Progress message failed in chat {self.chat_id}: {e}")
+        else:
+            self._task.cancel()
+        return False
+
+    async def _show(self):
+        await self.sender.chat_action(self.chat_id)
+        await asyncio.sleep(self.delay)
+        self._showing = True
+        message = await self.sender.send_message(self.chat_id, PROGRESS_TEXT)
+        self.message_id = message.message_id
+        metrics.inc("progress_messages_total")
+
+    async def reply_document(self, document, caption: str):
+        """Ответ файлом; сообщение о прогрессе, если было, указывает на файл"""
+        if self.message_id is not None:
+            try:
+                await self.sender.edit_message(self.chat_id, self.message_id, "📎 Готово, файл ниже")
+            except Exception as e:
+                logger.warning(f"Editing progress message failed in chat {self.chat_id}: {e}")
+        return await self.sender.send_document(self.chat_id, document, caption=caption)
+
+    async def reply(self, text: str, **kwargs):
+        """Ответ: правка сообщения о прогрессе или новое сообщение"""
+        if self.message_id is not None:
+            try:
+                return await self.sender.edit_message(self.chat_id, self.message_id, text, **kwargs)
+            except Exception as e:
+                logger.warning(f"Editing progress message failed in chat {self.chat_id}: {e}")
+        return await self.sender.send_message(self.chat_id, text, **kwargs)
@@ -0,0 +1,262 @@
+"""
+Кэш второго уровня, общий для всех процессов бота (таблица shared_cache).
+
+Первый уровень - память процесса: индекс похожих вопросов (src.similarity)
+для извлеченных параметров и кэш ответов (src.cache) для результатов SQL.
+Промах первого уровня проверяется в UNLOGGED таблице PostgreSQL: параметры,
+извлеченные LLM в одном процессе, и ответы, посчитанные в одном процессе,
+достаются остальным без LLM и без запроса к данным. Найденное копируется
+в первый уровень.
+
+- Параметры хранятся по шаблону вопроса (даты и id креаторов заменены на
+  слоты, как в индексе похожих вопросов) и живут shared_cache_args_ttl.
+- Ответы хранятся по тексту SQL вместе с версией данных и живут
+  answer_cache_ttl; ответы другой версии не возвращаются.
+- Загрузчик после загрузки удаляет ответы и шлет NOTIFY в канал
+  cache_invalidate с новой версией данных. Каждый процесс слушает канал
+  (LISTEN), сбрасывает свой кэш ответов и сообщает подписчикам (прогрев).
+  Пропущенные при разрыве соединения уведомления восполняются чтением
+  версии данных после переподключения.
+- Просроченные записи удаляются раз в shared_cache_cleanup_interval
+  (индекс по expires_at).
+
+Кэш необязателен: ошибка или таймаут (shared_cache_timeout) считаются
+промахом, запись выполняется в фоне и не задерживает ответ.
+"""
+import asyncio
+import json
+import logging
+import time
+from decimal import Decimal
+from typing import Optional
+import asyncpg
+from src import metrics
+from src.cache import MISSING, answer_cache
+from src.config import settings
+from src.similarity import DATE_SLOT, ID_SLOT, abstract, fill_slots, to_slots
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "cache_invalidate"
+RECONNECT_INTERVAL = 5.0
+
+SELECT_SQL = """
+    SELECT value FROM shared_cache
+    WHERE kind = $1 AND key = $2 AND data_version IS NOT DISTINCT FROM $3 AND expires_at > NOW()
+"""
+UPSERT_SQL = """
+    INSERT INTO shared_cache (kind, key, value, data_version, expires_at)
+    VALUES ($1, $2, $3::jsonb, $4, NOW() + make_interval(secs => $5))
+    ON CONFLICT (kind, key) DO UPDATE
+    SET value = EXCLUDED.value, data_version = EXCLUDED.data_version, expires_at = EXCLUDED.expires_at
+"""
+
+
+def _default(value):
+    # SUM по BIGINT возвращает Decimal - сохраняем его без потери точности
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    raise TypeError(f"Cannot store {type(value).__name__} in shared cache")
+
+
+def _object_hook(obj: dict):
+    if obj.keys() == {"$decimal"}:
+        return Decimal(obj["$decimal"])
+    return obj
+
+
+def encode(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_default)
+
+
+def decode(raw: str):
+    return json.loads(raw, object_hook=_object_hook)
+
+
+def _slot(value):
+    """Слоты в JSON превращаются в списки [«<date>», 0]; другие списки (metric_fields) остаются списками"""
+    if isinstance(value, list) and len(value) == 2 and value[0] in (DATE_SLOT, ID_SLOT) and isinstance(value[1], int):
+        return tuple(value)
+    return value
+
+
+class SharedCache:
+    def __init__(self, timeout: float, pool_size: int, cleanup_interval: float):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.cleanup_interval = cleanup_interval
+        # Вызываются с новой версией данных после сброса кэша ответов
+        self.subscribers = []
+        self._pool = None
+        self._listener = None
+        self._task = None
+        self._writes = set()
+        self._last_cleanup = 0.0
+
+    # --- Доступ к таблице ---
+
+    async def _fetch(self, kind: str, key: str, version):
+        """Сохраненное значение или MISSING"""
+        if self._pool is None:
+            return MISSING
+        raw = await asyncio.wait_for(self._pool.fetchval(SELECT_SQL, kind, key, version), self.timeout)
+        return MISSING if raw is None else decode(raw)
+
+    async def _store(self, kind: str, key: str, value, version, ttl: float):
+        await self._pool.execute(UPSERT_SQL, kind, key, encode(value), version, ttl)
+
+    async def get(self, kind: str, key: str, version=None):
+        try:
+            value = await self._fetch(kind, key, version)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed: {e!r}")
+            metrics.inc("shared_cache_total", kind=kind, outcome="error")
+            return MISSING
+        metrics.inc("shared_cache_total", kind=kind, outcome="miss" if value is MISSING else "hit")
+        return value
+
+    def put(self, kind: str, key: str, value, version=None, ttl: float = 3600.0):
+        """Записать в фоне; ответ пользователю запись не ждет"""
+        if self._pool is None:
+            return
+        task = asyncio.create_task(self._put(kind, key, value, version, ttl))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _put(self, kind, key, value, version, ttl):
+        try:
+            await self._store(kind, key, value, version, ttl)
+            metrics.inc("shared_cache_writes_total", kind=kind, outcome="ok")
+        except Exception as e:
+            logger.warning(f"Shared cache write failed: {e!r}")
+            metrics.inc("shared_cache_writes_total", kind=kind, outcome="error")
+
+    # --- Параметры и ответы ---
+
+    async def get_args(self, question: str) -> Optional[dict]:
+        """Параметры, извлеченные для того же шаблона вопроса, с подставленными датами и id"""
+        template, dates, ids = abstract(question)
+        if not template:
+            return None
+        stored = await self.get("args", template)
+        if stored is MISSING:
+            return None
+        stored = {field: _slot(value) for field, value in stored.items()}
+        try:
+            return fill_slots(stored, dates, ids)
+        except IndexError:
+            return None
+
+    def put_args(self, question: str, args: dict):
+        template, dates, ids = abstract(question)
+        stored = to_slots(args, dates, ids)
+        # Относительные даты («вчера») в шаблон не превращаются - не делимся
+        if stored is not None and template:
+            self.put("args", template, stored, ttl=settings.shared_cache_args_ttl)
+
+    async def get_answer(self, sql: str):
+        # Без известной версии данных нельзя отличить свежий ответ от устаревшего
+        if answer_cache.data_version is None:
+            return MISSING
+        return await self.get("answer", sql, answer_cache.data_version)
+
+    def put_answer(self, sql: str, result):
+        if answer_cache.data_version is not None:
+            self.put("answer", sql, result, answer_cache.data_version, settings.answer_cache_ttl)
+
+    # --- Инвалидация ---
+
+    def apply_version(self, version) -> bool:
+        """Новая версия данных: сбросить кэш ответов процесса и сообщить подписчикам"""
+        previous = answer_cache.data_version
+        if version is None or not answer_cache.set_data_version(version):
+            return False
+        # Первая известная версия - сбрасывать и прогревать нечего
+        if previous is None:
+            return False
+        metrics.inc("shared_cache_invalidations_total")
+        logger.info(f"Data version {version}: answer cache invalidated")
+        for callback in self.subscribers:
+            callback(version)
+        return True
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            version = int(payload)
+        except ValueError:
+            logger.warning(f"Bad {INVALIDATE_CHANNEL} payload: {payload!r}")
+            return
+        self.apply_version(version)
+
+    async def _connect(self):
+        params = dict(
+            user=settings.postgres_user,
+            password=settings.postgres_password,
+            database=settings.postgres_db,
+            host=settings.postgres_host,
+            port=settings.postgres_port
+        )
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(min_size=1, max_size=self.pool_size, **params)
+        if self._listener is None or self._listener.is_closed():
+            self._listener = await asyncpg.connect(**params)
+            await self._listener.add_listener(INVALIDATE_CHANNEL, self._on_notify)
+            # Уведомления, пришедшие без соединения, потеряны - сверяем версию
+            self.apply_version(await self._listener.fetchval("SELECT version FROM data_version WHERE id = 1"))
+
+    async def _cleanup(self):
+        deleted = await self._pool.execute("DELETE FROM shared_cache WHERE expires_at < NOW()")
+        logger.debug(f"Shared cache cleanup: {deleted}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RECONNECT_INTERVAL)
+            try:
+                await self._connect()
+                if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+                    self._last_cleanup = time.monotonic()
+                    await self._cleanup()
+            except Exception as e:
+                logger.warning(f"Shared cache maintenance failed: {e!r}")
+
+    async def start(self):
+        """Подключиться и начать слушать инвалидации; без БД работает только первый уровень"""
+        try:
+            await self._connect()
+        except Exception as e:
+            logger.warning(f"Shared cache unavailable, will retry: {e!r}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._writes, return_exceptions=True)
+        if self._listener is not None and not self._listener.is_closed():
+            await self._listener.close()
+        self._listener = None
+        if self._pool is not None:
+            await self._pool.close()
+        self._pool = None
+
+
+async def cached_answer(sql: str):
+    """Ответ из кэша процесса, затем из общего кэша (с копированием в кэш процесса); MISSING - нет нигде"""
+    result = answer_cache.get(sql)
+    if result is MISSING and settings.shared_cache_enabled:
+        result = await shared_cache.get_answer(sql)
+        if result is not MISSING:
+            answer_cache.put(sql, result)
+    return result
+
+
+def store_answer(sql: str, result):
+    answer_cache.put(sql, result)
+    if settings.shared_cache_enabled:
+        shared_cache.put_answer(sql, result)
+
+
+shared_cache = SharedCache(settings.shared_cache_timeout, settings.shared_cache_pool_size,
+                           settings.shared_cache_cleanup_interval)
@@ -0,0 +1,355 @@
+"""
+Similarity index over previously answered questions.
+
+A question is turned into a template: dates and creator ids are replaced by
+slots ("<date>", "<id>") and the validated build_sql_query arguments keep
+references to those slots instead of literal values. A new question that is
+close enough to a stored template reuses its arguments with the slots
+re-filled from the new question, so the LLM is only called for real novelties.
+
+Lookup:
+- exact template match - a dict lookup;
+- otherwise MinHash LSH over character trigrams gives a handful of candidates,
+  which are ranked by TF-IDF weighted cosine similarity. Buckets shared by too
+  many questions (e.g. only "сколько всего") are skipped as uninformative.
+
+Arguments with dates that do not come from the question text (e.g. "вчера")
+are not stored: re-using them later would return stale dates. Relative-date
+words are key concepts, so such a question never matches an undated one; the
+same goes for prepositions, negations, comparisons and thresholds ("до",
+"после", "не", "больше 1000"), which turn a question into a different one.
+"""
+import logging
+import math
+import random
+import re
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = ("date_exact", "date_from", "date_to")
+DATE_SLOT = "<date>"
+ID_SLOT = "<id>"
+
+MONTHS = {
+    "январ": 1, "феврал": 2, "март": 3, "апрел": 4, "ма": 5, "июн": 6,
+    "июл": 7, "август": 8, "сентябр": 9, "октябр": 10, "ноябр": 11, "декабр": 12
+}
+MONTH_RE = r"(январ[ья]|феврал[ья]|марта?|апрел[ья]|ма[яй]|июн[ья]|июл[ья]|августа?|сентябр[ья]|октябр[ья]|ноябр[ья]|декабр[ья])"
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+# "с 1 по 5 ноября" - the month is written once for both days
+DAY_RANGE_RE = re.compile(r"\b(\d{1,2})\s+по\s+(\d{1,2})\s+" + MONTH_RE + r"(?:\s+(\d{4}))?", re.IGNORECASE)
+DAY_MONTH_RE = re.compile(r"\b(\d{1,2})\s+" + MONTH_RE + r"(?:\s+(\d{4}))?(?:\s+года)?", re.IGNORECASE)
+CREATOR_RE = re.compile(r"\b[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}\b", re.IGNORECASE)
+WORD_RE = re.compile(r"<date>|<id>|\w+")
+
+# Filler words that do not change the meaning of a question
+STOP_WORDS = frozenset({"в", "во", "у", "и", "а", "ли", "же", "есть", "всего", "системе", "пожалуйста", "скажи", "подскажи"})
+# Colloquial forms -> the word the rest of the questions use
+SYNONYMS = (("видос", "видео"), ("ролик", "видео"), ("лайкос", "лайков"), ("просмотрел", "просмотров"))
+# Words that decide the extracted arguments: two questions can only share an
+# extraction if they mention the same concepts, however similar the rest is
+KEY_TERMS = (
+    ("просмотр", "views"), ("лайк", "likes"), ("коммент", "comments"), ("видео", "videos"),
+    ("разн", "distinct"), ("уникальн", "distinct"), ("вырос", "growth"), ("прирост", "growth"),
+    ("прибав", "growth"), ("креатор", "creator"), ("автор", "creator"),
+    ("выгруз", "export"), ("экспорт", "export"), ("csv", "export"), ("файл", "export"),
+    ("дням", "by_day"), ("ежедневн", "by_day"),
+    # Relative dates are not slots: a question with "вчера" must not reuse an undated extraction
+    ("вчера", "yesterday"), ("позавчера", "day_before_yesterday"), ("сегодня", "today"),
+    ("сутк", "day"), ("дней", "days"), ("недел", "week"), ("месяц", "month"), ("год", "year"),
+    ("средн", "avg"), ("максим", "max"), ("минимал", "min")
+)
+# Short words that flip the meaning of a question: matched as whole words,
+# since as stems they would match most of the vocabulary ("с" - "сколько")
+EXACT_TERMS = {
+    "до": "before", "раньше": "before", "ранее": "before",
+    "после": "after", "позже": "after", "позднее": "after",
+    "с": "since", "со": "since", "начиная": "since", "от": "since",
+    "по": "until", "между": "between",
+    "не": "not", "нет": "not", "ни": "not", "без": "without", "кроме": "except",
+    "больше": "more", "более": "more", "свыше": "more", "выше": "more",
+    "меньше": "less", "менее": "less", "ниже": "less"
+}
+
+# MinHash LSH: BANDS x ROWS hash functions
+BANDS = 8
+ROWS = 3
+MAX_BUCKET = 64
+MAX_CANDIDATES = 32
+# IDF weights are recomputed once the index has grown or shrunk by this share
+IDF_REFRESH = 0.1
+
+# 30-bit values stay single-digit Python ints, which keeps hashing cheap
+HASH_MASK = (1 << 30) - 1
+_rng = random.Random(20251128)
+SEEDS = [_rng.getrandbits(30) for _ in range(BANDS * ROWS)]
+
+
+def _month_number(word: str) -> int:
+    word = word.lower()
+    for stem, number in MONTHS.items():
+        if word.startswith(stem):
+            return number
+    raise ValueError(word)
+
+
+def _make_date(year: Optional[str], month: int, day: str) -> Optional[str]:
+    try:
+        return date(int(year) if year else datetime.now().year, month, int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+def abstract(text: str):
+    """Question -> (template, dates, creator_ids), values in order of appearance"""
+    found = []  # (start, end, slot, value)
+
+    def free(start, end):
+        return all(end <= s or start >= e for s, e, _, _ in found)
+
+    for match in CREATOR_RE.finditer(text):
+        found.append((match.start(), match.end(), ID_SLOT, match.group(0).lower()))
+    for match in ISO_DATE_RE.finditer(text):
+        value = _make_date(match.group(1), int(match.group(2)), match.group(3))
+        if value and free(match.start(), match.end()):
+            found.append((match.start(), match.end(), DATE_SLOT, value))
+    for match in DAY_RANGE_RE.finditer(text):
+        if not free(match.start(), match.end()):
+            continue
+        month = _month_number(match.group(3))
+        first = _make_date(match.group(4), month, match.group(1))
+        second = _make_date(match.group(4), month, match.group(2))
+        if first and second:
+            found.append((match.start(1), match.end(1), DATE_SLOT, first))
+            found.append((match.start(2), match.end(), DATE_SLOT, second))
+    for match in DAY_MONTH_RE.finditer(text):
+        value = _make_date(match.group(3), _month_number(match.group(2)), match.group(1))
+        if value and free(match.start(), match.end()):
+            found.append((match.start(), match.end(), DATE_SLOT, value))
+
+    found.sort()
+    parts, dates, ids, position = [], [], [], 0
+    for start, end, slot, value in found:
+        parts.append(text[position:start])
+        parts.append(f" {slot} ")
+        (dates if slot == DATE_SLOT else ids).append(value)
+        position = end
+    parts.append(text[position:])
+
+    # Word order is ignored: dates and ids keep their order in the lists instead
+    words = WORD_RE.findall("".join(parts).lower().replace("ё", "е"))
+    words = sorted(_canonical(word) for word in words if word not in STOP_WORDS)
+    return " ".join(words), dates, ids
+
+
+def _canonical(word: str) -> str:
+    for stem, replacement in SYNONYMS:
+        if word.startswith(stem):
+            return replacement
+    return word
+
+
+def concepts(template: str) -> frozenset:
+    """Key concepts of a template; numbers left after slotting dates are thresholds and must match too"""
+    found = set()
+    for word in template.split():
+        if word in EXACT_TERMS:
+            found.add(EXACT_TERMS[word])
+        elif word.isdigit():
+            found.add(f"#{word}")
+        else:
+            found.update(concept for stem, concept in KEY_TERMS if word.startswith(stem))
+    return frozenset(found)
+
+
+def features(template: str) -> frozenset:
+    """Character trigrams of each word, padded so word starts and ends count"""
+    grams = set()
+    for word in template.split():
+        if word in (DATE_SLOT, ID_SLOT):
+            grams.add(word)
+            continue
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return frozenset(grams)
+
+
+# gram -> its value under every hash function; the trigram vocabulary is small,
+# so the signature becomes an element-wise min over cached rows
+_gram_rows = {}
+MAX_GRAM_ROWS = 500000
+
+
+def _gram_row(gram) -> tuple:
+    row = _gram_rows.get(gram)
+    if row is None:
+        if len(_gram_rows) >= MAX_GRAM_ROWS:
+            _gram_rows.clear()
+        value = hash(gram) & HASH_MASK
+        row = _gram_rows[gram] = tuple(value ^ seed for seed in SEEDS)
+    return row
+
+
+def minhash_bands(grams: frozenset) -> list:
+    signature = list(map(min, zip(*map(_gram_row, grams))))
+    return [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+
+def to_slots(args: dict, dates: list, ids: list) -> Optional[dict]:
+    """Replace literal dates/creator ids in args by slot references; None if impossible"""
+    stored = dict(args)
+    for field in DATE_FIELDS:
+        value = args.get(field)
+        if not value:
+            continue
+        if value not in dates:
+            return None
+        stored[field] = (DATE_SLOT, dates.index(value))
+    creator = args.get("creator_id")
+    if creator:
+        normalized = creator.lower()
+        if normalized not in ids:
+            return None
+        stored["creator_id"] = (ID_SLOT, ids.index(normalized))
+    return stored
+
+
+def fill_slots(stored: dict, dates: list, ids: list) -> dict:
+    args = {}
+    for field, value in stored.items():
+        if isinstance(value, tuple):
+            slot, index = value
+            value = (dates if slot == DATE_SLOT else ids)[index]
+        args[field] = value
+    return args
+
+
+class Entry:
+    __slots__ = ("template", "grams", "bands", "args", "concepts", "date_count", "id_count", "norm", "generation")
+
+    def __init__(self, template, grams, bands, args, date_count, id_count):
+        self.template = template
+        self.grams = grams
+        self.bands = bands
+        self.args = args
+        self.concepts = concepts(template)
+        self.date_count = date_count
+        self.id_count = id_count
+        self.norm = 0.0
+        self.generation = -1
+
+
+class SimilarityIndex:
+    def __init__(self, threshold: float = 0.7, max_entries: int = 100000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # template -> Entry, in insertion order for eviction
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.document_frequency = {}
+        # gram -> idf^2, cached until the index size drifts by IDF_REFRESH
+        self.weights = {}
+        self.weights_size = 0
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _weight(self, gram) -> float:
+        weight = self.weights.get(gram)
+        if weight is None:
+            idf = math.log((1 + len(self.entries)) / (1 + self.document_frequency.get(gram, 0))) + 1
+            weight = self.weights[gram] = idf * idf
+        return weight
+
+    def _refresh_weights(self):
+        size = len(self.entries)
+        if abs(size - self.weights_size) > IDF_REFRESH * max(self.weights_size, 100):
+            self.weights = {}
+            self.weights_size = size
+            self.generation += 1
+
+    def _cosine(self, query_weights: dict, query_norm: float, entry: Entry) -> float:
+        if entry.generation != self.generation:
+            entry.norm = math.sqrt(sum(map(self._weight, entry.grams)))
+            entry.generation = self.generation
+        dot = sum(map(query_weights.__getitem__, entry.grams & query_weights.keys()))
+        return dot / (query_norm * entry.norm) if entry.norm else 0.0
+
+    def add(self, question: str, args: dict) -> bool:
+        """Remember validated arguments for a question; False if they can't be templated"""
+        template, dates, ids = abstract(question)
+        stored = to_slots(args, dates, ids)
+        if stored is None or not template:
+            return False
+
+        if template in self.entries:
+            self.entries.move_to_end(template)
+            self.entries[template].args = stored
+            return True
+
+        grams = features(template)
+        entry = Entry(template, grams, minhash_bands(grams), stored, len(dates), len(ids))
+        self.entries[template] = entry
+        for key in entry.bands:
+            self.buckets.setdefault(key, []).append(entry)
+        for gram in grams:
+            self.document_frequency[gram] = self.document_frequency.get(gram, 0) + 1
+
+        while len(self.entries) > self.max_entries:
+            self._remove(self.entries.popitem(last=False)[1])
+        return True
+
+    def _remove(self, entry: Entry):
+        for key in entry.bands:
+            bucket = self.buckets[key]
+            bucket.remove(entry)
+            if not bucket:
+                del self.buckets[key]
+        for gram in entry.grams:
+            count = self.document_frequency[gram] - 1
+            if count:
+                self.document_frequency[gram] = count
+            else:
+                del self.document_frequency[gram]
+
+    def lookup(self, question: str) -> Optional[tuple]:
+        """(args, score) for a close enough known question, or None"""
+        template, dates, ids = abstract(question)
+        entry = self.entries.get(template)
+        if entry is not None:
+            return fill_slots(entry.args, dates, ids), 1.0
+
+        grams = features(template)
+        if not grams:
+            return None
+        key_concepts = concepts(template)
+        candidates = {}
+        for key in minhash_bands(grams):
+            bucket = self.buckets.get(key)
+            if bucket and len(bucket) <= MAX_BUCKET:
+                for candidate in bucket:
+                    # Same concepts, and slots must line up with the values found in the new question
+                    if (candidate.concepts == key_concepts and candidate.date_count == len(dates)
+                            and candidate.id_count == len(ids)):
+                        candidates[candidate.template] = candidate
+                if len(candidates) >= MAX_CANDIDATES:
+                    break
+        if not candidates:
+            return None
+
+        self._refresh_weights()
+        query_weights = {gram: self._weight(gram) for gram in grams}
+        query_norm = math.sqrt(sum(query_weights.values()))
+        best, best_score = None, 0.0
+        for candidate in candidates.values():
+            score = self._cosine(query_weights, query_norm, candidate)
+            if score > best_score:
+                best, best_score = candidate, score
+        if best_score < self.threshold:
+            return None
+        return fill_slots(best.args, dates, ids), best_score
@@ -0,0 +1,235 @@
+"""
+Спекулятивное выполнение SQL параллельно с вызовом LLM.
+
+Пока LLM извлекает параметры, по ключевым словам вопроса угадываются самые
+вероятные параметры, и соответствующие запросы сразу выполняются на пуле.
+Если LLM подтвердила те же параметры (совпадает построенный SQL), готовый
+результат отдается сразу; иначе спекулятивные запросы отменяются.
+Ответы, уже лежащие в кэше ответов процесса (src.cache) или в общем кэше
+процессов (src.shared_cache), в БД не запрашиваются.
+
+Метрики для настройки:
+- speculation_questions_total{outcome=hit|miss|none} - доля вопросов со
+  спекуляцией и доля попаданий;
+- speculative_queries_total{outcome=hit|wasted|failed};
+- speculation_wasted_seconds_total - время БД, потраченное впустую.
+"""
+import asyncio
+import logging
+import re
+import time
+from src import metrics
+from src.config import settings
+from src.cost_guard import QueryTooExpensive, cost_guard
+from src.database import execute_rows, execute_scalar
+from src.export import Export
+from src.deadline import Deadline, NO_DEADLINE
+from src.llm_engine import build_sql, extract_params, lookup_similar, returns_rows, validate_args
+from src.querylog import RequestTrace
+from src.cache import MISSING, answer_cache
+from src.shared_cache import cached_answer, store_answer
+from src.similarity import abstract
+
+logger = logging.getLogger(__name__)
+
+# Основа слова -> (поле на videos или None, если его нет; поле прироста на video_snapshots)
+METRIC_STEMS = (
+    ("просмотр", "views_count", "delta_views_count"),
+    ("лайк", "likes_count", "delta_likes_count"),
+    ("коммент", None, "delta_comments_count")
+)
+DISTINCT_RE = re.compile(r"\b(разн|уникальн)", re.IGNORECASE)
+GROWTH_RE = re.compile(r"\b(вырос|прирост|прибав|получ)", re.IGNORECASE)
+# Относительные даты угадать нельзя - их разрешает LLM
+RELATIVE_RE = re.compile(r"\b(вчера|сегодня|позавчера|недел|месяц|дн[еяи]|год)", re.IGNORECASE)
+# Выгрузки (EXPORT) читаются курсором и не кэшируются - их не угадываем
+EXPORT_RE = re.compile(r"\b(выгруз|экспорт|csv|файл)", re.IGNORECASE)
+
+# Одновременно выполняемые спекулятивные запросы на процесс, чтобы не занять весь пул
+_inflight = 0
+
+
+def guess_args(user_text: str) -> list:
+    """Вероятные параметры build_sql_query по ключевым словам, от самых вероятных"""
+    template, dates, ids = abstract(user_text)
+    # Числа вне дат (пороги, топы) и относительные даты - не угадываем
+    if any(ch.isdigit() for ch in template) or RELATIVE_RE.search(template) or EXPORT_RE.search(template):
+        return []
+
+    stems = [(total, delta) for stem, total, delta in METRIC_STEMS if stem in template]
+    # Несколько метрик сразу считаются одним запросом другой формы - не угадываем
+    if len(stems) > 1:
+        return []
+    total_field, delta_field = stems[0] if stems else (None, None)
+
+    common = {}
+    if len(dates) == 1:
+        common["date_exact"] = dates[0]
+    elif len(dates) == 2:
+        common["date_from"], common["date_to"] = dates
+    elif dates:
+        return []
+    if len(ids) == 1:
+        common["creator_id"] = ids[0]
+    elif ids:
+        return []
+
+    guesses = []
+    if DISTINCT_RE.search(template):
+        guesses.append({"intent": "UNIQUE_ACTIVE", "target_table": "video_snapshots",
+                        "metric_field": delta_field or "delta_views_count"})
+    elif GROWTH_RE.search(template):
+        if delta_field:
+            guesses.append({"intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots", "metric_field": delta_field})
+    elif delta_field:
+        if total_field:
+            guesses.append({"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": total_field})
+        # «Сколько просмотров 28 ноября» часто означает прирост за день
+        if dates:
+            guesses.append({"intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots", "metric_field": delta_field})
+    elif "видео" in template:
+        guesses.append({"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"})
+
+    guesses = [dict(guess, **common) for guess in guesses]
+    return [guess for guess in guesses if not validate_args(guess, user_text)]
+
+
+async def _speculate(args: dict, sql: str, deadline: Deadline):
+    """Спекулятивный запрос; возвращает (результат, время выполнения)"""
+    start = time.perf_counter()
+    return await execute(args, sql, deadline), time.perf_counter() - start
+
+
+def _release(task: asyncio.Task):
+    # Через done-callback: задача, отмененная до первого шага, finally корутины не выполняет
+    global _inflight
+    _inflight -= 1
+
+
+def start_speculation(user_text: str, deadline: Deadline) -> dict:
+    """Запустить запросы для угаданных параметров: SQL -> (задача, время запуска)"""
+    global _inflight
+    tasks = {}
+    for args in guess_args(user_text)[:settings.speculation_max_queries]:
+        if _inflight >= settings.speculation_max_inflight:
+            break
+        sql = build_sql(args)
+        # Ответ уже в кэше - БД не нужна
+        if sql in tasks or sql in answer_cache.entries:
+            continue
+        _inflight += 1
+        task = asyncio.create_task(_speculate(args, sql, deadline))
+        task.add_done_callback(_release)
+        tasks[sql] = (task, time.perf_counter())
+    return tasks
+
+
+async def discard(tasks: dict):
+    """Отменить ненужные спекулятивные запросы и учесть потраченное время БД"""
+    for task, _ in tasks.values():
+        task.cancel()
+    for task, started in tasks.values():
+        try:
+            _, elapsed = await task
+        except BaseException:
+            elapsed = time.perf_counter() - started
+        metrics.inc("speculative_queries_total", outcome="wasted")
+        metrics.inc("speculation_wasted_seconds_total", elapsed)
+
+
+async def execute(args: dict, sql: str, deadline: Deadline = NO_DEADLINE):
+    """Выполнить SQL: одно значение или строки (несколько метрик, ряд по дням).
+
+    Перед выполнением стоимость запроса оценивается (src.cost_guard): слишком
+    дорогой запрос не выполняется - бросается QueryTooExpensive с подсказкой.
+    """
+    async def run():
+        if returns_rows(args):
+            return await execute_rows(sql, deadline, keys=1 if args.get("group_by") == "day" else 0)
+        return await execute_scalar(sql, deadline)
+
+    if settings.cost_guard_enabled:
+        return await cost_guard.run(sql, run, args, deadline)
+    return await run()
+
+
+async def execute_cached(args: dict, sql: str, deadline: Deadline = NO_DEADLINE, trace: RequestTrace = None):
+    """Результат SQL из кэшей ответов или из БД (с записью в кэши)"""
+    result = await cached_answer(sql)
+    if result is MISSING:
+        result = await execute(args, sql, deadline)
+        store_answer(sql, result)
+    elif trace is not None:
+        trace.path += "+cache"
+    return result
+
+
+async def answer(user_text: str, deadline: Deadline = NO_DEADLINE, trace: RequestTrace = None):
+    """Результат SQL для вопроса; при совпадении догадки с LLM - без ожидания запроса.
+
+    Для выгрузки (intent EXPORT) возвращается src.export.Export без выполнения,
+    для нескольких метрик и ряда по дням - список строк (src.answers).
+    Путь ответа, параметры, SQL и время этапов записываются в trace.
+    """
+    trace = trace or RequestTrace(user_text)
+    # Похожий вопрос уже разбирался - LLM не нужна, спекулировать незачем
+    args = lookup_similar(user_text) if settings.similarity_enabled else None
+    if args is not None:
+        trace.path, trace.args = "similarity", args
+        trace.sql = sql = build_sql(args)
+        logger.info(f"Constructed SQL: {sql}")
+        if args["intent"] == "EXPORT":
+            return Export(sql, args)
+        with trace.stage("sql"):
+            return await execute_cached(args, sql, deadline, trace)
+
+    tasks = start_speculation(user_text, deadline) if settings.speculation_enabled else {}
+    speculated = bool(tasks)
+    try:
+        with trace.stage("llm"):
+            args = await extract_params(user_text, deadline, lookup=False, trace=trace)
+    except BaseException:
+        await discard(tasks)
+        raise
+
+    trace.args = args
+    trace.sql = sql = build_sql(args)
+    logger.info(f"Constructed SQL: {sql}")
+
+    # Выгрузка не считается здесь: строки читает курсором src.export
+    if args["intent"] == "EXPORT":
+        await discard(tasks)
+        metrics.inc("speculation_questions_total", outcome="miss" if speculated else "none")
+        return Export(sql, args)
+
+    cached = await cached_answer(sql)
+    if cached is not MISSING:
+        await discard(tasks)
+        trace.path += "+cache"
+        metrics.inc("speculation_questions_total", outcome="miss" if speculated else "none")
+        return cached
+
+    hit = tasks.pop(sql, None)
+    await discard(tasks)
+
+    if hit is not None:
+        try:
+            with trace.stage("sql"):
+                result, _ = await hit[0]
+            store_answer(sql, result)
+            trace.path = "speculation"
+            metrics.inc("speculative_queries_total", outcome="hit")
+            metrics.inc("speculation_questions_total", outcome="hit")
+            return result
+        except (asyncio.CancelledError, QueryTooExpensive):
+            raise
+        except Exception as e:
+            # Ошибка спекулятивного запроса - выполняем обычным путем
+            logger.warning(f"Speculative query failed: {e}")
+            metrics.inc("speculative_queries_total", outcome="failed")
+
+    metrics.inc("speculation_questions_total", outcome="miss" if speculated else "none")
+    with trace.stage("sql"):
+        result = await execute(args, sql, deadline)
+    store_answer(sql, result)
+    return result
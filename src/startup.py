@@ -0,0 +1,51 @@
+"""
+Замер этапов запуска бота.
+
+Независимые этапы (схема БД, пул соединений, клиент LLM, сессия бота)
+выполняются параллельно через parallel(), остальные замеряются через
+phase(). В конце запуска report() печатает время каждого этапа и общее
+время с импорта модуля - по нему видно, что замедляет рестарты при деплое.
+Время этапов также доступно в /metrics (startup_phase_seconds).
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from src import metrics
+
+
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, name: str, seconds: float):
+        self.phases[name] = seconds
+        metrics.set_gauge("startup_phase_seconds", round(seconds, 3), phase=name)
+
+    @asynccontextmanager
+    async def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - start)
+
+    async def _run(self, name: str, awaitable):
+        async with self.phase(name):
+            return await awaitable
+
+    async def parallel(self, **phases) -> dict:
+        """Выполнить этапы одновременно; результаты по именам этапов"""
+        results = await asyncio.gather(*(self._run(name, awaitable) for name, awaitable in phases.items()))
+        return dict(zip(phases, results))
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.started
+        metrics.set_gauge("startup_seconds", round(total, 3))
+        width = max(map(len, self.phases), default=0)
+        lines = [f"Запуск за {total:.2f} с:"]
+        lines += [f"  {name:<{width}}  {seconds:6.3f} с" for name, seconds in self.phases.items()]
+        return "\n".join(lines)
+
+
+startup_timer = StartupTimer()
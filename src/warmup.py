@@ -0,0 +1,205 @@
+"""
+Прогрев кэшей при старте и после перезагрузки данных.
+
+Первые пользователи после рестарта или load_data не должны платить полную
+цену LLM и БД за популярные вопросы. Прогрев:
+1. извлекает параметры для примеров из /start (заполняет индекс похожих
+   вопросов) - так появляются «формы» вопросов;
+2. добавляет самые частые формы из query_log (параметры без дат);
+3. для каждой формы считает ответы за все время, сегодня, вчера и последние
+   7 дней и кладет их в кэш ответов.
+
+Запросы выполняются параллельно (warmup_concurrency) в пределах общего
+бюджета warmup_budget; ответы, уже посчитанные другим процессом, берутся из
+общего кэша (src.shared_cache). Фоновая задача следит за версией данных
+(таблица data_version, ее увеличивает загрузчик) и при смене сбрасывает кэш
+ответов и повторяет прогрев.
+"""
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from src import metrics
+from src.cache import MISSING, answer_cache
+from src.config import settings
+from src.cost_guard import QueryTooExpensive, cost_guard
+from src.database import execute_query, execute_scalar
+from src.deadline import Deadline, DeadlineExceeded
+from src.llm_engine import build_sql, extract_params
+from src.shared_cache import cached_answer, shared_cache, store_answer
+
+logger = logging.getLogger(__name__)
+
+# Примеры вопросов из /start - их спросят первыми
+EXAMPLE_QUESTIONS = [
+    "Сколько всего видео?",
+    "Сколько всего просмотров?",
+    "Сколько лайков прибавилось 28 ноября 2025?",
+    "Сколько комментариев было за 27 ноября 2025?",
+]
+
+DATE_FIELDS = ("date_exact", "date_from", "date_to")
+SHAPE_FIELDS = ("intent", "target_table", "metric_field", "creator_id")
+WINDOWS = ("all", "today", "yesterday", "last_7_days")
+
+
+def shape_of(args: dict) -> tuple:
+    """Форма вопроса - параметры без дат"""
+    return tuple(args.get(field) for field in SHAPE_FIELDS)
+
+
+def window_args(shape: tuple, window: str, today: date) -> dict:
+    args = {field: value for field, value in zip(SHAPE_FIELDS, shape) if value}
+    if window == "today":
+        args["date_exact"] = today.isoformat()
+    elif window == "yesterday":
+        args["date_exact"] = (today - timedelta(days=1)).isoformat()
+    elif window == "last_7_days":
+        args["date_from"] = (today - timedelta(days=6)).isoformat()
+        args["date_to"] = today.isoformat()
+    return args
+
+
+async def read_data_version():
+    """Текущая версия данных (None, если таблицы еще нет)"""
+    try:
+        return await execute_scalar("SELECT version FROM data_version WHERE id = 1")
+    except Exception as e:
+        logger.warning(f"Cannot read data version: {e}")
+        return None
+
+
+async def top_shapes(limit: int) -> list:
+    """Самые частые формы вопросов из журнала за неделю (без выгрузок)"""
+    try:
+        rows = await execute_query(f"""
+            SELECT args->>'intent', args->>'target_table', args->>'metric_field', args->>'creator_id'
+            FROM query_log
+            WHERE args IS NOT NULL AND outcome IN ('ok', 'empty') AND args->>'intent' <> 'EXPORT'
+              AND created_at >= NOW() - INTERVAL '7 days'
+            GROUP BY 1, 2, 3, 4
+            ORDER BY COUNT(*) DESC
+            LIMIT {int(limit)}
+        """)
+    except Exception as e:
+        logger.warning(f"Cannot read top shapes from query_log: {e}")
+        return []
+    return [tuple(row) for row in rows]
+
+
+async def warm(trigger: str = "startup") -> dict:
+    """Один прогон прогрева в пределах бюджета; возвращает отчет"""
+    start = time.perf_counter()
+    deadline = Deadline(settings.warmup_budget)
+    semaphore = asyncio.Semaphore(settings.warmup_concurrency)
+    report = {"extracted": 0, "queries": 0, "shared": 0, "cached": 0, "failed": 0}
+
+    async def extract(question: str):
+        async with semaphore:
+            try:
+                args = await extract_params(question, deadline)
+            except Exception as e:
+                logger.warning(f"Warmup extraction failed for {question!r}: {e}")
+                return None
+        report["extracted"] += 1
+        return shape_of(args)
+
+    async def compute(sql: str, args: dict):
+        async with semaphore:
+            # Ответ уже посчитан другим процессом - берем из общего кэша
+            if await cached_answer(sql) is not MISSING:
+                report["shared"] += 1
+                metrics.inc("warmup_queries_total", outcome="shared")
+                return
+            try:
+                # Окно «все время» без фильтров может оказаться слишком дорогим - его не греем
+                if settings.cost_guard_enabled:
+                    result = await cost_guard.run(sql, lambda: execute_scalar(sql, deadline), args, deadline)
+                else:
+                    result = await execute_scalar(sql, deadline)
+            except QueryTooExpensive:
+                metrics.inc("warmup_queries_total", outcome="too_expensive")
+                return
+            except Exception as e:
+                report["failed"] += 1
+                metrics.inc("warmup_queries_total", outcome="timeout" if isinstance(e, DeadlineExceeded) else "error")
+                return
+        store_answer(sql, result)
+        report["queries"] += 1
+        metrics.inc("warmup_queries_total", outcome="ok")
+
+    shapes = list(dict.fromkeys(
+        [shape for shape in await asyncio.gather(*map(extract, EXAMPLE_QUESTIONS)) if shape]
+        + await top_shapes(settings.warmup_top_shapes)
+    ))
+
+    today = date.today()
+    # SQL -> параметры (для подсказки cost_guard)
+    queries = {}
+    for shape in shapes:
+        for window in WINDOWS:
+            args = window_args(shape, window, today)
+            sql = build_sql(args)
+            if sql in answer_cache.entries:
+                report["cached"] += 1
+            else:
+                queries.setdefault(sql, args)
+    await asyncio.gather(*(compute(sql, args) for sql, args in queries.items()))
+
+    report["shapes"] = len(shapes)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    metrics.inc("warmup_runs_total", trigger=trigger)
+    metrics.observe("warmup_seconds", report["seconds"])
+    logger.info(f"Cache warmup ({trigger}): {report}")
+    return report
+
+
+class Warmer:
+    """Прогрев при старте и повторно при каждой смене версии данных.
+
+    О смене версии сообщает общий кэш (NOTIFY от загрузчика); опрос
+    data_version остается запасным путем, если уведомление потерялось.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._changed = asyncio.Event()
+
+    def notify(self, version):
+        """Версия данных уже применена к кэшу ответов - нужен повторный прогрев"""
+        self._changed.set()
+
+    async def start(self):
+        """Прогреть кэши (до начала обслуживания) и начать следить за версией данных"""
+        answer_cache.set_data_version(await read_data_version())
+        if self.notify not in shared_cache.subscribers:
+            shared_cache.subscribers.append(self.notify)
+        await warm("startup")
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), settings.warmup_poll_interval)
+                trigger = "notify"
+            except asyncio.TimeoutError:
+                version = await read_data_version()
+                if version is None or not answer_cache.set_data_version(version):
+                    continue
+                trigger = "data_version"
+            self._changed.clear()
+            logger.info(f"Data version changed to {answer_cache.data_version}, re-warming caches")
+            try:
+                await warm(trigger)
+            except Exception as e:
+                logger.warning(f"Cache warmup failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+warmer = Warmer()
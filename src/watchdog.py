@@ -0,0 +1,86 @@
+"""
+Сторож event loop'а: постоянное измерение лага и поиск блокирующих вызовов.
+
+Корутина-пульс каждые interval секунд засыпает и измеряет, насколько позже
+она проснулась (лаг), и обновляет отметку времени. Отдельный поток следит
+за этой отметкой: если loop не отвечает дольше порога, значит текущий
+callback блокирует loop - поток снимает его стек и пишет в лог.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from src import metrics
+from src.config import settings
+from src.profiler import capture_stack
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        # Последние найденные блокировки: (время, длительность, стек)
+        self.blocks = deque(maxlen=20)
+        self._thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Запустить сторожа (вызывать из потока event loop'а)"""
+        self._thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._pulse())
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (interval={self.interval}s, threshold={self.threshold}s)")
+
+    async def stop(self):
+        """Остановить сторожа; без запуска ничего не делает"""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        self._stop.clear()
+
+    async def _pulse(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            metrics.observe("event_loop_lag_seconds", lag)
+            metrics.set_gauge("asyncio_tasks", len(asyncio.all_tasks()))
+            self.heartbeat = time.monotonic()
+
+    def _monitor(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold:
+                continue
+            # Одна блокировка - один отчет, даже если она длится долго
+            if reported == heartbeat:
+                continue
+            reported = heartbeat
+
+            stack = capture_stack(self._thread_id)
+            self.blocks.append((time.time(), stalled, stack))
+            metrics.inc("event_loop_blocked_total")
+            logger.warning(
+                f"Event loop blocked for {stalled * 1000:.0f}+ ms:\n  " + "\n  ".join(stack[-15:])
+            )
+
+
+watchdog = LoopWatchdog(settings.loop_watchdog_interval, settings.loop_block_threshold)
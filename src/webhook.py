@@ -0,0 +1,74 @@
+"""
+Режим webhook: встроенный aiohttp сервер вместо long polling.
+
+Telegram (или локальный скрипт) присылает обновления POST-запросами на
+WEBHOOK_PATH. Ответ 200 отдается сразу, а само обновление обрабатывается
+в фоновой задаче, поэтому обновления обрабатываются конкурентно.
+"""
+import asyncio
+import logging
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from src import metrics
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@web.middleware
+async def count_requests(request: web.Request, handler):
+    """Считаем входящие запросы по пути и статусу ответа"""
+    response = await handler(request)
+    metrics.inc("webhook_requests_total", path=request.path, status=response.status)
+    return response
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def build_app(dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str = "") -> web.Application:
+    """aiohttp приложение с обработчиком webhook, /metrics и /healthz"""
+    app = web.Application(middlewares=[count_requests])
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=secret_token or None
+    ).register(app, path=path)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/healthz", handle_health)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, on_serving=None):
+    """Запустить webhook сервер и работать до отмены; on_serving вызывается, когда сервер слушает"""
+    app = build_app(dispatcher, bot, settings.webhook_path, settings.webhook_secret)
+
+    # Без публичного URL сервер принимает только локальные (синтетические) обновления
+    if settings.webhook_url:
+        await bot.set_webhook(
+            settings.webhook_url.rstrip("/") + settings.webhook_path,
+            secret_token=settings.webhook_secret or None,
+            allowed_updates=dispatcher.resolve_used_update_types()
+        )
+        logger.info(f"Webhook registered at {settings.webhook_url}")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    print(f"Webhook сервер слушает http://{settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+    if on_serving is not None:
+        on_serving()
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
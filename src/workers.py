@@ -0,0 +1,201 @@
+"""
+Многопроцессный режим: один webhook-вход и N процессов-обработчиков.
+
+Главный процесс принимает обновления по HTTP и раскладывает их по очередям
+воркеров по хешу chat_id: все сообщения одного чата попадают в один процесс
+и обрабатываются там строго по порядку, разные чаты - параллельно.
+Каждый воркер запускается через spawn и поэтому создает свои event loop,
+пул соединений с БД, клиента LLM и сессию бота.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import secrets
+import zlib
+from aiohttp import web
+from src import metrics
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Сигнал остановки воркера
+STOP = None
+
+
+def update_chat_id(update: dict):
+    """chat_id из обновления любого типа (None, если чата нет)"""
+    for value in update.values():
+        if isinstance(value, dict):
+            chat = value.get("chat") or (value.get("message") or {}).get("chat")
+            if chat:
+                return chat.get("id")
+    return None
+
+
+def pick_worker(update: dict, workers: int) -> int:
+    """Номер воркера для обновления: по chat_id, иначе по update_id"""
+    key = update_chat_id(update)
+    if key is None:
+        key = update.get("update_id", 0)
+    return zlib.crc32(str(key).encode()) % workers
+
+
+class ChatSequencer:
+    """Последовательная обработка внутри чата, параллельная между чатами"""
+
+    def __init__(self):
+        self.locks = {}
+        self.pending = {}
+        self.tasks = set()
+
+    def submit(self, chat_id, coro_factory):
+        # Lock в asyncio отдается в порядке очереди, поэтому порядок сообщений сохраняется
+        lock = self.locks.get(chat_id)
+        if lock is None:
+            lock = self.locks[chat_id] = asyncio.Lock()
+        self.pending[chat_id] = self.pending.get(chat_id, 0) + 1
+        task = asyncio.create_task(self._run(chat_id, lock, coro_factory))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, chat_id, lock: asyncio.Lock, coro_factory):
+        try:
+            async with lock:
+                await coro_factory()
+        except Exception as e:
+            logger.error(f"Update processing failed in chat {chat_id}: {e}")
+        finally:
+            # Последнее обновление чата - освобождаем память под его lock
+            self.pending[chat_id] -= 1
+            if not self.pending[chat_id]:
+                del self.pending[chat_id]
+                del self.locks[chat_id]
+
+
+async def serve_worker(index: int, queue):
+    """Цикл воркера: читает обновления из очереди и скармливает их диспетчеру"""
+    from src import profiler
+    from src.bot import bot, dp, prepare
+    from src.startup import startup_timer
+    from src.watchdog import watchdog
+
+    # /profile обрабатывает воркер, получивший команду: профилируется его event loop
+    profiler.install(f"worker {index}")
+
+    if settings.loop_watchdog_enabled:
+        watchdog.start()
+
+    loop = asyncio.get_running_loop()
+    sequencer = ChatSequencer()
+    await prepare(schema=False)
+    await dp.emit_startup(bot=bot)
+    print(f"[worker {index}] started")
+    print(startup_timer.report())
+
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is STOP:
+                break
+            update = json.loads(raw)
+            sequencer.submit(
+                update_chat_id(update),
+                lambda update=update: dp.feed_raw_update(bot, update)
+            )
+        if sequencer.tasks:
+            await asyncio.gather(*sequencer.tasks, return_exceptions=True)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        print(f"[worker {index}] stopped")
+
+
+def worker_main(index: int, queue):
+    """Точка входа процесса-воркера"""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve_worker(index, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+def build_ingress_app(queues: list, path: str, secret_token: str = "") -> web.Application:
+    """Webhook-вход: проверяет секрет, выбирает воркера и сразу отвечает 200"""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and not secrets.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret_token
+        ):
+            return web.Response(body="Unauthorized", status=401)
+
+        raw = await request.read()
+        try:
+            update = json.loads(raw)
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+
+        index = pick_worker(update, len(queues))
+        queues[index].put(raw)
+        metrics.inc("ingress_updates_total", worker=index)
+        return web.json_response({})
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+async def run_ingress(queues: list):
+    """Запустить webhook-вход и работать до отмены"""
+    if settings.webhook_url:
+        from src.bot import bot, dp
+        await bot.set_webhook(
+            settings.webhook_url.rstrip("/") + settings.webhook_path,
+            secret_token=settings.webhook_secret or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        await bot.session.close()
+        logger.info(f"Webhook registered at {settings.webhook_url}")
+
+    app = build_ingress_app(queues, settings.webhook_path, settings.webhook_secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    print(
+        f"Webhook вход слушает http://{settings.webhook_host}:{settings.webhook_port}"
+        f"{settings.webhook_path}, воркеров: {len(queues)}"
+    )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def run_workers(workers: int):
+    """Запустить N процессов-воркеров и общий webhook-вход в текущем процессе"""
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(target=worker_main, args=(i, queues[i]), name=f"bot-worker-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        asyncio.run(run_ingress(queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(STOP)
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
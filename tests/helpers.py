@@ -0,0 +1,82 @@
+"""
+Shared pieces of the offline tests: an LLM stand-in, the check report and
+the guard for checks that need a running PostgreSQL
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+
+def completion(args: dict, usage: tuple = None):
+    """Minimal ChatCompletion shape read by llm_engine, with (prompt, completion) token usage if given"""
+    call = SimpleNamespace(function=SimpleNamespace(name="build_sql_query", arguments=json.dumps(args)))
+    response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(tool_calls=[call]))])
+    if usage is not None:
+        response.usage = SimpleNamespace(prompt_tokens=usage[0], completion_tokens=usage[1])
+    return response
+
+
+class StubClient:
+    """Stand-in for AsyncOpenAI answering build_sql_query.
+
+    answer is the extraction of every call: a dict, a list answered in order,
+    or a function of the request; an exception instead of an extraction is
+    raised. delay is awaited before answering (cancellations are counted),
+    usage is a function of the request returning (prompt, completion) tokens.
+    Every request is kept in requests.
+    """
+
+    def __init__(self, answer, delay: float = 0.0, usage=None):
+        self.answer = list(answer) if isinstance(answer, list) else answer
+        self.delay = delay
+        self.usage = usage
+        self.requests = []
+        self.cancelled = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @property
+    def calls(self) -> int:
+        return len(self.requests)
+
+    @property
+    def models(self) -> list:
+        return [request.get("model") for request in self.requests]
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(self.answer, list):
+            answer = self.answer.pop(0)
+        elif callable(self.answer):
+            answer = self.answer(kwargs)
+        else:
+            answer = self.answer
+        if isinstance(answer, BaseException):
+            raise answer
+        return completion(answer, self.usage(kwargs) if self.usage else None)
+
+
+async def with_postgres(what: str, run) -> list:
+    """Checks of run() against a running PostgreSQL; none (with a note) when it is not reachable"""
+    try:
+        return await run()
+    except Exception as e:
+        print(f"[INFO] PostgreSQL not reachable - {what} skipped ({e.__class__.__name__})")
+        return []
+
+
+def summarize(checks: list) -> bool:
+    """Print (description, ok) checks and the summary; True if all passed"""
+    passed = 0
+    for description, ok in checks:
+        print(f"{'[OK]' if ok else '[FAILED]'} {description}")
+        passed += ok
+
+    print("\n" + "=" * 80)
+    print(f"[SUMMARY] Passed: {passed}/{len(checks)}")
+    print("=" * 80)
+    return passed == len(checks)
@@ -31,6 +31,27 @@ def main():
         ("python test_db_connectivity.py", "Database Connectivity Test"),
         ("python test_sql_queries.py", "SQL Query Functionality Test"),
         ("python test_user_requests.py", "User Request Scenarios Test"),
+        ("python test_cassette.py", "LLM Cassette Record/Replay Test"),
+        ("python test_webhook.py", "Webhook Mode Test"),
+        ("python test_workers.py", "Worker Routing Test"),
+        ("python test_sender.py", "Outbound Sender Test"),
+        ("python test_fairness.py", "Fairness Middleware Test"),
+        ("python test_pipeline.py", "Work Queue Test"),
+        ("python test_deadline.py", "Deadline Propagation Test"),
+        ("python test_llm_failover.py", "LLM Hedging / Failover Test"),
+        ("python test_cascade.py", "Model Cascade Test"),
+        ("python test_similarity.py", "Similarity Index Test"),
+        ("python test_speculation.py", "Speculative SQL Test"),
+        ("python test_querylog.py", "Query Log Test"),
+        ("python test_warmup.py", "Cache Warmup Test"),
+        ("python test_routing.py", "Replica Routing Test"),
+        ("python test_shared_cache.py", "Shared Cache Test"),
+        ("python test_startup.py", "Fast Startup Test"),
+        ("python test_export.py", "Streaming Export Test"),
+        ("python test_multi_metric.py", "Multi-Metric Series Test"),
+        ("python test_cost_guard.py", "Cost Guard Test"),
+        ("python test_prompt_modes.py", "Prompt Modes Test"),
+        ("python test_digest.py", "Daily Digest Test"),
     ]
 
     results = []
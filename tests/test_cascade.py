@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test the small -> large model cascade and extraction validation - offline
+"""
+import asyncio
+from src import llm_engine, metrics
+from src.config import settings
+from helpers import StubClient, summarize
+
+SMALL_MODEL = "small-model"
+
+
+def tiers(small, large):
+    """Answer by tier: the small model gets `small`, the large tier (no model) `large`"""
+    return lambda request: small if request.get("model") == SMALL_MODEL else large
+
+
+async def ask(client: StubClient, question: str) -> str:
+    llm_engine.client = client
+    return await llm_engine.get_sql_query(question)
+
+
+async def test_cascade():
+    """Check acceptance, escalation and validation rules"""
+
+    print("=" * 80)
+    print("MODEL CASCADE TEST")
+    print("=" * 80)
+
+    checks = []
+    metrics.reset()
+    original_client = llm_engine.client
+    original_model = settings.llm_small_model
+    original_similarity = settings.similarity_enabled
+    settings.llm_small_model = SMALL_MODEL
+    # Every question must reach the models here, not the similarity index
+    settings.similarity_enabled = False
+    total = {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"}
+    growth = {"intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots",
+              "metric_field": "delta_views_count", "date_exact": "2025-11-28"}
+    try:
+        # 1. Valid small-model extraction is accepted, the large model is not called
+        client = StubClient(tiers(total, growth))
+        sql = await ask(client, "Сколько всего видео?")
+        checks.append(("valid small extraction accepted",
+                       client.models == [SMALL_MODEL] and sql == "SELECT COUNT(id) FROM videos"))
+
+        # 2. Inconsistent intent/table escalates to the large model
+        bad = dict(growth, target_table="videos")
+        client = StubClient(tiers(bad, growth))
+        sql = await ask(client, "На сколько выросли просмотры 28 ноября?")
+        checks.append(("inconsistent extraction escalated",
+                       client.models == [SMALL_MODEL, None] and "video_snapshots" in sql))
+
+        # 3. Date mentioned in the question but not extracted -> escalate
+        client = StubClient(tiers(dict(growth, date_exact=None), growth))
+        await ask(client, "На сколько выросли просмотры 28 ноября?")
+        checks.append(("missed date escalated", client.models == [SMALL_MODEL, None]))
+
+        # 4. Small model error falls through to the large model
+        client = StubClient(tiers(RuntimeError("Error code: 500"), total))
+        await ask(client, "Сколько всего видео?")
+        checks.append(("small model error escalated", client.models == [SMALL_MODEL, None]))
+
+        # 5. Cascade disabled -> only the large model
+        settings.llm_small_model = ""
+        client = StubClient(tiers(total, total))
+        await ask(client, "Сколько всего видео?")
+        checks.append(("cascade off -> large model only", client.models == [None]))
+
+        # 6. Validation rules
+        checks.append(("bad date / one-sided range / bad creator rejected", all(
+            llm_engine.validate_args(dict(total, **extra)) for extra in (
+                {"date_exact": "2025-13-40"},
+                {"date_from": "2025-11-01"},
+                {"date_from": "2025-11-10", "date_to": "2025-11-01"},
+                {"creator_id": "'; DROP TABLE videos; --"},
+            )
+        )))
+
+        checks.append(("cascade metrics recorded",
+                       metrics.get_counter("llm_cascade_total", tier="small", outcome="accepted") == 1
+                       and metrics.get_counter("llm_cascade_total", tier="small", outcome="escalated") == 2
+                       and metrics.get_counter("llm_cascade_total", tier="small", outcome="error") == 1))
+    finally:
+        llm_engine.client = original_client
+        settings.llm_small_model = original_model
+        settings.similarity_enabled = original_similarity
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_cascade())
+    exit(0 if success else 1)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test LLM record/replay cassettes - runs offline, no API key needed
+"""
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from openai.types.chat import ChatCompletion
+from src.cassette import CassetteClient, Cassette, CassetteMissError, request_key
+from helpers import summarize
+
+
+def make_completion(arguments: str) -> ChatCompletion:
+    """Build a chat completion with a single build_sql_query tool call"""
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "glm-4.6",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls",
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": "call_0",
+                    "type": "function",
+                    "function": {"name": "build_sql_query", "arguments": arguments}
+                }]
+            }
+        }]
+    })
+
+
+class SlowClient:
+    """Stand-in for AsyncOpenAI that answers after a fixed delay"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return make_completion('{"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"}')
+
+
+def make_request(system_prompt: str) -> dict:
+    return {
+        "model": "glm-4.6",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "Сколько всего видео?"}
+        ],
+        "tools": [{"type": "function", "function": {"name": "build_sql_query"}}],
+        "tool_choice": {"type": "function", "function": {"name": "build_sql_query"}},
+        "temperature": 0
+    }
+
+
+async def test_cassette():
+    """Record a response, then replay it instantly and with recorded latency"""
+
+    print("=" * 80)
+    print("LLM CASSETTE TEST")
+    print("=" * 80)
+
+    checks = []
+    path = os.path.join(tempfile.mkdtemp(), "llm.json")
+    request = make_request("Today is 2025-11-28.")
+
+    # 1. Record
+    inner = SlowClient(delay=0.2)
+    recorder = CassetteClient(inner, Cassette(path), "record")
+    recorded = await recorder.chat.completions.create(**request)
+    checks.append(("record forwards to client", inner.calls == 1))
+    checks.append(("cassette file written", os.path.exists(path)))
+
+    # 2. Replay instantly, with a different date in the system prompt
+    player = CassetteClient(None, Cassette(path), "replay")
+    start = time.perf_counter()
+    replayed = await player.chat.completions.create(**make_request("Today is 2025-11-29."))
+    elapsed = time.perf_counter() - start
+    same_args = (
+        replayed.choices[0].message.tool_calls[0].function.arguments
+        == recorded.choices[0].message.tool_calls[0].function.arguments
+    )
+    checks.append(("system prompt ignored in key", request_key(request) == request_key(make_request("x"))))
+    checks.append(("replay returns recorded arguments", same_args))
+    checks.append((f"instant replay ({elapsed * 1000:.1f} ms)", elapsed < 0.05))
+
+    # 3. Replay with recorded latency
+    player = CassetteClient(None, Cassette(path), "replay", replay_latency=True)
+    start = time.perf_counter()
+    await player.chat.completions.create(**request)
+    elapsed = time.perf_counter() - start
+    checks.append((f"latency replay ({elapsed * 1000:.1f} ms)", elapsed >= 0.2))
+
+    # 4. Unknown request
+    miss_request = make_request("Today is 2025-11-28.")
+    miss_request["messages"][1]["content"] = "Сколько всего лайков?"
+    try:
+        await player.chat.completions.create(**miss_request)
+        checks.append(("miss raises CassetteMissError", False))
+    except CassetteMissError:
+        checks.append(("miss raises CassetteMissError", True))
+
+    # 5. Concurrent recording: the file is written off the event loop and keeps every response
+    recorder = CassetteClient(SlowClient(delay=0.01), Cassette(path), "record")
+    questions = [f"Сколько видео у креатора {i}?" for i in range(10)]
+    requests = [make_request("Today is 2025-11-28.") for _ in questions]
+    for request, question in zip(requests, questions):
+        request["messages"][1]["content"] = question
+    await asyncio.gather(*(recorder.chat.completions.create(**request) for request in requests))
+    checks.append(("concurrent records all saved", len(Cassette(path).entries) == len(questions) + 1
+                   and not os.path.exists(f"{path}.tmp")))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_cassette())
+    exit(0 if success else 1)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Test the EXPLAIN-based cost guard: plan cache, routes, heavy lane, refusal - offline
+
+With PostgreSQL running, a real EXPLAIN is also checked.
+"""
+import asyncio
+from src import cost_guard as guard_module
+from src import database, export, llm_engine, metrics, speculation, warmup
+from src.cache import answer_cache
+from src.config import settings
+from src.deadline import Deadline, DeadlineExceeded
+from src.cost_guard import CostGuard, QueryTooExpensive, plan_key
+from src.llm_engine import build_sql
+from helpers import StubClient, summarize, with_postgres
+
+COSTS = {"videos": 50.0, "delta_views_count": 200_000.0, "DISTINCT": 9_000_000.0}
+UNFILTERED_ARGS = {"intent": "UNIQUE_ACTIVE", "target_table": "video_snapshots", "metric_field": "delta_views_count"}
+
+
+class StubPlanner:
+    """explain() stand-in: cost by query shape, counts calls, can fail"""
+
+    def __init__(self):
+        self.calls = 0
+        self.failing = False
+
+    async def explain(self, query, deadline=None):
+        self.calls += 1
+        if self.failing:
+            raise ConnectionError("replica is down")
+        cost = next(cost for marker, cost in sorted(COSTS.items(), key=lambda item: -item[1]) if marker in query)
+        return {"Total Cost": cost, "Plan Rows": 1}
+
+
+async def live_checks() -> list:
+    top = await database.explain("SELECT COUNT(id) FROM videos")
+    return [(f"live: EXPLAIN cost {top['Total Cost']}", float(top["Total Cost"]) > 0)]
+
+
+async def test_cost_guard():
+    """Check plan keys, routing by cost, the heavy lane and refusals"""
+
+    print("=" * 80)
+    print("COST GUARD TEST")
+    print("=" * 80)
+
+    checks = []
+    planner = StubPlanner()
+    original = (guard_module.explain, llm_engine.client, speculation.execute_scalar,
+                settings.similarity_enabled, settings.speculation_enabled)
+    guard_module.explain = planner.explain
+    try:
+        # 1. Plan key: same shape and period length share an estimate
+        day = "SELECT COALESCE(SUM(delta_views_count), 0) FROM video_snapshots WHERE created_at::DATE = '{}'"
+        week = ("SELECT COALESCE(SUM(delta_views_count), 0) FROM video_snapshots "
+                "WHERE created_at::DATE >= '{}' AND created_at::DATE <= '{}'")
+        checks.append(("plan key by template and period length",
+                       plan_key(day.format("2025-11-28")) == plan_key(day.format("2025-11-01"))
+                       and plan_key(week.format("2025-11-01", "2025-11-07")) == plan_key(week.format("2025-11-10", "2025-11-16"))
+                       and plan_key(week.format("2025-11-01", "2025-11-07")) != plan_key(week.format("2025-01-01", "2025-11-30"))))
+
+        # 2. Routes by cost; EXPLAIN once per key
+        guard = CostGuard(heavy_cost=100_000, max_cost=5_000_000, heavy_concurrency=2, plan_ttl=3600)
+        routes = [
+            (await guard.plan("SELECT COUNT(id) FROM videos")).route,
+            (await guard.plan(day.format("2025-11-28"))).route,
+            (await guard.plan(day.format("2025-11-27"))).route,
+            (await guard.plan(build_sql(UNFILTERED_ARGS))).route,
+        ]
+        checks.append((f"routes {routes}, {planner.calls} EXPLAIN calls",
+                       routes == ["fast", "heavy", "heavy", "refuse"] and planner.calls == 3))
+
+        # 3. Heavy lane: at most heavy_concurrency at once, fast queries are not held up
+        running, peak, fast_done = 0, 0, []
+
+        async def heavy_query():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+            return "heavy"
+
+        async def fast_query():
+            fast_done.append(running)
+            return "fast"
+
+        heavy = [guard.run(day.format("2025-11-28"), heavy_query, {}) for _ in range(6)]
+        results = await asyncio.gather(*heavy, guard.run("SELECT COUNT(id) FROM videos", fast_query, {}))
+        checks.append((f"heavy lane peak {peak}", peak == 2 and results.count("heavy") == 6 and fast_done == [2]))
+
+        # Waiters that run out of budget or are cancelled - also just as a slot frees up - leave no slot taken
+        heavy_sql = day.format("2025-11-28")
+        holders = [asyncio.create_task(guard.run(heavy_sql, heavy_query, {})) for _ in range(2)]
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(guard.run(heavy_sql, heavy_query, {}, Deadline(0.045 + i * 0.001)))
+                   for i in range(10)]
+        cancelled = [asyncio.create_task(guard.run(heavy_sql, heavy_query, {})) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        for task in cancelled:
+            task.cancel()
+        outcomes = await asyncio.gather(*holders, *waiters, *cancelled, return_exceptions=True)
+        lost = [outcome for outcome in outcomes if not (outcome == "heavy" or isinstance(
+            outcome, (DeadlineExceeded, asyncio.CancelledError)))]
+        checks.append((f"heavy slots returned after timeouts and cancellations ({guard.heavy._value} free)",
+                       not lost and guard.heavy._value == 2 and not guard.heavy.locked()))
+
+        # 4. Refusal: nothing executed, the hint asks for a period and a creator
+        executed = []
+        try:
+            await guard.run(build_sql(UNFILTERED_ARGS), lambda: executed.append(1), UNFILTERED_ARGS)
+            hint = ""
+        except QueryTooExpensive as e:
+            hint = str(e)
+        checks.append(("refused with a narrowing hint", not executed and "период" in hint and "креатор" in hint
+                       and metrics.get_counter("cost_guard_queries_total", route="refuse") >= 1))
+
+        # 5. EXPLAIN failure: the query still runs; the failure is remembered for failure_ttl only
+        guard.failure_ttl = 0.05
+        planner.failing = True
+        failed_plan = await guard.plan("SELECT COUNT(id) FROM videos WHERE creator_id = 'x'")
+        calls = planner.calls
+        planner.failing = False
+        remembered = await guard.plan("SELECT COUNT(id) FROM videos WHERE creator_id = 'y'")
+        await asyncio.sleep(0.06)
+        retried = await guard.plan("SELECT COUNT(id) FROM videos WHERE creator_id = 'z'")
+        checks.append(("fails open on EXPLAIN errors, retries after failure_ttl",
+                       failed_plan.route == "fast" and failed_plan.cost is None
+                       and remembered is failed_plan and planner.calls == calls + 1
+                       and retried.cost == COSTS["videos"]))
+
+        # 6. answer(): an unfiltered distinct count is refused before touching the data
+        async def execute_scalar(sql, deadline=None):
+            executed.append(sql)
+            return 0
+
+        llm_engine.client = StubClient(UNFILTERED_ARGS)
+        speculation.execute_scalar = execute_scalar
+        settings.similarity_enabled = False
+        settings.speculation_enabled = True
+        answer_cache.entries.clear()
+        try:
+            await speculation.answer("Сколько разных видео получали просмотры?")
+            refused = False
+        except QueryTooExpensive:
+            refused = True
+        checks.append(("answer refuses the runaway scan", refused and not executed))
+
+        # 7. Cache warmup and CSV exports go through the guard too
+        async def stream_query(sql, chunk_rows, deadline=None):
+            executed.append(sql)
+            yield []
+
+        llm_engine.client = StubClient({"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "views_count"})
+        original_paths = (warmup.execute_scalar, export.stream_query, guard_module.cost_guard.max_cost)
+        warmup.execute_scalar, export.stream_query = execute_scalar, stream_query
+        guard_module.cost_guard.max_cost = 0
+        guard_module.cost_guard.plans.clear()
+        try:
+            report = await warmup.warm("test")
+            export_args = {"intent": "EXPORT", "target_table": "video_snapshots",
+                           "metric_field": "delta_views_count", "group_by": "video"}
+            try:
+                await export.Export(build_sql(export_args), export_args).write()
+                exported = True
+            except QueryTooExpensive:
+                exported = False
+        finally:
+            warmup.execute_scalar, export.stream_query, guard_module.cost_guard.max_cost = original_paths
+            guard_module.cost_guard.plans.clear()
+        checks.append((f"warmup and export guarded ({report['queries']} warmed)",
+                       not executed and not exported and report["queries"] == 0
+                       and metrics.get_counter("warmup_queries_total", outcome="too_expensive") >= 4))
+    finally:
+        (guard_module.explain, llm_engine.client, speculation.execute_scalar,
+         settings.similarity_enabled, settings.speculation_enabled) = original
+
+    checks.extend(await with_postgres("live EXPLAIN check", live_checks))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_cost_guard())
+    exit(0 if success else 1)
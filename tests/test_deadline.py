@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test deadline propagation through the LLM call and retry loop - offline
+"""
+import asyncio
+import time
+from src import llm_engine
+from src.deadline import Deadline, DeadlineExceeded
+from helpers import StubClient, summarize
+
+
+async def run_with_deadline(client, seconds: float):
+    """Run get_sql_query with a stub client; return (exception, elapsed)"""
+    llm_engine.client = client
+    start = time.perf_counter()
+    try:
+        await llm_engine.get_sql_query("Сколько всего видео?", Deadline(seconds))
+        error = None
+    except Exception as e:
+        error = e
+    return error, time.perf_counter() - start
+
+
+async def test_deadline():
+    """Check that the budget cancels in-flight calls and cuts retries short"""
+
+    print("=" * 80)
+    print("DEADLINE PROPAGATION TEST")
+    print("=" * 80)
+
+    checks = []
+    original_client = llm_engine.client
+    try:
+        # 1. Hanging LLM call is cancelled when the budget runs out
+        client = StubClient({}, delay=60)
+        error, elapsed = await run_with_deadline(client, 0.3)
+        checks.append((f"hanging call -> DeadlineExceeded ({elapsed:.2f} s)",
+                       isinstance(error, DeadlineExceeded) and elapsed < 0.5))
+        checks.append(("in-flight request cancelled", client.cancelled == 1))
+
+        # 2. No retry sleep when the backoff does not fit into the budget
+        client = StubClient(RuntimeError("Error code: 500"))
+        error, elapsed = await run_with_deadline(client, 0.5)
+        checks.append((f"retry skipped when budget too small ({elapsed:.2f} s)",
+                       isinstance(error, DeadlineExceeded) and client.calls == 1 and elapsed < 0.2))
+
+        # 3. Retries still happen while the budget allows
+        client = StubClient(RuntimeError("Error code: 500"))
+        error, elapsed = await run_with_deadline(client, 2.5)
+        checks.append((f"retry within budget ({client.calls} calls, {elapsed:.2f} s)",
+                       isinstance(error, DeadlineExceeded) and client.calls == 2))
+
+        # 4. Already expired deadline fails before any call
+        client = StubClient({}, delay=60)
+        error, elapsed = await run_with_deadline(client, 0)
+        checks.append(("expired deadline -> no LLM call", isinstance(error, DeadlineExceeded) and client.calls == 0))
+    finally:
+        llm_engine.client = original_client
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_deadline())
+    exit(0 if success else 1)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test scheduled digests: computed once, fanned out in batches, catch-up, one sender - offline
+
+With PostgreSQL running, subscribe/unsubscribe are also checked on the real table.
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from aiogram.exceptions import TelegramForbiddenError
+from src import digest, llm_engine
+from src.cache import answer_cache
+from src.digest import DigestScheduler, digest_args
+from src.llm_engine import build_sql
+from helpers import summarize, with_postgres
+
+NOW = datetime(2025, 11, 29, 10, 0)
+YESTERDAY = date(2025, 11, 28)
+
+
+class MemoryDigests(DigestScheduler):
+    """Scheduler with digest_subscriptions kept in a dict shared between 'processes'"""
+
+    def __init__(self, table: dict, **kwargs):
+        super().__init__("09:00", kwargs.get("catchup_days", 3), kwargs.get("batch_size", 100), 60.0)
+        self.table = table
+        self.claims = 0
+
+    async def _pending(self, day):
+        return any(last_sent is None or last_sent < day for last_sent in self.table.values())
+
+    async def _claim(self, day):
+        self.claims += 1
+        await asyncio.sleep(0)
+        chat_ids = sorted(chat_id for chat_id, last_sent in self.table.items()
+                          if last_sent is None or last_sent < day)[:self.batch_size]
+        for chat_id in chat_ids:
+            self.table[chat_id] = day
+        return chat_ids
+
+    async def unsubscribe(self, chat_id):
+        return self.table.pop(chat_id, None) is not None
+
+
+class StubSender:
+    """Sender stand-in: records messages; some chats blocked the bot or fail"""
+
+    def __init__(self, blocked=(), failing=()):
+        self.sent = []
+        self.blocked = set(blocked)
+        self.failing = set(failing)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method=None, message="Forbidden: bot was blocked by the user")
+        if chat_id in self.failing:
+            raise ConnectionError("network is unreachable")
+        self.sent.append((chat_id, text))
+
+
+async def live_checks() -> list:
+    from src.database import init_db
+    await init_db()
+    scheduler = digest.digests
+    await scheduler.unsubscribe(-1)
+    first, again = await scheduler.subscribe(-1), await scheduler.subscribe(-1)
+    removed = await scheduler.unsubscribe(-1)
+    return [("live: subscribe once, unsubscribe", first and not again and removed)]
+
+
+async def test_digest():
+    """Check scheduling, single computation, batched fan-out, catch-up and failures"""
+
+    print("=" * 80)
+    print("DAILY DIGEST TEST")
+    print("=" * 80)
+
+    checks = []
+    queries = []
+
+    async def execute_cached(args, sql, deadline=None, trace=None):
+        queries.append(sql)
+        # New numbers after the data reload of check 6
+        return [[1500, 120 + (answer_cache.data_version == 2), 7]]
+
+    original = digest.execute_cached
+    digest.execute_cached = execute_cached
+    try:
+        # 1. Due day: yesterday after digest_time, the day before until then
+        scheduler = MemoryDigests({})
+        checks.append(("due day follows digest_time",
+                       scheduler.due_day(NOW) == YESTERDAY
+                       and scheduler.due_day(NOW.replace(hour=8, minute=59)) == YESTERDAY - timedelta(days=1)))
+
+        # 2. One query, no LLM, 250 subscribers in batches of 100; a second run sends nothing
+        table = {chat_id: YESTERDAY - timedelta(days=1) for chat_id in range(1, 251)}
+        scheduler, sender = MemoryDigests(table), StubSender()
+        scheduler.sender = sender
+        report = await scheduler.run_due(NOW)
+        again = await scheduler.run_due(NOW)
+        text = sender.sent[0][1]
+        print(text)
+        checks.append((f"fan-out {report}, {len(queries)} query, {scheduler.claims} claims",
+                       report["sent"] == 250 and len({chat_id for chat_id, _ in sender.sent}) == 250
+                       and len(queries) == 1 and queries[0] == build_sql(digest_args(YESTERDAY))
+                       and scheduler.claims == 4 and again["sent"] == 0 and llm_engine.client is None
+                       and text.startswith("📬 Дайджест за 28.11.2025:") and "прирост лайков: 120" in text))
+
+        # 3. Catch-up after downtime: missed days oldest first, at most catchup_days
+        queries.clear()
+        table = {1: YESTERDAY - timedelta(days=6), 2: YESTERDAY - timedelta(days=2)}
+        scheduler, sender = MemoryDigests(table), StubSender()
+        scheduler.sender = sender
+        report = await scheduler.run_due(NOW)
+        days = [(chat_id, text.split("\n")[0]) for chat_id, text in sender.sent]
+        checks.append((f"catch-up {report['days']} days, {len(sender.sent)} messages",
+                       days == [(1, "📬 Дайджест за 26.11.2025:"), (1, "📬 Дайджест за 27.11.2025:"),
+                                (2, "📬 Дайджест за 27.11.2025:"), (1, "📬 Дайджест за 28.11.2025:"),
+                                (2, "📬 Дайджест за 28.11.2025:")]
+                       and len(queries) == 3 and table == {1: YESTERDAY, 2: YESTERDAY}))
+
+        # 4. Blocked chats are unsubscribed; failed sends are not retried
+        table = {chat_id: YESTERDAY - timedelta(days=1) for chat_id in (1, 2, 3)}
+        scheduler, sender = MemoryDigests(table), StubSender(blocked={2}, failing={3})
+        scheduler.sender = sender
+        report = await scheduler.run_due(NOW)
+        retry = await scheduler.run_due(NOW)
+        checks.append((f"failures {report}", report["sent"] == 1 and report["failed"] == 2
+                       and 2 not in table and table[3] == YESTERDAY and retry["failed"] == 0))
+
+        # 5. Two bot processes share the table: every chat gets exactly one digest
+        table = {chat_id: YESTERDAY - timedelta(days=1) for chat_id in range(1, 101)}
+        sender = StubSender()
+        first, second = MemoryDigests(table, batch_size=10), MemoryDigests(table, batch_size=10)
+        first.sender = second.sender = sender
+        reports = await asyncio.gather(first.run_due(NOW), second.run_due(NOW))
+        chats = [chat_id for chat_id, _ in sender.sent]
+        checks.append((f"two processes sent {reports[0]['sent']} + {reports[1]['sent']}",
+                       sorted(chats) == list(range(1, 101)) and reports[0]["sent"] > 0 and reports[1]["sent"] > 0))
+
+        # 6. A data reload (new data version) recomputes the digest instead of sending the old numbers
+        queries.clear()
+        scheduler = MemoryDigests({})
+        original_version = answer_cache.data_version
+        try:
+            answer_cache.set_data_version(1)
+            before, cached = await scheduler.compute(YESTERDAY), await scheduler.compute(YESTERDAY)
+            answer_cache.set_data_version(2)
+            after = await scheduler.compute(YESTERDAY)
+        finally:
+            answer_cache.data_version = original_version
+        checks.append((f"recomputed after a data reload ({len(queries)} queries)",
+                       len(queries) == 2 and before is cached and list(scheduler.texts) == [(2, YESTERDAY)]
+                       and "прирост лайков: 120" in before and "прирост лайков: 121" in after))
+    finally:
+        digest.execute_cached = original
+
+    checks.extend(await with_postgres("live subscription checks", live_checks))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_digest())
+    exit(0 if success else 1)
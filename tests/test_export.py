@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Test streaming CSV exports: SQL, chunked writing, limits and memory - offline
+"""
+import asyncio
+import csv
+import os
+import tracemalloc
+from collections import namedtuple
+from src import export, llm_engine, speculation
+from src.cache import answer_cache
+from src.config import settings
+from src.export import BOM, Export
+from src.llm_engine import build_sql, validate_args
+from helpers import StubClient, summarize
+
+Row = namedtuple("Row", ["day", "delta_views_count"])
+EXPORT_ARGS = {
+    "intent": "EXPORT", "group_by": "day", "target_table": "video_snapshots",
+    "metric_field": "delta_views_count", "date_from": "2025-11-01", "date_to": "2025-11-30"
+}
+
+
+class StubCursor:
+    """stream_query stand-in: yields total rows in chunks, built lazily like a cursor"""
+
+    def __init__(self, total: int, fail_after: int = None):
+        self.total = total
+        self.fail_after = fail_after
+        self.closed = False
+        self.chunks = 0
+
+    async def stream_query(self, query, chunk_rows, deadline=None):
+        try:
+            for start in range(0, self.total, chunk_rows):
+                if self.fail_after is not None and self.chunks >= self.fail_after:
+                    raise ConnectionError("connection lost")
+                self.chunks += 1
+                yield [Row(f"2025-11-{i % 30 + 1:02d}", i * 7) for i in range(start, min(start + chunk_rows, self.total))]
+                await asyncio.sleep(0)
+        finally:
+            self.closed = True
+
+
+async def run_export(cursor: StubCursor, **limits) -> Export:
+    export.stream_query = cursor.stream_query
+    job = Export("SELECT ...", EXPORT_ARGS)
+    await job.write(**limits)
+    return job
+
+
+def read_csv(path: str) -> list:
+    with open(path, "rb") as f:
+        raw = f.read()
+    assert raw.startswith(BOM)
+    return list(csv.reader(raw[len(BOM):].decode("utf-8").splitlines()))
+
+
+async def test_export():
+    """Check export SQL, streaming, row/byte limits, cleanup and the answer path"""
+
+    print("=" * 80)
+    print("STREAMING EXPORT TEST")
+    print("=" * 80)
+
+    checks = []
+    original = (export.stream_query, llm_engine.client, speculation.execute_scalar, settings.similarity_enabled,
+                settings.cost_guard_enabled)
+    try:
+        # Streaming only: the cost guard in front of exports is covered by test_cost_guard.py
+        settings.cost_guard_enabled = False
+        # 1. Export SQL and validation
+        by_video = dict(EXPORT_ARGS, group_by="video", creator_id="aca1061a9d324ecf8c3fa2bb32d7be63")
+        sql_ok = (
+            build_sql(EXPORT_ARGS) == "SELECT created_at::DATE AS day, SUM(delta_views_count) AS delta_views_count "
+            "FROM video_snapshots WHERE created_at::DATE >= '2025-11-01' AND created_at::DATE <= '2025-11-30' "
+            "GROUP BY 1 ORDER BY 1"
+            and "video_id IN (SELECT id FROM videos WHERE creator_id = " in build_sql(by_video)
+            and build_sql({"intent": "EXPORT", "group_by": "video", "target_table": "videos", "metric_field": "views_count"})
+            == "SELECT id AS video_id, creator_id, video_created_at, views_count FROM videos ORDER BY video_created_at, id"
+        )
+        rejected = [
+            validate_args(dict(EXPORT_ARGS, group_by=None)),
+            validate_args(dict(EXPORT_ARGS, intent="GROWTH_DYNAMIC", group_by="video")),
+            validate_args(dict(EXPORT_ARGS, metric_field="views_count")),
+        ]
+        checks.append(("export SQL and validation", sql_ok and not validate_args(EXPORT_ARGS) and all(rejected)))
+
+        # 2. 500k rows streamed in chunks; memory stays around one chunk
+        cursor = StubCursor(500_000)
+        tracemalloc.start()
+        job = await run_export(cursor, chunk_rows=5000)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rows = read_csv(job.path)
+        checks.append((f"500k rows in {cursor.chunks} chunks, {job.bytes / 2 ** 20:.1f} MB file, peak {peak / 2 ** 20:.1f} MB",
+                       job.rows == 500_000 and len(rows) == 500_001 and rows[0] == ["day", "delta_views_count"]
+                       and rows[-1] == ["2025-11-20", str(499_999 * 7)] and os.path.getsize(job.path) == job.bytes
+                       and not job.truncated and peak < job.bytes / 4))
+        job.remove()
+
+        # 3. Row limit: stops early and closes the cursor
+        cursor = StubCursor(200_000)
+        job = await run_export(cursor, max_rows=12_345, chunk_rows=5000)
+        checks.append((f"row limit ({job.rows} rows, {cursor.chunks} chunks read)",
+                       job.rows == 12_345 and len(read_csv(job.path)) == 12_346 and job.truncated
+                       and cursor.closed and cursor.chunks == 3 and "Обрезано" in job.caption()))
+        job.remove()
+
+        # 4. Byte limit: the file never exceeds it
+        job = await run_export(StubCursor(200_000), max_bytes=100_000, chunk_rows=5000)
+        checks.append((f"byte limit ({job.bytes} bytes, {job.rows} rows)",
+                       os.path.getsize(job.path) <= 100_000 and job.truncated and len(read_csv(job.path)) == job.rows + 1))
+        job.remove()
+
+        # 5. Empty result and a failing cursor leave no files behind
+        job = await run_export(StubCursor(0))
+        empty_ok = job.rows == 0 and job.bytes == 0
+        job.remove()
+        failed = Export("SELECT ...", EXPORT_ARGS)
+        export.stream_query = StubCursor(50_000, fail_after=2).stream_query
+        try:
+            await failed.write(chunk_rows=5000)
+            raised = False
+        except ConnectionError:
+            raised = True
+        checks.append(("empty result and failed export cleaned up", empty_ok and raised and failed.path is None))
+
+        # 6. answer() hands EXPORT back without executing it; no speculation for exports
+        executed = []
+
+        async def execute_scalar(sql, deadline=None):
+            executed.append(sql)
+            return 0
+
+        llm_engine.client = StubClient(EXPORT_ARGS)
+        speculation.execute_scalar = execute_scalar
+        settings.similarity_enabled = False
+        answer_cache.entries.clear()
+        question = "Выгрузи прирост просмотров по дням с 1 по 30 ноября 2025"
+        result = await speculation.answer(question)
+        checks.append(("answer returns Export, nothing executed",
+                       isinstance(result, Export) and not executed and result.filename
+                       == "delta_views_count_by_day_2025-11-01_2025-11-30.csv"
+                       and speculation.guess_args(question) == []))
+    finally:
+        (export.stream_query, llm_engine.client, speculation.execute_scalar, settings.similarity_enabled,
+         settings.cost_guard_enabled) = original
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_export())
+    exit(0 if success else 1)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test per-user quotas and duplicate debouncing - offline
+"""
+import asyncio
+from types import SimpleNamespace
+from src import metrics
+from src.middlewares import FairnessMiddleware, THROTTLED_TEXT
+from helpers import summarize
+
+
+class FakeSender:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def make_message(user_id: int, text: str):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=user_id),
+        from_user=SimpleNamespace(id=user_id),
+        text=text
+    )
+
+
+async def test_fairness():
+    """Check quotas, debouncing and metrics"""
+
+    print("=" * 80)
+    print("FAIRNESS MIDDLEWARE TEST")
+    print("=" * 80)
+
+    checks = []
+
+    # Middleware: debounce, quota and admission
+    metrics.reset()
+    sender = FakeSender()
+    middleware = FairnessMiddleware(sender)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.text)
+
+    # Same question three times -> handled once
+    for _ in range(3):
+        await middleware(handler, make_message(1, "Сколько  всего видео?"), {})
+    checks.append(("duplicates collapsed", handled == ["Сколько  всего видео?"]))
+
+    # 20 different questions from one user -> only the burst is admitted
+    for i in range(20):
+        await middleware(handler, make_message(2, f"question {i}"), {})
+    admitted = len(handled) - 1
+    checks.append((f"quota limits a flooding user ({admitted} admitted)", admitted == 5))
+    checks.append(("throttled user notified once", sender.sent == [(2, THROTTLED_TEXT)]))
+
+    # Another user is unaffected
+    await middleware(handler, make_message(3, "question"), {})
+    checks.append(("other users unaffected", handled[-1] == "question"))
+
+    decisions = {
+        decision: metrics.get_counter("fairness_decisions_total", decision=decision)
+        for decision in ("admitted", "debounced", "rate_limited")
+    }
+    print(f"Decisions: {decisions}")
+    checks.append(("decisions exported as metrics", decisions == {"admitted": 7, "debounced": 2, "rate_limited": 15}))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_fairness())
+    exit(0 if success else 1)
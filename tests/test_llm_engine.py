@@ -1,12 +1,43 @@
 #!/usr/bin/env python3
 """
 Test LLM Engine - SQL generation
+
+Calls the live API by default. With LLM_CASSETTE_MODE=record the responses are
+saved to the cassette in tests/cassettes/ (llm_compact.json with
+LLM_PROMPT_MODE=compact, LLM_CASSETTE_PATH if set); LLM_CASSETTE_MODE=replay
+runs the same questions offline from that recording. Without PostgreSQL the
+generated SQL is not executed.
 """
 import asyncio
+import os
 import asyncpg
 from src.config import settings
 from src.llm_engine import get_sql_query
 
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes")
+
+
+def resolve_cassette():
+    """The default cassette path is relative to the repository root - make it work from tests/ too"""
+    if settings.llm_cassette_mode != "off" and "LLM_CASSETTE_PATH" not in os.environ:
+        name = "llm_compact.json" if settings.llm_prompt_mode == "compact" else "llm.json"
+        settings.llm_cassette_path = os.path.join(CASSETTE_DIR, name)
+        print(f"[INFO] LLM cassette {settings.llm_cassette_mode}: {settings.llm_cassette_path}")
+
+
+async def connect():
+    try:
+        return await asyncpg.connect(
+            user=settings.postgres_user,
+            password=settings.postgres_password,
+            database=settings.postgres_db,
+            host=settings.postgres_host,
+            port=settings.postgres_port
+        )
+    except Exception as e:
+        print(f"[INFO] PostgreSQL not reachable - generated SQL is not executed ({e.__class__.__name__})")
+        return None
+
 
 async def test_llm_engine():
     """Test LLM engine with various user queries"""
@@ -15,6 +46,8 @@ async def test_llm_engine():
     print("LLM ENGINE TEST - SQL GENERATION")
     print("=" * 70)
 
+    resolve_cassette()
+
     # Test queries
     test_queries = [
         "Сколько всего видео?",
@@ -26,13 +59,8 @@ async def test_llm_engine():
     ]
 
     # Connect to database for verification
-    conn = await asyncpg.connect(
-        user=settings.postgres_user,
-        password=settings.postgres_password,
-        database=settings.postgres_db,
-        host=settings.postgres_host,
-        port=settings.postgres_port
-    )
+    conn = await connect()
+    failed = 0
 
     try:
         for i, query in enumerate(test_queries, 1):
@@ -46,12 +74,14 @@ async def test_llm_engine():
                 print(f"Generated SQL: {generated_sql}")
 
                 # Execute SQL and get result
-                print("Executing SQL...")
-                result = await conn.fetchval(generated_sql)
-                print(f"Result: {result}")
+                if conn is not None:
+                    print("Executing SQL...")
+                    result = await conn.fetchval(generated_sql)
+                    print(f"Result: {result}")
                 print("[OK] Test passed")
 
             except Exception as e:
+                failed += 1
                 print(f"[FAILED] Error: {e}")
                 import traceback
                 traceback.print_exc()
@@ -61,8 +91,11 @@ async def test_llm_engine():
         print("=" * 70)
 
     finally:
-        await conn.close()
+        if conn is not None:
+            await conn.close()
+    return failed == 0
 
 
 if __name__ == "__main__":
-    asyncio.run(test_llm_engine())
+    success = asyncio.run(test_llm_engine())
+    exit(0 if success else 1)
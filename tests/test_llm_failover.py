@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Test hedged LLM requests, failover and circuit breakers against local stub servers
+"""
+import asyncio
+import json
+import time
+from aiohttp import web
+from openai import AsyncOpenAI
+from src import metrics
+from src.llm_pool import Endpoint, EndpointPool, OPEN
+from helpers import summarize
+
+ARGUMENTS = json.dumps({"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"})
+
+
+class StubServer:
+    """OpenAI-compatible /chat/completions with configurable delay and status"""
+
+    def __init__(self, name: str, delay: float = 0.0, status: int = 200):
+        self.name = name
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+        self.models = []
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        self.models.append(body.get("model"))
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.json_response({"error": {"message": f"stub {self.status}"}}, status=self.status)
+        return web.json_response({
+            "id": f"chatcmpl-{self.name}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [{
+                        "id": "call_0",
+                        "type": "function",
+                        "function": {"name": "build_sql_query", "arguments": ARGUMENTS}
+                    }]
+                }
+            }]
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def endpoint(self, small_model: str = "") -> Endpoint:
+        client = AsyncOpenAI(api_key="test", base_url=f"http://127.0.0.1:{self.port}/v1", max_retries=0)
+        endpoint = Endpoint(self.name, client, "stub-model", small_model)
+        # Pretend we already know the endpoint answers in ~0.1 s
+        endpoint.latencies.extend([0.1] * 20)
+        return endpoint
+
+
+async def ask(pool: EndpointPool, model: str = None):
+    start = time.perf_counter()
+    response = await pool.create(model=model, messages=[{"role": "user", "content": "Сколько всего видео?"}])
+    return response.id, time.perf_counter() - start
+
+
+async def test_llm_failover():
+    """Check hedging, failover and circuit breaking"""
+
+    print("=" * 80)
+    print("LLM HEDGING / FAILOVER TEST")
+    print("=" * 80)
+
+    checks = []
+    metrics.reset()
+    slow = StubServer("slow", delay=2.0)
+    fast = StubServer("fast", delay=0.05)
+    broken = StubServer("broken", status=429)
+    for server in (slow, fast, broken):
+        await server.start()
+
+    try:
+        # 1. Hedging: slow primary, the hedge to the fast endpoint wins
+        pool = EndpointPool([slow.endpoint(), fast.endpoint()])
+        winner, elapsed = await ask(pool)
+        checks.append((f"hedged request won by fast endpoint ({elapsed:.2f} s)",
+                       winner == "chatcmpl-fast" and elapsed < 1.0))
+        checks.append(("hedge counted", metrics.get_counter("llm_hedges_total") == 1))
+        checks.append(("slow loser cancelled",
+                       metrics.get_counter("llm_requests_total", endpoint="slow", outcome="cancelled") == 1))
+
+        # 2. Failover: 429 from the primary moves the request to the next endpoint
+        pool = EndpointPool([broken.endpoint(), fast.endpoint()])
+        winner, elapsed = await ask(pool)
+        checks.append((f"failover after 429 ({elapsed:.2f} s)", winner == "chatcmpl-fast" and elapsed < 0.5))
+
+        # 3. Circuit breaker: after 3 failures the broken endpoint gets no traffic
+        for _ in range(3):
+            await ask(pool)
+        requests_before = broken.requests
+        for _ in range(5):
+            await ask(pool)
+        checks.append(("breaker opened", pool.endpoints[0].breaker.state == OPEN))
+        checks.append((f"no traffic to open endpoint ({broken.requests - requests_before} requests)",
+                       broken.requests == requests_before))
+
+        # 4. Half-open probe after cooldown: recovered endpoint is used again
+        broken.status = 200
+        pool.endpoints[0].breaker.opened_at -= pool.endpoints[0].breaker.cooldown
+        winner, _ = await ask(pool)
+        checks.append(("recovered endpoint closes breaker",
+                       winner == "chatcmpl-broken" and pool.endpoints[0].breaker.state == "closed"))
+
+        # 5. Models per endpoint: the small tier only goes to endpoints that serve a small model
+        fast.models.clear()
+        broken.models.clear()
+        pool = EndpointPool([broken.endpoint(), fast.endpoint("fast-small")], small_model="small")
+        await ask(pool, "small")
+        await ask(pool)
+        # No failover of the small tier to an endpoint without a small model
+        pool = EndpointPool([fast.endpoint(), broken.endpoint("broken-small")], small_model="small")
+        broken.status = 429
+        try:
+            await ask(pool, "small")
+            served = True
+        except Exception:
+            served = False
+        checks.append((f"models per endpoint ({fast.models}, {broken.models})",
+                       fast.models == ["fast-small"] and broken.models == ["stub-model", "broken-small"] and not served))
+    finally:
+        for server in (slow, fast, broken):
+            await server.stop()
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_llm_failover())
+    exit(0 if success else 1)
@@ -1,12 +1,41 @@
 #!/usr/bin/env python3
 """
 Test LLM engine with real API key
+
+With LLM_CASSETTE_MODE=record the responses are saved to the cassette in
+tests/cassettes/ (LLM_CASSETTE_PATH if set); LLM_CASSETTE_MODE=replay runs the
+same questions offline from it. Without PostgreSQL the generated SQL is not executed.
 """
 import asyncio
+import os
 import asyncpg
 from src.config import settings
 from src.llm_engine import get_sql_query
 
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes")
+
+
+def resolve_cassette():
+    """The default cassette path is relative to the repository root - make it work from tests/ too"""
+    if settings.llm_cassette_mode != "off" and "LLM_CASSETTE_PATH" not in os.environ:
+        name = "llm_compact.json" if settings.llm_prompt_mode == "compact" else "llm.json"
+        settings.llm_cassette_path = os.path.join(CASSETTE_DIR, name)
+        print(f"[INFO] LLM cassette {settings.llm_cassette_mode}: {settings.llm_cassette_path}")
+
+
+async def connect():
+    try:
+        return await asyncpg.connect(
+            user=settings.postgres_user,
+            password=settings.postgres_password,
+            database=settings.postgres_db,
+            host=settings.postgres_host,
+            port=settings.postgres_port
+        )
+    except Exception as e:
+        print(f"[INFO] PostgreSQL not reachable - generated SQL is not executed ({e.__class__.__name__})")
+        return None
+
 
 async def test_llm_with_api():
     """Test LLM engine with actual API calls"""
@@ -15,6 +44,8 @@ async def test_llm_with_api():
     print("LLM ENGINE TEST WITH REAL API")
     print("=" * 80)
 
+    resolve_cassette()
+
     # Test queries
     test_queries = [
         "Сколько всего видео?",
@@ -24,13 +55,7 @@ async def test_llm_with_api():
     ]
 
     # Connect to database for verification
-    conn = await asyncpg.connect(
-        user=settings.postgres_user,
-        password=settings.postgres_password,
-        database=settings.postgres_db,
-        host=settings.postgres_host,
-        port=settings.postgres_port
-    )
+    conn = await connect()
 
     try:
         for i, query in enumerate(test_queries, 1):
@@ -44,9 +69,10 @@ async def test_llm_with_api():
                 print(f"Generated SQL: {generated_sql}")
 
                 # Execute SQL and get result
-                print("Executing SQL...")
-                result = await conn.fetchval(generated_sql)
-                print(f"Result: {result}")
+                if conn is not None:
+                    print("Executing SQL...")
+                    result = await conn.fetchval(generated_sql)
+                    print(f"Result: {result}")
                 print("[OK] Test passed")
 
             except Exception as e:
@@ -59,7 +85,8 @@ async def test_llm_with_api():
         print("=" * 80)
 
     finally:
-        await conn.close()
+        if conn is not None:
+            await conn.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Test multi-metric and per-day series answers: one query, shard merge, compact reply - offline
+"""
+import asyncio
+from src import llm_engine, speculation
+from src.answers import format_rows
+from src.cache import answer_cache
+from src.config import settings
+from src.llm_engine import build_sql, returns_rows, validate_args
+from src.routing import Node, ShardSet, combine_rows, is_additive
+from helpers import StubClient, summarize
+
+MULTI_ARGS = {
+    "intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots", "metric_field": "delta_views_count",
+    "metric_fields": ["delta_views_count", "delta_likes_count"], "date_from": "2025-11-24", "date_to": "2025-11-30"
+}
+SERIES_ARGS = dict(MULTI_ARGS, group_by="day")
+
+
+class StubShard(Node):
+    """Shard answering every query with fixed rows"""
+
+    def __init__(self, name: str, rows: list):
+        self.name = name
+        self.result = rows
+        self.latency = None
+
+    async def _execute(self, query, deadline, rows=False):
+        return self.result if rows else self.result[0][-1]
+
+
+async def test_multi_metric():
+    """Check SQL, validation, shard merge, reply formatting and the answer path"""
+
+    print("=" * 80)
+    print("MULTI-METRIC AND SERIES TEST")
+    print("=" * 80)
+
+    checks = []
+
+    # 1. Several metrics and a per-day series in one scan; single metrics unchanged
+    multi_sql, series_sql = build_sql(MULTI_ARGS), build_sql(SERIES_ARGS)
+    unique_sql = build_sql(dict(MULTI_ARGS, intent="UNIQUE_ACTIVE"))
+    single = dict(MULTI_ARGS, metric_fields=["delta_views_count"])
+    checks.append(("multi-metric and series SQL", multi_sql == (
+        "SELECT COALESCE(SUM(delta_views_count), 0) AS delta_views_count, "
+        "COALESCE(SUM(delta_likes_count), 0) AS delta_likes_count FROM video_snapshots "
+        "WHERE created_at::DATE >= '2025-11-24' AND created_at::DATE <= '2025-11-30'"
+    ) and series_sql.startswith("SELECT to_char(date_trunc('day', created_at), 'YYYY-MM-DD') AS day, COALESCE(SUM(")
+        and series_sql.endswith("GROUP BY 1 ORDER BY 1") and series_sql.count("FROM") == 1
+        and "COUNT(DISTINCT video_id) FILTER (WHERE delta_likes_count > 0)" in unique_sql
+        and not returns_rows(single) and build_sql(single).startswith("SELECT COALESCE(SUM(delta_views_count), 0) FROM")
+        and all(map(is_additive, (multi_sql, series_sql, unique_sql)))))
+
+    # 2. Validation: every metric must fit the intent and table; series need a range
+    rejected = [
+        validate_args(dict(MULTI_ARGS, metric_fields=["delta_views_count", "views_count"])),
+        validate_args(dict(MULTI_ARGS, metric_fields=["shares_count"])),
+        validate_args(dict(MULTI_ARGS, metric_fields="delta_likes_count")),
+        validate_args({k: v for k, v in SERIES_ARGS.items() if k not in ("date_from", "date_to")}),
+        validate_args(dict(MULTI_ARGS, group_by="video")),
+    ]
+    totals = {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id",
+              "metric_fields": ["id", "views_count", "likes_count"]}
+    checks.append(("validation of metric lists and series", not validate_args(MULTI_ARGS)
+                   and not validate_args(SERIES_ARGS) and not validate_args(totals) and all(rejected)))
+
+    # 3. Shards: rows merged by day, columns summed
+    shards = ShardSet([
+        StubShard("shard0", [["2025-11-24", 10, 1], ["2025-11-25", 5, 0]]),
+        StubShard("shard1", [["2025-11-25", 7, 2], ["2025-11-26", None, 3]]),
+    ])
+    merged = await shards.scatter_rows(series_sql, keys=1)
+    flat = combine_rows([[[10, None]], [[5, 2]]])
+    checks.append((f"shard rows merged {merged}", merged == [
+        ["2025-11-24", 10, 1], ["2025-11-25", 12, 2], ["2025-11-26", None, 3]
+    ] and flat == [[15, 2]]))
+
+    # 4. Compact reply: missing days as zeros, totals, long series trimmed
+    series_text = format_rows(SERIES_ARGS, merged)
+    multi_text = format_rows(totals, [[120, 34567, 890]])
+    long_args = dict(SERIES_ARGS, date_from="2025-09-01", date_to="2025-11-30")
+    long_text = format_rows(long_args, merged, max_days=30)
+    print(series_text)
+    checks.append(("compact replies", series_text.count("\n") == 8 and "2025-11-30: 0 / 0" in series_text
+                   and series_text.endswith("Итого: 22 / 6")
+                   and multi_text == "📊 Результат:\nвидео: 120\nпросмотры: 34567\nлайки: 890"
+                   and "еще 61 дн." in long_text and long_text.count("\n") == 32
+                   and "Итого" not in format_rows(dict(SERIES_ARGS, intent="UNIQUE_ACTIVE"), merged)))
+
+    # 5. answer(): one LLM call and one query for both metrics; no speculation on several metrics
+    queries = []
+
+    async def execute_rows(sql, deadline=None, keys=0):
+        queries.append((sql, keys))
+        return [["2025-11-24", 10, 1]]
+
+    original = (llm_engine.client, speculation.execute_rows, settings.similarity_enabled)
+    client = StubClient(SERIES_ARGS)
+    try:
+        llm_engine.client = client
+        speculation.execute_rows = execute_rows
+        settings.similarity_enabled = False
+        answer_cache.entries.clear()
+        question = "Прирост просмотров и лайков по дням с 24 по 30 ноября 2025"
+        result = await speculation.answer(question)
+        again = await speculation.answer(question)
+    finally:
+        llm_engine.client, speculation.execute_rows, settings.similarity_enabled = original
+    checks.append((f"answer: {client.calls} LLM calls, {len(queries)} query",
+                   result == again == [["2025-11-24", 10, 1]] and queries == [(series_sql, 1)]
+                   and client.calls == 2 and speculation.guess_args("Сколько просмотров и лайков?") == []))
+
+    # 6. Untrusted extractions outside the enums are refused before any SQL is built or run
+    injected = dict(MULTI_ARGS, metric_fields=["delta_views_count", "1) FROM videos; DROP TABLE videos; --"])
+    refused = []
+    for args in (injected, dict(MULTI_ARGS, target_table="pg_user"), dict(SERIES_ARGS, group_by="hour"),
+                 dict(MULTI_ARGS, creator_id="x' OR '1'='1"), dict(MULTI_ARGS, date_from="2025-11-24'--")):
+        try:
+            build_sql(args)
+        except ValueError:
+            refused.append(True)
+    queries.clear()
+    original = (llm_engine.client, speculation.execute_rows, settings.similarity_enabled, settings.shared_cache_enabled)
+    client = StubClient(injected)
+    try:
+        llm_engine.client = client
+        speculation.execute_rows = execute_rows
+        settings.similarity_enabled = settings.shared_cache_enabled = False
+        answer_cache.entries.clear()
+        await speculation.answer("Прирост просмотров и чего-то еще с 24 по 30 ноября 2025")
+        refused_answer = False
+    except ValueError:
+        refused_answer = True
+    finally:
+        (llm_engine.client, speculation.execute_rows,
+         settings.similarity_enabled, settings.shared_cache_enabled) = original
+    checks.append(("arguments outside the enums refused", len(refused) == 5 and refused_answer and not queries))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_multi_metric())
+    exit(0 if success else 1)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Test the bounded work queue: round-robin service, backpressure, metrics - offline
+"""
+import asyncio
+from src import metrics
+from src.pipeline import WorkQueue
+from helpers import summarize
+
+
+async def test_pipeline():
+    """Check round-robin order across users, fixed concurrency and load shedding"""
+
+    print("=" * 80)
+    print("WORK QUEUE TEST")
+    print("=" * 80)
+
+    checks = []
+    metrics.reset()
+
+    # 1. Round-robin: user A queues 6 questions before B and C queue 2 each
+    served = []
+
+    async def record(item):
+        served.append(item)
+        await asyncio.sleep(0.01)
+
+    work_queue = WorkQueue(record, workers=1, maxsize=100)
+    for user in "AAAAAABCBC":
+        work_queue.submit(user, user)
+    work_queue.start()
+    while work_queue.size:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.02)
+    await work_queue.stop()
+    print(f"Service order: {''.join(served)}")
+    checks.append(("B and C served before A's backlog", "".join(served) == "ABCABCAAAA"))
+
+    # 2. One user's questions never run at once, even with idle workers; others run alongside
+    active, overlap, finished = {}, [], []
+
+    async def per_user(item):
+        user, number = item
+        active[user] = active.get(user, 0) + 1
+        overlap.append(active[user])
+        await asyncio.sleep(0.02 if number == 0 else 0.005)
+        active[user] -= 1
+        finished.append(item)
+
+    work_queue = WorkQueue(per_user, workers=4, maxsize=100)
+    work_queue.start()
+    for number in range(5):
+        work_queue.submit("A", ("A", number))
+    work_queue.submit("B", ("B", 1))
+    while work_queue.size or any(active.values()):
+        await asyncio.sleep(0.01)
+    await work_queue.stop()
+    order = [number for user, number in finished if user == "A"]
+    checks.append((f"one user at a time, in order ({order})", max(overlap) == 1
+                   and order == list(range(5)) and finished[0] == ("B", 1)))
+
+    # 3. Fixed concurrency and overflow rejection
+    running = 0
+    peak = 0
+
+    async def slow(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    work_queue = WorkQueue(slow, workers=3, maxsize=10)
+    work_queue.start()
+    accepted = sum(work_queue.submit(i, i) for i in range(50))
+    checks.append((f"overflow rejected immediately ({accepted}/50 accepted)", accepted == 10))
+    while work_queue.size or running:
+        await asyncio.sleep(0.01)
+    await work_queue.stop()
+    checks.append((f"concurrency bounded by workers (peak {peak})", peak == 3))
+
+    # 4. Metrics
+    wait = metrics.get_summary("work_queue_wait_seconds")
+    checks.append(("queue wait time exported", wait is not None and wait.count == 26))
+    checks.append(("rejections exported", metrics.get_counter("work_queue_rejected_total") == 40))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_pipeline())
+    exit(0 if success else 1)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test LLM token accounting and the compact prompt/schema mode - offline
+
+The compact mode is also validated against the verbose one on the question
+set of tests/cassettes/ (llm.json and llm_compact.json) once both have been
+recorded against the live API; without them that check is skipped:
+
+    LLM_CASSETTE_MODE=record python tests/test_llm_engine.py
+    LLM_CASSETTE_MODE=record LLM_PROMPT_MODE=compact LLM_CASSETTE_PATH=tests/cassettes/llm_compact.json \\
+        python tests/test_llm_engine.py
+"""
+import asyncio
+import json
+import os
+import tempfile
+from src import llm_engine, metrics
+from src.cassette import Cassette, compare_cassettes
+from src.config import settings
+from src.llm_engine import COMPACT_TOOLS, TOOLS, build_compact_prompt, build_sql, build_system_prompt
+from src.querylog import COLUMNS, RequestTrace
+from helpers import StubClient, summarize
+
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes")
+CASSETTES = (os.path.join(CASSETTE_DIR, "llm.json"), os.path.join(CASSETTE_DIR, "llm_compact.json"))
+
+
+def usage(request: dict) -> tuple:
+    """Prompt tokens grow with the tool schema sent"""
+    return len(json.dumps(request["tools"])) // 4, 30
+
+
+def cassette_entry(question: str, args: dict, prompt_tokens: int) -> dict:
+    return {
+        "request": {"messages": [{"role": "user", "content": question}]},
+        "response": {
+            "choices": [{"message": {"tool_calls": [{"function": {"arguments": json.dumps(args)}}]}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 25}
+        },
+        "elapsed": 1.0
+    }
+
+
+def recorded_validation() -> list:
+    if not all(os.path.exists(path) for path in CASSETTES):
+        print("[INFO] Verbose and compact cassettes not recorded - validation on the question set skipped")
+        return []
+    report = compare_cassettes(Cassette(CASSETTES[0]), Cassette(CASSETTES[1]), build_sql)
+    for question, expected, actual in report["mismatches"]:
+        print(f"[INFO] Compact mismatch: {question!r}: {expected} -> {actual}")
+    reference, candidate = report["tokens"]["reference"][0], report["tokens"]["candidate"][0]
+    return [(f"recorded set: compact accuracy {report['accuracy']}, prompt tokens {reference} -> {candidate}",
+             report["accuracy"] == 1.0 and candidate < reference)]
+
+
+async def test_prompt_modes():
+    """Check the compact schema, per-request token accounting and cassette comparison"""
+
+    print("=" * 80)
+    print("PROMPT MODES AND TOKEN ACCOUNTING TEST")
+    print("=" * 80)
+
+    checks = []
+
+    # 1. Compact schema: same parameters, enums and required fields, much smaller
+    verbose, compact = TOOLS[0]["function"]["parameters"], COMPACT_TOOLS[0]["function"]["parameters"]
+    same_schema = verbose["required"] == compact["required"] and verbose["properties"].keys() == compact["properties"].keys() and all(
+        spec.get("enum") == compact["properties"][name].get("enum")
+        and spec.get("items", {}).get("enum") == compact["properties"][name].get("items", {}).get("enum")
+        for name, spec in verbose["properties"].items()
+    )
+    verbose_size = len(json.dumps(TOOLS, ensure_ascii=False)) + len(build_system_prompt())
+    compact_size = len(json.dumps(COMPACT_TOOLS, ensure_ascii=False)) + len(build_compact_prompt())
+    checks.append((f"compact schema matches, {verbose_size} -> {compact_size} chars",
+                   same_schema and compact_size < verbose_size * 0.6))
+
+    # 2. Tokens of every call in the cascade recorded per request and as metrics
+    good = {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"}
+    bad = {"intent": "GROWTH_DYNAMIC", "target_table": "videos", "metric_field": "id"}
+    original = (llm_engine.client, settings.llm_small_model, settings.llm_prompt_mode,
+                settings.similarity_enabled, settings.shared_cache_enabled)
+    try:
+        llm_engine.client = StubClient([bad, good], usage=usage)
+        settings.llm_small_model, settings.similarity_enabled, settings.shared_cache_enabled = "small-model", False, False
+        settings.llm_prompt_mode = "verbose"
+        before = metrics.get_counter("llm_tokens_total", kind="prompt", tier="large", mode="verbose")
+        trace = RequestTrace("Сколько всего видео?")
+        await llm_engine.extract_params("Сколько всего видео?", trace=trace)
+        verbose_prompt = llm_engine.client.requests[-1]["tools"]
+        per_call = len(json.dumps(TOOLS)) // 4
+        checks.append((f"tokens per request: {trace.prompt_tokens} prompt, {trace.completion_tokens} completion",
+                       trace.prompt_tokens == 2 * per_call and trace.completion_tokens == 60 and verbose_prompt is TOOLS
+                       and metrics.get_counter("llm_tokens_total", kind="prompt", tier="large", mode="verbose") - before == per_call))
+
+        # 3. Compact mode sends the compact prompt and schema
+        llm_engine.client = StubClient([good], usage=usage)
+        settings.llm_small_model, settings.llm_prompt_mode = "", "compact"
+        compact_trace = RequestTrace("Сколько всего видео?")
+        await llm_engine.extract_params("Сколько всего видео?", trace=compact_trace)
+        request = llm_engine.client.requests[-1]
+        checks.append((f"compact mode request ({compact_trace.prompt_tokens} prompt tokens)",
+                       request["tools"] is COMPACT_TOOLS and request["messages"][0]["content"] == build_compact_prompt()
+                       and compact_trace.prompt_tokens < per_call))
+    finally:
+        (llm_engine.client, settings.llm_small_model, settings.llm_prompt_mode,
+         settings.similarity_enabled, settings.shared_cache_enabled) = original
+
+    # 4. Tokens go to query_log; questions answered without LLM leave them empty
+    record = dict(zip(COLUMNS, trace.record()))
+    cached = dict(zip(COLUMNS, RequestTrace("Сколько всего видео?").record()))
+    checks.append(("query_log record carries tokens", len(record) == len(COLUMNS)
+                   and record["prompt_tokens"] == trace.prompt_tokens and cached["completion_tokens"] is None))
+
+    # 5. Cassette comparison: equivalent extractions match through build_sql
+    with tempfile.TemporaryDirectory() as directory:
+        reference, candidate = Cassette(os.path.join(directory, "a.json")), Cassette(os.path.join(directory, "b.json"))
+        views = {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "views_count"}
+        reference.put("k1", cassette_entry("Сколько всего видео?", good, 900))
+        reference.put("k2", cassette_entry("Сколько всего просмотров?", views, 900))
+        reference.put("k3", cassette_entry("Сколько лайков?", dict(views, metric_field="likes_count"), 900))
+        candidate.put("k1", cassette_entry("Сколько всего видео?", dict(good, metric_fields=["id"]), 300))
+        candidate.put("k2", cassette_entry("Сколько всего просмотров?", dict(views, metric_field="likes_count"), 300))
+        report = compare_cassettes(reference, candidate, build_sql)
+    checks.append((f"cassette comparison {report['matched']}/{report['questions']}, tokens {report['tokens']}",
+                   report["questions"] == 2 and report["matched"] == 1 and report["accuracy"] == 0.5
+                   and report["mismatches"][0][0] == "Сколько всего просмотров?"
+                   and report["tokens"] == {"reference": [1800, 50], "candidate": [600, 50]}))
+
+    checks.extend(recorded_validation())
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_prompt_modes())
+    exit(0 if success else 1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Test the query log: request traces and write-behind batching - offline
+"""
+import asyncio
+from src import llm_engine, metrics, speculation
+from src.config import settings
+from src.querylog import COLUMNS, QueryLog, RequestTrace
+from helpers import StubClient, summarize
+
+
+class MemoryQueryLog(QueryLog):
+    """QueryLog writing batches to a list instead of COPY; can be made to fail"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+        self.failing = False
+        self.delay = 0
+
+    async def _copy(self, records: list):
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise ConnectionError("database is down")
+        self.batches.append(list(records))
+
+    async def _apply_retention(self):
+        pass
+
+
+async def fake_execute_scalar(sql: str, deadline=None):
+    await asyncio.sleep(0.01)
+    return 42
+
+
+def trace(question: str = "Сколько всего видео?") -> RequestTrace:
+    item = RequestTrace(question)
+    item.outcome = "ok"
+    return item
+
+
+async def test_querylog():
+    """Check trace records, batching, retry after failure and overflow"""
+
+    print("=" * 80)
+    print("QUERY LOG TEST")
+    print("=" * 80)
+
+    checks = []
+    metrics.reset()
+
+    # 1. Trace -> record for COPY
+    item = RequestTrace("  Сколько   ВСЕГО видео  28 ноября? ")
+    item.sql = "SELECT COUNT(id) FROM videos WHERE video_created_at::DATE = '2025-11-28'"
+    item.mark("llm", 0.25)
+    item.outcome = "ok"
+    record = dict(zip(COLUMNS, item.record()))
+    checks.append(("record: normalized text, SQL template, stage ms",
+                   len(record) == len(COLUMNS)
+                   and record["question"] == "сколько всего видео 28 ноября?"
+                   and record["sql_template"].endswith("::DATE = ?")
+                   and record["llm_ms"] == 250.0 and record["sql_ms"] is None))
+
+    # 2. A full batch wakes the background writer
+    log = MemoryQueryLog(batch_size=10, flush_interval=60, max_buffer=100)
+    log.start()
+    for _ in range(10):
+        log.record(trace())
+    await asyncio.sleep(0.05)
+    checks.append(("full batch flushed in one COPY", [len(b) for b in log.batches] == [10] and not log.buffer))
+
+    # 3. Failed COPY keeps the records for the next flush
+    log.failing = True
+    for _ in range(3):
+        log.record(trace())
+    await log.flush()
+    kept = len(log.buffer)
+    log.failing = False
+    await log.flush()
+    checks.append(("records kept after failed COPY", kept == 3 and len(log.batches) == 2 and not log.buffer))
+
+    # 4. Overflow drops the oldest records instead of growing
+    small = MemoryQueryLog(batch_size=1000, flush_interval=60, max_buffer=5)
+    for i in range(8):
+        small.record(trace(f"вопрос {i}"))
+    checks.append(("overflow drops oldest",
+                   len(small.buffer) == 5 and small.buffer[0][1] == "вопрос 3"
+                   and metrics.get_counter("query_log_dropped_total") == 3))
+
+    # 5. Records arriving during a COPY into a full buffer: each one written once or counted as dropped
+    busy = MemoryQueryLog(batch_size=5, flush_interval=60, max_buffer=5)
+    busy.delay = 0.02
+    for i in range(5):
+        busy.record(trace(f"вопрос {i}"))
+    flushing = asyncio.create_task(busy.flush())
+    await asyncio.sleep(0.005)
+    for i in range(5, 10):
+        busy.record(trace(f"вопрос {i}"))
+    await flushing
+    written = [record[1] for batch in busy.batches for record in batch]
+    busy.failing, dropped = True, metrics.get_counter("query_log_dropped_total")
+    for i in range(10, 15):
+        busy.record(trace(f"вопрос {i}"))
+    flushing = asyncio.create_task(busy.flush())
+    await asyncio.sleep(0.005)
+    for i in range(15, 17):
+        busy.record(trace(f"вопрос {i}"))
+    await flushing
+    checks.append(("records during COPY neither lost nor written twice",
+                   written == [f"вопрос {i}" for i in range(10)]
+                   and [record[1] for record in busy.buffer] == [f"вопрос {i}" for i in range(12, 17)]
+                   and metrics.get_counter("query_log_dropped_total") - dropped == 2))
+
+    # 6. stop() flushes what is left
+    log.record(trace())
+    await log.stop()
+    checks.append(("stop flushes remainder", len(log.batches) == 3 and not log.buffer))
+
+    # 7. answer() fills the trace: path, args, SQL and stage timings
+    original = llm_engine.client, speculation.execute_scalar, settings.similarity_enabled
+    try:
+        settings.similarity_enabled = False
+        llm_engine.client = StubClient({"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"}, delay=0.05)
+        speculation.execute_scalar = fake_execute_scalar
+        item = RequestTrace("Что нового?")
+        await speculation.answer("Что нового?", trace=item)
+        checks.append((f"trace filled by answer (path={item.path})",
+                       item.path == "llm_large" and item.args["intent"] == "TOTAL_STATIC"
+                       and item.sql == "SELECT COUNT(id) FROM videos"
+                       and item.stages["llm"] >= 0.05 and "sql" in item.stages))
+    finally:
+        llm_engine.client, speculation.execute_scalar, settings.similarity_enabled = original
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_querylog())
+    exit(0 if success else 1)
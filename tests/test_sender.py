@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test the rate-limited outbound sender and progress indicator - offline
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from src.ratelimit import TokenBucket
+from src.sender import Sender, Progress
+from helpers import summarize
+
+
+class FakeBot:
+    """Records Telegram API calls; can fail the first send with retry_after"""
+
+    def __init__(self, flood_first: bool = False):
+        self.calls = []
+        self.flood_first = flood_first
+        self.next_id = 1
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.flood_first:
+            self.flood_first = False
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Flood control", 1)
+        self.calls.append(("sendMessage", chat_id, text))
+        self.next_id += 1
+        return SimpleNamespace(message_id=self.next_id)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.calls.append(("editMessageText", chat_id, text))
+
+    async def send_chat_action(self, chat_id, action):
+        self.calls.append(("sendChatAction", chat_id, action))
+
+
+def methods(bot: FakeBot) -> list:
+    return [call[0] for call in bot.calls]
+
+
+async def test_sender():
+    """Check round-trips per answer, retry_after handling and per-chat limits"""
+
+    print("=" * 80)
+    print("OUTBOUND SENDER TEST")
+    print("=" * 80)
+
+    checks = []
+
+    # 1. Quick answer: chat action + one message, no progress message
+    bot = FakeBot()
+    sender = Sender(bot)
+    progress = Progress(sender, 1, delay=0.2)
+    async with progress:
+        await asyncio.sleep(0.05)
+    await progress.reply("📊 Результат: 1")
+    checks.append((f"quick answer {methods(bot)}", methods(bot) == ["sendChatAction", "sendMessage"]))
+
+    # 2. Slow answer: progress message edited in place, nothing deleted
+    bot = FakeBot()
+    sender = Sender(bot)
+    progress = Progress(sender, 2, delay=0.05)
+    async with progress:
+        await asyncio.sleep(0.2)
+    await progress.reply("📊 Результат: 2")
+    checks.append((
+        f"slow answer {methods(bot)}",
+        methods(bot) == ["sendChatAction", "sendMessage", "editMessageText"]
+    ))
+
+    # 3. retry_after: the answer is delayed, not dropped
+    bot = FakeBot(flood_first=True)
+    sender = Sender(bot)
+    start = time.perf_counter()
+    await sender.send_message(3, "answer")
+    elapsed = time.perf_counter() - start
+    checks.append((f"retry_after honoured ({elapsed:.2f} s)", elapsed >= 1.0 and methods(bot) == ["sendMessage"]))
+
+    # 4. Per-chat token bucket: burst of 2, then 10 msg/s
+    bot = FakeBot()
+    sender = Sender(bot)
+    sender.chat_buckets[4] = TokenBucket(rate=10, capacity=2)
+    start = time.perf_counter()
+    await asyncio.gather(*(sender.send_message(4, f"m{i}") for i in range(6)))
+    elapsed = time.perf_counter() - start
+    checks.append((f"per-chat limit paces sends ({elapsed:.2f} s)", 0.35 <= elapsed < 1.0 and len(bot.calls) == 6))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_sender())
+    exit(0 if success else 1)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Test the cache shared by bot processes and its invalidation.
+
+Two processes are simulated offline: the first answers through the LLM and
+the database, the second starts with empty in-process caches and must get
+both the extraction and the answer from the shared table. If PostgreSQL is
+reachable, a LISTEN/NOTIFY round trip is checked on the real table too.
+"""
+import asyncio
+from decimal import Decimal
+import asyncpg
+from src import llm_engine, metrics, speculation
+from src.cache import MISSING, answer_cache
+from src.config import settings
+from src.querylog import RequestTrace
+from src.shared_cache import INVALIDATE_CHANNEL, SharedCache, decode, encode
+from src.similarity import SimilarityIndex
+from helpers import StubClient, summarize
+
+QUESTION_ARGS = {
+    "intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots",
+    "metric_field": "delta_likes_count", "date_exact": "2025-11-28"
+}
+
+
+class MemorySharedCache(SharedCache):
+    """Shared cache over a dict instead of the shared_cache table"""
+
+    def __init__(self):
+        super().__init__(timeout=0.2, pool_size=1, cleanup_interval=300)
+        self._pool = "memory"
+        self.table = {}
+        self.failing = False
+
+    async def _fetch(self, kind, key, version):
+        if self.failing:
+            raise ConnectionError("database is down")
+        row = self.table.get((kind, key))
+        if row is None or row[1] != version:
+            return MISSING
+        return decode(row[0])
+
+    async def _store(self, kind, key, value, version, ttl):
+        self.table[(kind, key)] = (encode(value), version)
+
+    async def flush(self):
+        await asyncio.gather(*self._writes)
+
+
+def new_process():
+    """Forget everything a process keeps in memory"""
+    answer_cache.entries.clear()
+    llm_engine.similar_questions = SimilarityIndex(settings.similarity_threshold, settings.similarity_max_entries)
+
+
+async def live_checks() -> list:
+    """NOTIFY from another connection reaches the listener; real table round trip"""
+    params = dict(user=settings.postgres_user, password=settings.postgres_password,
+                  database=settings.postgres_db, host=settings.postgres_host, port=settings.postgres_port)
+    try:
+        conn = await asyncpg.connect(timeout=2, **params)
+    except Exception:
+        print("[INFO] PostgreSQL not reachable - live shared cache checks skipped")
+        return []
+
+    checks = []
+    cache = SharedCache(timeout=1.0, pool_size=2, cleanup_interval=300)
+    notified = []
+    cache.subscribers.append(notified.append)
+    try:
+        await cache.start()
+        version = answer_cache.data_version
+        cache.put_answer("SELECT 'live'", Decimal("42"))
+        await asyncio.gather(*cache._writes)
+        checks.append(("live: answer round trip", await cache.get_answer("SELECT 'live'") == Decimal("42")))
+
+        await conn.execute("SELECT pg_notify($1, $2)", INVALIDATE_CHANNEL, str(version + 1000))
+        await asyncio.sleep(0.5)
+        checks.append(("live: NOTIFY invalidates", notified == [version + 1000]))
+    finally:
+        await conn.execute("DELETE FROM shared_cache WHERE key = 'SELECT ''live'''")
+        await conn.close()
+        await cache.stop()
+    return checks
+
+
+async def test_shared_cache():
+    """Check cross-process reuse, version isolation, invalidation and failure handling"""
+
+    print("=" * 80)
+    print("SHARED CACHE TEST")
+    print("=" * 80)
+
+    checks = []
+    metrics.reset()
+    memory = MemorySharedCache()
+    client = StubClient(QUESTION_ARGS)
+    executed = []
+
+    async def execute_scalar(sql, deadline=None):
+        executed.append(sql)
+        return Decimal("1234")
+
+    import src.shared_cache as shared_cache_module
+    saved = (llm_engine.client, llm_engine.shared_cache, shared_cache_module.shared_cache,
+             speculation.execute_scalar, llm_engine.similar_questions, settings.speculation_enabled,
+             answer_cache.data_version)
+    try:
+        llm_engine.client = client
+        llm_engine.shared_cache = shared_cache_module.shared_cache = memory
+        speculation.execute_scalar = execute_scalar
+        settings.speculation_enabled = False
+        answer_cache.data_version = 1
+        new_process()
+
+        # 1. First process: LLM + database, both results shared
+        question = "Сколько лайков прибавилось 28 ноября 2025?"
+        first = await speculation.answer(question)
+        await memory.flush()
+        checks.append((f"first process shares extraction and answer ({sorted(k for k, _ in memory.table)})",
+                       client.calls == 1 and len(executed) == 1
+                       and {kind for kind, _ in memory.table} == {"args", "answer"}))
+
+        # 2. Second process: no LLM call, no database query, same answer
+        new_process()
+        trace = RequestTrace(question)
+        second = await speculation.answer(question, trace=trace)
+        checks.append((f"second process served from shared cache (path {trace.path})",
+                       second == first == Decimal("1234") and client.calls == 1 and len(executed) == 1
+                       and trace.path == "shared+cache"))
+
+        # 3. Another date reuses the extraction with the date re-filled
+        new_process()
+        trace = RequestTrace("Сколько лайков прибавилось 27 ноября 2025?")
+        await speculation.answer(trace.question, trace=trace)
+        checks.append(("template extraction re-filled with the new date",
+                       client.calls == 1 and "2025-11-27" in executed[-1] and trace.path == "shared"))
+
+        # 4. New data version: in-process answers dropped, stale shared answers ignored
+        notified = []
+        memory.subscribers.append(notified.append)
+        memory._on_notify(None, 1, INVALIDATE_CHANNEL, "2")
+        memory._on_notify(None, 1, INVALIDATE_CHANNEL, "garbage")
+        stale = await memory.get_answer(executed[0])
+        checks.append(("NOTIFY invalidates process cache and old answers",
+                       notified == [2] and len(answer_cache) == 0 and stale is MISSING))
+
+        # 5. Values keep their types; relative dates are not shared
+        values = [Decimal("12345678901234567890"), Decimal("1.5"), 7, None]
+        await memory.flush()
+        before = len(memory.table)
+        memory.put_args("Сколько лайков было вчера?", dict(QUESTION_ARGS))
+        await memory.flush()
+        checks.append(("Decimal/None round trip, relative dates kept local",
+                       [decode(encode(value)) for value in values] == values
+                       and type(decode(encode(values[0]))) is Decimal and len(memory.table) == before))
+
+        # 6. List-valued arguments survive the round trip next to date slots
+        multi = dict(QUESTION_ARGS, metric_field="delta_views_count",
+                     metric_fields=["delta_views_count", "delta_likes_count"])
+        memory.put_args("На сколько выросли просмотры и лайки 28 ноября 2025?", multi)
+        await memory.flush()
+        shared = await memory.get_args("На сколько выросли просмотры и лайки 26 ноября 2025?")
+        checks.append(("metric_fields round trip", shared == dict(multi, date_exact="2025-11-26")))
+
+        # 7. Database errors are misses, not failures
+        memory.failing = True
+        new_process()
+        result = await speculation.answer(question)
+        checks.append(("shared cache errors fall back to LLM and database",
+                       result == Decimal("1234") and client.calls == 2
+                       and metrics.get_counter("shared_cache_total", kind="args", outcome="error") == 1))
+    finally:
+        (llm_engine.client, llm_engine.shared_cache, shared_cache_module.shared_cache,
+         speculation.execute_scalar, llm_engine.similar_questions, settings.speculation_enabled,
+         answer_cache.data_version) = saved
+        answer_cache.entries.clear()
+
+    checks.extend(await live_checks())
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_shared_cache())
+    exit(0 if success else 1)
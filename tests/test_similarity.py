@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test the similarity index over answered questions - offline
+"""
+import asyncio
+import random
+import time
+from src import llm_engine
+from src.similarity import SimilarityIndex
+from helpers import StubClient, summarize
+
+TOTAL = {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"}
+GROWTH = {"intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots", "metric_field": "delta_views_count"}
+CREATOR = "aca1061a9d324ecf8c3fa2bb32d7be63"
+
+
+def build_large_index(size: int) -> tuple:
+    """Index with `size` distinct synthetic questions and probes close to some of them"""
+    rng = random.Random(1)
+    vocab = ["сколько", "видео", "просмотров", "лайков", "комментариев", "выросли", "разных",
+             "креатора", "набрали", "больше", "опубликовано", "вышло", "суммарно", "за", "день",
+             "неделю", "месяц", "новых", "получали", "итого", "было", "стало", "число"]
+    letters = "абвгдежзиклмнопрстуфхцчшщыэюя"
+    filler = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(3000)]
+    questions = [" ".join(rng.sample(vocab, 4) + rng.sample(filler, 2)) for _ in range(size)]
+
+    index = SimilarityIndex(max_entries=size)
+    for question in questions:
+        index.add(question, TOTAL)
+    # Half of the probes are typos of stored questions, half are new
+    probes = [question[:-1] for question in questions[:500]]
+    probes += [" ".join(rng.sample(vocab, 4) + rng.sample(filler, 2)) for _ in range(500)]
+    return index, probes
+
+
+async def test_similarity():
+    """Check rephrasing hits, slot re-filling, misses and lookup latency"""
+
+    print("=" * 80)
+    print("SIMILARITY INDEX TEST")
+    print("=" * 80)
+
+    checks = []
+    index = SimilarityIndex()
+    index.add("Сколько всего видео есть в системе?", TOTAL)
+    index.add("На сколько выросли просмотры 28 ноября 2025?", dict(GROWTH, date_exact="2025-11-28"))
+    index.add(
+        f"Сколько видео у креатора {CREATOR} вышло с 1 по 5 ноября 2025 включительно?",
+        dict(TOTAL, creator_id=CREATOR, date_from="2025-11-01", date_to="2025-11-05")
+    )
+
+    # 1. Rephrasings of a known question reuse its extraction
+    hits = [index.lookup(q) for q in ("сколько всего видосов?", "Сколько видео всего")]
+    checks.append(("rephrasings hit", all(hit and hit[0] == TOTAL for hit in hits)))
+
+    # 2. Dates and creator ids are re-filled from the new question
+    hit = index.lookup("на сколько выросли просмотры 3 декабря 2025")
+    checks.append(("date slot re-filled", hit is not None and hit[0] == dict(GROWTH, date_exact="2025-12-03")))
+    other = "0123456789abcdef0123456789abcdef"
+    hit = index.lookup(f"Сколько видео у креатора {other} вышло с 10 по 20 ноября 2025 включительно?")
+    checks.append(("range and creator re-filled", hit is not None and hit[0] == dict(
+        TOTAL, creator_id=other, date_from="2025-11-10", date_to="2025-11-20"
+    )))
+
+    # 3. A different metric or a different number of dates is a novelty
+    checks.append(("different metric misses", index.lookup("На сколько выросли лайки 3 декабря 2025?") is None))
+    checks.append(("missing date misses", index.lookup("На сколько выросли просмотры?") is None))
+
+    # 4. Arguments with dates not taken from the text (relative dates) are not stored
+    checks.append(("relative dates not stored",
+                   not index.add("Сколько видео вышло вчера?", dict(TOTAL, date_exact="2025-11-27"))))
+
+    # 5. Relative dates never reuse an undated extraction
+    likes, views = dict(TOTAL, metric_field="likes_count"), dict(GROWTH)
+    index.add("Сколько лайков набрали все видео в системе?", likes)
+    index.add("На сколько выросли просмотры всех видео?", views)
+    relative = ("Сколько лайков набрали все видео в системе вчера?",
+                "Сколько лайков набрали все видео в системе за неделю?",
+                "На сколько выросли просмотры всех видео вчера?",
+                "На сколько выросли просмотры всех видео за последний месяц?")
+    checks.append(("relative dates miss undated questions", all(index.lookup(q) is None for q in relative)
+                   and index.lookup("Сколько лайков набрали все видео?") is not None))
+
+    # 6. Prepositions, negations and thresholds change the question
+    index.add("Сколько видео вышло 28 ноября 2025?", dict(TOTAL, date_exact="2025-11-28"))
+    index.add("Сколько видео набрало больше 1000 просмотров?", TOTAL)
+    near_misses = ("Сколько видео вышло до 28 ноября 2025?", "Сколько видео вышло после 28 ноября 2025?",
+                   "Сколько видео вышло с 28 ноября 2025?", "Сколько видео не вышло 28 ноября 2025?",
+                   "Сколько видео вышло по 28 ноября 2025?", "Сколько видео набрало меньше 1000 просмотров?",
+                   "Сколько видео набрало больше 5000 просмотров?", "Сколько видео набрало не больше 1000 просмотров?")
+    checks.append(("prepositions, negations and thresholds miss",
+                   all(index.lookup(q) is None for q in near_misses)
+                   and index.lookup("Сколько видосов вышло 3 декабря 2025?") is not None))
+
+    # 7. Through the engine: the second, rephrased question does not reach the LLM
+    original_client, original_index = llm_engine.client, llm_engine.similar_questions
+    client = StubClient(dict(GROWTH, date_exact="2025-11-28"))
+    try:
+        llm_engine.client = client
+        llm_engine.similar_questions = SimilarityIndex()
+        await llm_engine.get_sql_query("На сколько выросли просмотры 28 ноября 2025?")
+        sql = await llm_engine.get_sql_query("на сколько в сумме выросли просмотры 2 декабря 2025")
+        checks.append(("engine reuses extraction without LLM call",
+                       client.calls == 1 and "2025-12-02" in sql))
+    finally:
+        llm_engine.client, llm_engine.similar_questions = original_client, original_index
+
+    # 8. Lookup latency at 100k stored questions
+    index, probes = build_large_index(100000)
+    start = time.perf_counter()
+    found = sum(index.lookup(probe) is not None for probe in probes)
+    average_ms = (time.perf_counter() - start) / len(probes) * 1000
+    checks.append((f"lookup at {len(index)} entries: {average_ms:.3f} ms avg, {found} hits",
+                   average_ms < 1.0 and found >= 450))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_similarity())
+    exit(0 if success else 1)
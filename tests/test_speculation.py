@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test speculative SQL execution in parallel with the LLM call - offline
+"""
+import asyncio
+import time
+from src import llm_engine, metrics, speculation
+from src.cache import answer_cache
+from src.config import settings
+from src.deadline import NO_DEADLINE, Deadline
+from helpers import StubClient, summarize
+
+LLM_DELAY = 0.3
+SQL_DELAY = 0.2
+
+
+class StubDatabase:
+    """execute_scalar stand-in: records queries, returns the query length"""
+
+    def __init__(self):
+        self.queries = []
+
+    async def execute_scalar(self, sql: str, deadline=None):
+        self.queries.append(sql)
+        await asyncio.sleep(SQL_DELAY)
+        return len(sql)
+
+
+async def ask(question: str, args: dict) -> tuple:
+    llm_engine.client = StubClient(args, delay=LLM_DELAY)
+    database = StubDatabase()
+    speculation.execute_scalar = database.execute_scalar
+    answer_cache.entries.clear()
+    start = time.perf_counter()
+    result = await speculation.answer(question)
+    return result, database.queries, time.perf_counter() - start
+
+
+async def test_speculation():
+    """Check guesses, hits, misses and the wasted-time accounting"""
+
+    print("=" * 80)
+    print("SPECULATIVE SQL TEST")
+    print("=" * 80)
+
+    checks = []
+    metrics.reset()
+    original = llm_engine.client, speculation.execute_scalar, settings.similarity_enabled
+    settings.similarity_enabled = False
+    views = {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "views_count"}
+    growth = {"intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots",
+              "metric_field": "delta_views_count", "date_exact": "2025-11-28"}
+    try:
+        # 1. Local guesses
+        checks.append(("'всего просмотров' -> TOTAL_STATIC views_count",
+                       speculation.guess_args("Сколько всего просмотров?") == [views]))
+        checks.append(("growth with a date guessed", speculation.guess_args(
+            "На сколько выросли просмотры 28 ноября 2025?") == [growth]))
+        checks.append(("relative date / threshold not guessed",
+                       speculation.guess_args("Сколько просмотров было вчера?") == []
+                       and speculation.guess_args("Сколько видео набрали больше 100000 просмотров?") == []))
+
+        # 2. Hit: the guessed query runs while the LLM thinks
+        result, queries, elapsed = await ask("Сколько всего просмотров?", views)
+        checks.append((f"hit served without a second query ({elapsed:.2f} s)",
+                       len(queries) == 1 and elapsed < LLM_DELAY + SQL_DELAY - 0.1
+                       and result == len(llm_engine.build_sql(views))))
+
+        # 3. Miss: the guess is discarded and the confirmed query runs
+        result, queries, elapsed = await ask("Сколько всего просмотров?", dict(views, metric_field="likes_count"))
+        checks.append(("miss runs the confirmed query",
+                       len(queries) == 2 and "likes_count" in queries[1]
+                       and result == len(queries[1])))
+
+        # 4. Nothing to guess -> no speculation
+        _, queries, _ = await ask("Что нового?", views)
+        checks.append(("unguessable question not speculated", len(queries) == 1))
+
+        checks.append(("metrics: 1 hit, 1 miss, 1 none, wasted time recorded",
+                       metrics.get_counter("speculation_questions_total", outcome="hit") == 1
+                       and metrics.get_counter("speculation_questions_total", outcome="miss") == 1
+                       and metrics.get_counter("speculation_questions_total", outcome="none") == 1
+                       and metrics.get_counter("speculative_queries_total", outcome="wasted") == 1
+                       and metrics.get_counter("speculation_wasted_seconds_total") >= SQL_DELAY - 0.05))
+
+        # 5. Guesses cancelled before their first step (deadline spent in the queue) free their slots
+        answer_cache.entries.clear()
+        for _ in range(settings.speculation_max_inflight + 2):
+            await speculation.discard(speculation.start_speculation("Сколько всего просмотров?", Deadline(0)))
+        tasks = speculation.start_speculation("Сколько всего просмотров?", NO_DEADLINE)
+        checks.append((f"cancel before start releases slots ({speculation._inflight} in flight)",
+                       len(tasks) == 1 and speculation._inflight == 1))
+        await speculation.discard(tasks)
+    finally:
+        llm_engine.client, speculation.execute_scalar, settings.similarity_enabled = original
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_speculation())
+    exit(0 if success else 1)
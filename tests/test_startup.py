@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test fast startup: no LLM client or database engine at import, schema version check, parallel phases - offline
+
+With PostgreSQL running, init_db() is also run twice on the real database:
+the second run must only check the version.
+"""
+import asyncio
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy.exc import ProgrammingError
+from src import database
+from src.database import MIGRATIONS, SCHEMA_VERSION, SHARD_MIGRATIONS, migrate
+from src.startup import StartupTimer
+from helpers import summarize, with_postgres
+
+
+class FakeDatabase:
+    """Engine stand-in recording statements; knows only the schema_version table"""
+
+    def __init__(self):
+        self.table_exists = False
+        self.version = None
+        self.queries = []
+
+    def connect(self):
+        return self._connection()
+
+    begin = connect
+
+    @asynccontextmanager
+    async def _connection(self):
+        yield self
+
+    async def scalar(self, statement, params=None):
+        self.queries.append(str(statement))
+        if not self.table_exists:
+            raise ProgrammingError(str(statement), params, Exception('relation "schema_version" does not exist'))
+        return self.version
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        self.queries.append(sql)
+        if "CREATE TABLE IF NOT EXISTS schema_version" in sql:
+            self.table_exists = True
+        elif "INSERT INTO schema_version" in sql:
+            self.version = params["version"]
+
+
+async def live_checks() -> list:
+    await database.init_db()
+    applied = await database.init_db()
+    return [("live: second init_db applies nothing", applied == 0)]
+
+
+async def test_startup():
+    """Check import side effects, migrations and parallel startup phases"""
+
+    print("=" * 80)
+    print("FAST STARTUP TEST")
+    print("=" * 80)
+
+    checks = []
+
+    # 1. Importing the bot does not import openai or create the LLM client
+    probe = subprocess.run(
+        [sys.executable, "-c", "import sys, src.bot, src.llm_engine as e; print('openai' in sys.modules, e.client)"],
+        capture_output=True, text=True
+    )
+    checks.append((f"no LLM client at import ({probe.stdout.strip() or probe.stderr.strip()[-200:]})",
+                   probe.stdout.strip() == "False None"))
+
+    # 2. Nor the database engine: it is created on first use by init_db / warm_pool
+    probe = subprocess.run(
+        [sys.executable, "-c", "import src.bot, src.database as d; print(d.replicas.primary._engine); "
+                               "d.get_engine(); print(d.replicas.primary._engine is d.get_engine())"],
+        capture_output=True, text=True
+    )
+    checks.append((f"no database engine at import ({probe.stdout.strip() or probe.stderr.strip()[-200:]})",
+                   probe.stdout.split() == ["None", "True"]))
+
+    # 3. Migrations are numbered 1..N and hold one command per statement
+    for name, migrations in (("primary", MIGRATIONS), ("shard", SHARD_MIGRATIONS)):
+        versions = [version for version, _, _ in migrations]
+        single = all(";" not in statement.strip().rstrip(";")
+                     for _, _, statements in migrations for statement in statements)
+        checks.append((f"{name} migrations {versions} well formed",
+                       versions == list(range(1, len(versions) + 1)) and single))
+
+    # 4. Empty database: all migrations applied and the version stored
+    db = FakeDatabase()
+    applied = await migrate(db, MIGRATIONS, "primary")
+    statements = sum(len(statements) for _, _, statements in MIGRATIONS)
+    checks.append((f"new database migrated to version {db.version} ({len(db.queries)} statements)",
+                   applied == len(MIGRATIONS) and db.version == SCHEMA_VERSION
+                   and len(db.queries) > statements))
+
+    # 5. Current schema: a single query, no DDL
+    db.queries.clear()
+    applied = await migrate(db, MIGRATIONS, "primary")
+    checks.append((f"current schema checked with {len(db.queries)} query", applied == 0 and len(db.queries) == 1))
+
+    # 6. Independent phases run concurrently and are all reported
+    timer = StartupTimer()
+    start = time.perf_counter()
+    results = await timer.parallel(
+        schema=asyncio.sleep(0.1, result="schema"),
+        db_pool=asyncio.sleep(0.1, result="pool"),
+        llm_client=asyncio.to_thread(time.sleep, 0.1),
+    )
+    elapsed = time.perf_counter() - start
+    report = timer.report()
+    print(report)
+    checks.append((f"phases run in parallel ({elapsed:.2f} s)",
+                   elapsed < 0.2 and results["schema"] == "schema"
+                   and all(name in report for name in ("schema", "db_pool", "llm_client"))))
+
+    checks.extend(await with_postgres("live schema checks", live_checks))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_startup())
+    exit(0 if success else 1)
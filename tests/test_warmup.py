@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Test cache pre-warming and re-warming on data version change - offline
+"""
+import asyncio
+import time
+from src import llm_engine, metrics, speculation, warmup
+from src.cache import answer_cache
+from src.config import settings
+from helpers import StubClient, summarize
+
+EXAMPLE_ARGS = {
+    "Сколько всего видео?": {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "id"},
+    "Сколько всего просмотров?": {"intent": "TOTAL_STATIC", "target_table": "videos", "metric_field": "views_count"},
+    "Сколько лайков прибавилось 28 ноября 2025?": {
+        "intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots",
+        "metric_field": "delta_likes_count", "date_exact": "2025-11-28"},
+    "Сколько комментариев было за 27 ноября 2025?": {
+        "intent": "GROWTH_DYNAMIC", "target_table": "video_snapshots",
+        "metric_field": "delta_comments_count", "date_exact": "2025-11-27"},
+}
+# A frequent shape from query_log that is not among the examples
+LOGGED_SHAPE = ("UNIQUE_ACTIVE", "video_snapshots", "delta_views_count", None)
+
+
+class StubDatabase:
+    """execute_scalar / execute_query stand-in with a data version and concurrency tracking"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.version = 1
+        self.queries = []
+        self.running = 0
+        self.max_running = 0
+
+    async def execute_scalar(self, sql: str, deadline=None):
+        if "data_version" in sql:
+            return self.version
+        self.queries.append(sql)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            if deadline is not None:
+                return await deadline.run(asyncio.sleep(self.delay, result=len(sql)), "SQL query")
+            await asyncio.sleep(self.delay)
+            return len(sql)
+        finally:
+            self.running -= 1
+
+    async def execute_query(self, sql: str):
+        return [LOGGED_SHAPE]
+
+
+async def test_warmup():
+    """Check warmup coverage, concurrency, budget and data version re-warm"""
+
+    print("=" * 80)
+    print("CACHE WARMUP TEST")
+    print("=" * 80)
+
+    checks = []
+    metrics.reset()
+    saved = (llm_engine.client, warmup.execute_scalar, warmup.execute_query, speculation.execute_scalar,
+             settings.warmup_budget, settings.warmup_poll_interval, settings.similarity_enabled)
+    database = StubDatabase()
+    try:
+        llm_engine.client = StubClient(lambda request: EXAMPLE_ARGS[request["messages"][-1]["content"]])
+        warmup.execute_scalar = speculation.execute_scalar = database.execute_scalar
+        warmup.execute_query = database.execute_query
+        settings.similarity_enabled = False
+        answer_cache.entries.clear()
+
+        # 1. Examples + logged shape x 4 date windows, at most warmup_concurrency at once
+        report = await warmup.warm()
+        checks.append((f"5 shapes x 4 windows cached ({report})",
+                       report["shapes"] == 5 and report["queries"] == 20 and len(answer_cache) == 20))
+        checks.append((f"concurrency bounded ({database.max_running})",
+                       1 < database.max_running <= settings.warmup_concurrency))
+
+        # 2. A popular question is now answered from the cache without the database
+        before = len(database.queries)
+        await speculation.answer("Сколько всего видео?")
+        checks.append(("warm question served from cache", len(database.queries) == before))
+
+        # 3. Budget: slow queries are cut off when warmup_budget runs out
+        answer_cache.entries.clear()
+        database.delay = 5.0
+        settings.warmup_budget = 0.3
+        start = time.perf_counter()
+        report = await warmup.warm()
+        elapsed = time.perf_counter() - start
+        checks.append((f"warmup stays within budget ({elapsed:.2f} s, {report['failed']} cut off)",
+                       elapsed < 0.6 and report["failed"] == 20))
+
+        # 4. New data version -> cache cleared and warmed again by the watcher
+        database.delay = 0.01
+        settings.warmup_budget = 20.0
+        settings.warmup_poll_interval = 0.05
+        answer_cache.data_version = None
+        await warmup.warmer.start()
+        stale = "SELECT 1"
+        answer_cache.put(stale, 1)
+        database.version = 2
+        await asyncio.sleep(0.3)
+        await warmup.warmer.stop()
+        checks.append(("data version change re-warms",
+                       stale not in answer_cache.entries and len(answer_cache) == 20
+                       and metrics.get_counter("warmup_runs_total", trigger="data_version") == 1))
+    finally:
+        (llm_engine.client, warmup.execute_scalar, warmup.execute_query, speculation.execute_scalar,
+         settings.warmup_budget, settings.warmup_poll_interval, settings.similarity_enabled) = saved
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_warmup())
+    exit(0 if success else 1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test webhook mode by POSTing synthetic Telegram updates to the local server
+"""
+import asyncio
+import time
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, types
+from src.webhook import build_app
+from helpers import summarize
+
+SECRET = "test-secret"
+PATH = "/webhook"
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Synthetic Telegram update with a text message"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": text
+        }
+    }
+
+
+async def test_webhook():
+    """Check secret verification, quick acknowledgement and concurrent processing"""
+
+    print("=" * 80)
+    print("WEBHOOK MODE TEST")
+    print("=" * 80)
+
+    # Separate dispatcher: the handler only records updates, no Telegram API calls
+    dp = Dispatcher()
+    handled = []
+
+    @dp.message()
+    async def slow_handler(message: types.Message):
+        await asyncio.sleep(0.5)
+        handled.append(message.text)
+
+    bot = Bot(token="123456:TEST-TOKEN")
+    client = TestClient(TestServer(build_app(dp, bot, PATH, SECRET)))
+    await client.start_server()
+
+    checks = []
+    try:
+        # 1. Wrong secret is rejected
+        response = await client.post(PATH, json=make_update(1, 1, "hi"),
+                                     headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+        checks.append(("wrong secret -> 401", response.status == 401))
+
+        # 2. Ten updates are acknowledged before the 0.5 s handler finishes
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post(PATH, json=make_update(i, 100 + i, f"question {i}"), headers=headers)
+            for i in range(10)
+        ))
+        ack_time = time.perf_counter() - start
+        checks.append(("all updates acknowledged", all(r.status == 200 for r in responses)))
+        checks.append((f"acknowledged quickly ({ack_time * 1000:.0f} ms)", ack_time < 0.5))
+
+        # 3. Updates are processed concurrently: ~0.5 s in total, not 5 s
+        await asyncio.sleep(1.0)
+        checks.append((f"processed concurrently ({len(handled)}/10)", len(handled) == 10))
+
+        # 4. Metrics endpoint
+        response = await client.get("/metrics")
+        body = await response.text()
+        checks.append(("/metrics exports webhook counters", "webhook_requests_total" in body))
+    finally:
+        await client.close()
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_webhook())
+    exit(0 if success else 1)
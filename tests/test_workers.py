@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test multi-process worker routing: chat affinity, in-chat ordering and per-worker profiling
+"""
+import asyncio
+import os
+import random
+import tempfile
+import time
+from src import profiler
+from src.config import settings
+from src.workers import ChatSequencer, pick_worker
+from helpers import summarize
+
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "hi"}
+    }
+
+
+async def test_workers():
+    """Check that a chat always maps to one worker and keeps message order"""
+
+    print("=" * 80)
+    print("WORKER ROUTING TEST")
+    print("=" * 80)
+
+    checks = []
+
+    # 1. Chat affinity: every update of a chat goes to the same worker
+    workers = 4
+    affinity = all(
+        len({pick_worker(make_update(u, chat_id), workers) for u in range(20)}) == 1
+        for chat_id in range(1, 200)
+    )
+    checks.append(("same chat -> same worker", affinity))
+
+    # 2. Spread: 1000 chats are distributed over all workers
+    load = [0] * workers
+    for chat_id in range(1000):
+        load[pick_worker(make_update(chat_id, chat_id), workers)] += 1
+    checks.append((f"chats spread across workers {load}", min(load) > 150))
+
+    # 3. Ordering within a chat, concurrency across chats
+    sequencer = ChatSequencer()
+    processed = {chat_id: [] for chat_id in range(10)}
+
+    async def handle(chat_id: int, n: int):
+        await asyncio.sleep(random.uniform(0, 0.02))
+        processed[chat_id].append(n)
+
+    start = time.perf_counter()
+    for n in range(10):
+        for chat_id in range(10):
+            sequencer.submit(chat_id, lambda chat_id=chat_id, n=n: handle(chat_id, n))
+    await asyncio.gather(*sequencer.tasks)
+    elapsed = time.perf_counter() - start
+
+    in_order = all(processed[chat_id] == list(range(10)) for chat_id in processed)
+    checks.append(("messages processed in order within each chat", in_order))
+    checks.append((f"chats processed concurrently ({elapsed * 1000:.0f} ms)", elapsed < 0.5))
+    checks.append(("idle chat locks released", not sequencer.locks and not sequencer.pending))
+
+    # 4. /profile in a worker samples that worker's loop and names it in the report
+    original_dir = settings.profiler_dir
+    with tempfile.TemporaryDirectory() as directory:
+        settings.profiler_dir = directory
+        try:
+            profiler.install("worker 2")
+            report = await profiler.profile(0.2)
+        finally:
+            settings.profiler_dir = original_dir
+    checks.append((f"worker profile labelled: {report['process']}",
+                   report["process"] == f"worker 2 (pid {os.getpid()})" and report["samples"] > 0
+                   and str(os.getpid()) in os.path.basename(report["path"])))
+
+    return summarize(checks)
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_workers())
+    exit(0 if success else 1)